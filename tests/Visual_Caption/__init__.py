@@ -0,0 +1,3 @@
+# -*- coding:utf-8 -*-
+# unit tests of numpy and file utilities of visual_caption, runnable without tensorflow:
+#     python -m pytest tests/Visual_Caption
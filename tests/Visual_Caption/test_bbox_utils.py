@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import unittest
+
+import numpy as np
+
+from visual_caption.utils import bbox_utils
+
+
+def _greedy_nms(boxes, scores, iou_threshold):
+    """reference nms comparing each pair of boxes"""
+    keep = list()
+    for index in sorted(range(len(scores)), key=lambda i: -scores[i]):
+        if all(bbox_utils.box_ious(boxes[index], boxes[[kept]])[0] <= iou_threshold for kept in keep):
+            keep.append(index)
+    return keep
+
+
+class BoxIousTest(unittest.TestCase):
+    def test_ious(self):
+        box = np.array([0, 0, 10, 10], dtype=np.float32)
+        boxes = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30], [0, 0, 0, 0]], dtype=np.float32)
+        np.testing.assert_allclose(bbox_utils.box_ious(box, boxes), [1.0, 50.0 / 150.0, 0.0, 0.0])
+
+    def test_areas_of_inverted_boxes(self):
+        boxes = np.array([[0, 0, 2, 3], [5, 5, 4, 8]], dtype=np.float32)
+        np.testing.assert_allclose(bbox_utils.box_areas(boxes), [6.0, 0.0])
+
+
+class NonMaxSuppressionTest(unittest.TestCase):
+    def test_overlapping_boxes(self):
+        boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [20, 20, 30, 30], [0, 0, 10, 9]])
+        scores = np.array([0.6, 0.9, 0.5, 0.8])
+        keep = bbox_utils.non_max_suppression(boxes, scores, iou_threshold=0.5)
+        self.assertEqual(keep.tolist(), [1, 2])
+        self.assertEqual(keep.dtype, np.int64)
+
+    def test_max_output(self):
+        boxes = np.array([[0, 0, 10, 10], [20, 20, 30, 30], [40, 40, 50, 50]])
+        scores = np.array([0.1, 0.3, 0.2])
+        self.assertEqual(bbox_utils.non_max_suppression(boxes, scores, 0.5, max_output=2).tolist(), [1, 2])
+        self.assertEqual(bbox_utils.non_max_suppression(boxes, scores, 0.5).tolist(), [1, 2, 0])
+
+    def test_empty(self):
+        keep = bbox_utils.non_max_suppression(np.zeros([0, 4]), np.zeros([0]), 0.5)
+        self.assertEqual(keep.shape, (0,))
+
+    def test_equal_scores_keep_input_order(self):
+        boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [20, 20, 30, 30]])
+        scores = np.array([0.5, 0.5, 0.5])
+        self.assertEqual(bbox_utils.non_max_suppression(boxes, scores, 0.5).tolist(), [0, 2])
+
+    def test_matches_reference(self):
+        rng = np.random.RandomState(0)
+        mins = rng.randint(0, 80, size=(200, 2))
+        boxes = np.concatenate([mins, mins + rng.randint(5, 40, size=(200, 2))], axis=1).astype(np.float32)
+        scores = rng.rand(200)
+        for iou_threshold in (0.3, 0.5, 0.7):
+            keep = bbox_utils.non_max_suppression(boxes, scores, iou_threshold)
+            self.assertEqual(keep.tolist(), _greedy_nms(boxes, scores, iou_threshold))
+
+
+class PaddedBoxesTest(unittest.TestCase):
+    def test_pixels_keep_their_position(self):
+        # crop_and_resize samples normalized y at y * (height - 1)
+        boxes = np.array([[0.0, 0.0, 1.0, 1.0], [0.25, 0.5, 0.75, 1.0]])
+        padded_boxes = bbox_utils.get_padded_boxes(boxes, (101, 201), (128, 256))
+        np.testing.assert_allclose(padded_boxes * [127, 255, 127, 255], boxes * [100, 200, 100, 200], atol=1e-4)
+        self.assertEqual(padded_boxes.dtype, np.float32)
+
+    def test_unpadded_and_single_pixel_images(self):
+        boxes = np.array([[0.1, 0.2, 0.3, 0.4]])
+        np.testing.assert_allclose(bbox_utils.get_padded_boxes(boxes, (64, 64), (64, 64)), boxes, rtol=1e-6)
+        self.assertEqual(bbox_utils.get_padded_boxes(np.zeros([0, 4]), (1, 1), (1, 1)).shape, (0, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
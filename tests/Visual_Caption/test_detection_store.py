@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from visual_caption.image_caption.data import detection_store
+from visual_caption.utils import jsonl_utils
+
+IMAGES = [
+    {"image_id": "a.jpg", "width": 640, "height": 480, "captions": ["一只猫"],
+     "bbox_boxes": [[1, 2, 30, 40], [5, 6, 70, 80]], "bbox_class_ids": [1, 17], "bbox_scores": [0.9, 0.25]},
+    {"image_id": "b.jpg", "width": 320, "height": 240, "captions": list(),
+     "bbox_boxes": np.zeros([0, 4], dtype=np.int32), "bbox_class_ids": list(), "bbox_scores": list()},
+    # bboxes dict list of earlier detection files
+    {"image_id": "c.jpg", "width": 100, "height": 100,
+     "bboxes": [{"x_min": 3, "y_min": 4, "x_max": 50, "y_max": 60, "class_id": 2, "confidence": 0.5}]},
+]
+
+
+class DetectionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.data_dir, "detect_train" + detection_store.STORE_SUFFIX)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _assert_image(self, image_data, expected):
+        boxes, class_ids, scores = detection_store._get_bbox_arrays(expected)
+        for key in ("image_id", "width", "height"):
+            self.assertEqual(image_data[key], expected[key])
+        self.assertNotIn("bboxes", image_data)
+        np.testing.assert_array_equal(image_data["bbox_boxes"], boxes)
+        np.testing.assert_array_equal(image_data["bbox_class_ids"], class_ids)
+        np.testing.assert_allclose(image_data["bbox_scores"], scores.astype(np.float32))
+        self.assertEqual(image_data["bbox_boxes"].shape, (len(boxes), 4))
+
+    def test_round_trip(self):
+        with detection_store.DetectionStoreWriter(self.store_dir) as writer:
+            for image_data in IMAGES:
+                writer.write(image_data)
+        self.assertTrue(detection_store.is_store(self.store_dir))
+        self.assertFalse(os.path.exists(self.store_dir + ".tmp"))
+
+        store = detection_store.DetectionStore(self.store_dir)
+        self.assertEqual(len(store), len(IMAGES))
+        self.assertEqual(store.header["num_boxes"], 3)
+        for index, expected in enumerate(IMAGES):
+            self._assert_image(store.get(index), expected)
+        self.assertEqual(store.get(0)["captions"], ["一只猫"])
+        self._assert_image(store.get_by_image_id("c.jpg"), IMAGES[2])
+        self.assertEqual([image_data["image_id"] for image_data in store], ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertEqual([image_data["image_id"] for image_data in store.iter_from(1)], ["b.jpg", "c.jpg"])
+        self.assertEqual(list(store.iter_from(3)), list())
+
+    def test_build_from_jsonl(self):
+        detected_data_file = os.path.join(self.data_dir, "detect_train.jsonl")
+        with jsonl_utils.JsonLinesWriter(detected_data_file) as writer:
+            for image_data in IMAGES:
+                writer.write(image_data)
+        self.assertEqual(detection_store.build_store(detected_data_file, self.store_dir), len(IMAGES))
+        store = detection_store.DetectionStore(self.store_dir)
+        for index, expected in enumerate(IMAGES):
+            self._assert_image(store.get(index), expected)
+
+        json_file = os.path.join(self.data_dir, "detect_train.json")
+        detection_store.export_json(self.store_dir, json_file)
+        with open(json_file, mode='r') as f:
+            exported = json.load(f)
+        self.assertEqual([image_data["image_id"] for image_data in exported], ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertEqual(exported[0]["bbox_boxes"], [[1, 2, 30, 40], [5, 6, 70, 80]])
+
+    def test_empty_store(self):
+        with detection_store.DetectionStoreWriter(self.store_dir):
+            pass
+        store = detection_store.DetectionStore(self.store_dir)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), list())
+
+    def test_failed_write_keeps_previous_store(self):
+        with detection_store.DetectionStoreWriter(self.store_dir) as writer:
+            writer.write(IMAGES[0])
+        with self.assertRaises(RuntimeError):
+            with detection_store.DetectionStoreWriter(self.store_dir) as writer:
+                writer.write(IMAGES[1])
+                raise RuntimeError("interrupted")
+        store = detection_store.DetectionStore(self.store_dir)
+        self.assertEqual([image_data["image_id"] for image_data in store], ["a.jpg"])
+
+
+if __name__ == '__main__':
+    unittest.main()
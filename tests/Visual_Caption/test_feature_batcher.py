@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import unittest
+
+import numpy as np
+
+from visual_caption.image_caption.feature.feature_batcher import FeatureBatcher
+
+
+class _FakeExtractor(object):
+    """features of a crop are the image value and the first coordinate of its box"""
+
+    def __init__(self):
+        self.runs = list()
+
+    def extract(self, images, boxes_list):
+        self.runs.append([len(boxes) for boxes in boxes_list])
+        return [np.stack([np.full(len(boxes), image, dtype=np.float32), boxes[:, 0]], axis=1)
+                for image, boxes in zip(images, boxes_list)]
+
+
+def _get_boxes(num_boxes):
+    return np.stack([np.arange(num_boxes) / 10.0] + [np.ones(num_boxes)] * 3, axis=1)
+
+
+class FeatureBatcherTest(unittest.TestCase):
+    def _run(self, num_boxes_list, batch_size, split_images):
+        """:return: list of (item, features) in the order they are completed, list of crops of each run"""
+        extractor = _FakeExtractor()
+        batcher = FeatureBatcher(extractor.extract, batch_size=batch_size, split_images=split_images)
+        completed = list()
+        for index, num_boxes in enumerate(num_boxes_list):
+            image = None if num_boxes is None else index
+            completed.extend(batcher.add(index, image, _get_boxes(num_boxes or 0)))
+        completed.extend(batcher.flush())
+        self.assertEqual(batcher.get_stats()["num_runs"], len(extractor.runs))
+        return completed, extractor.runs
+
+    def _assert_features(self, completed, num_boxes_list):
+        self.assertEqual([item for item, _ in completed], list(range(len(num_boxes_list))))
+        for (item, features), num_boxes in zip(completed, num_boxes_list):
+            if num_boxes is None:
+                self.assertIsNone(features)
+                continue
+            expected = np.stack([np.full(num_boxes, item), np.arange(num_boxes) / 10.0], axis=1)
+            np.testing.assert_allclose(features, expected, rtol=1e-6)
+
+    def test_split_images(self):
+        num_boxes_list = [3, 7, 2, 5, 1]
+        completed, runs = self._run(num_boxes_list, batch_size=4, split_images=True)
+        self._assert_features(completed, num_boxes_list)
+        # every run but the last is full, crops of one image span runs
+        self.assertEqual([sum(run) for run in runs], [4, 4, 4, 4, 2])
+        self.assertEqual(runs[0], [3, 1])
+
+    def test_whole_images(self):
+        num_boxes_list = [3, 7, 2, 5, 1]
+        completed, runs = self._run(num_boxes_list, batch_size=2, split_images=False)
+        self._assert_features(completed, num_boxes_list)
+        self.assertEqual(runs, [[3, 7], [2, 5], [1]])
+
+    def test_items_without_features_keep_order(self):
+        num_boxes_list = [None, 2, None, 3, None]
+        completed, runs = self._run(num_boxes_list, batch_size=4, split_images=True)
+        self._assert_features(completed, num_boxes_list)
+        self.assertEqual([sum(run) for run in runs], [4, 1])
+
+    def test_items_are_returned_when_completed(self):
+        extractor = _FakeExtractor()
+        batcher = FeatureBatcher(extractor.extract, batch_size=4)
+        self.assertEqual(batcher.add("a", 0, _get_boxes(2)), list())
+        # the first run completes a and part of b
+        self.assertEqual([item for item, _ in batcher.add("b", 1, _get_boxes(3))], ["a"])
+        self.assertEqual([item for item, _ in batcher.add("c", None, None)], list())
+        self.assertEqual([item for item, _ in batcher.flush()], ["b", "c"])
+        self.assertEqual(batcher.flush(), list())
+
+
+if __name__ == '__main__':
+    unittest.main()
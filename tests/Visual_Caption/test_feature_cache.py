@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from visual_caption.utils import feature_cache
+
+
+def _get_value(seed):
+    return {"features": np.random.RandomState(seed).rand(64).astype(np.float32), "num_boxes": seed}
+
+
+class FeatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.caches = list()
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.cache_dir)
+
+    def _get_cache(self, **kwargs):
+        kwargs.setdefault("refresh_interval", 0.0)
+        cache = feature_cache.FeatureCache(self.cache_dir, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def _set_mtime(self, cache, key, mtime):
+        segment = cache._index[key][0]
+        os.utime(cache._get_path(segment, feature_cache.SEGMENT_SUFFIX), (mtime, mtime))
+
+    def _get_entry_bytes(self):
+        cache = feature_cache.FeatureCache(tempfile.mkdtemp())
+        cache.put("key", _get_value(0))
+        cache.close()
+        shutil.rmtree(cache.cache_dir)
+        return cache.total_bytes
+
+    def test_make_key(self):
+        key = feature_cache.make_key("region_feature", "hash", "model:1:2", {"crop_size": [299, 299]})
+        self.assertEqual(key, feature_cache.make_key("region_feature", "hash", "model:1:2",
+                                                     {"crop_size": (299, 299)}))
+        self.assertNotEqual(key, feature_cache.make_key("region_feature", "hash", "model:1:2",
+                                                        {"crop_size": [224, 224]}))
+        self.assertNotEqual(key, feature_cache.make_key("image_feature", "hash", "model:1:2",
+                                                        {"crop_size": [299, 299]}))
+        self.assertEqual(feature_cache.get_bytes_hash(b'jpeg'), feature_cache.get_bytes_hash(b'jpeg'))
+
+    def test_round_trip(self):
+        cache = self._get_cache()
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", _get_value(3))
+        value = cache.get("key")
+        np.testing.assert_array_equal(value["features"], _get_value(3)["features"])
+        self.assertEqual(value["num_boxes"], 3)
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["puts"], stats["num_entries"]), (1, 1, 1, 1))
+
+    def test_entries_share_segments(self):
+        cache = self._get_cache()
+        for seed in range(10):
+            cache.put("key{}".format(seed), _get_value(seed))
+        self.assertEqual(cache.get_stats()["num_segments"], 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)  # one segment and its index
+        for seed in range(10):
+            self.assertEqual(cache.get("key{}".format(seed))["num_boxes"], seed)
+
+    def test_entries_of_other_caches(self):
+        writer = self._get_cache()
+        reader = self._get_cache()
+        writer.put("key", _get_value(1))
+        self.assertEqual(reader.get("key")["num_boxes"], 1)
+        writer.close()
+        # a reopened cache loads the indexes of the cache dir
+        self.assertEqual(self._get_cache().get("key")["num_boxes"], 1)
+
+    def test_evict_least_recently_used_segments(self):
+        entry_bytes = self._get_entry_bytes()
+        # each entry is written into a segment of its own
+        cache = self._get_cache(max_bytes=int(3.5 * entry_bytes), segment_bytes=1)
+        cache.put("key0", _get_value(0))
+        cache.put("key1", _get_value(1))
+        self._set_mtime(cache, "key0", 100)
+        self._set_mtime(cache, "key1", 200)
+        self.assertIsNotNone(cache.get("key0"))  # key0 becomes the most recently used
+        cache.put("key2", _get_value(2))
+        self.assertEqual(cache.get_stats()["evictions"], 0)
+        cache.put("key3", _get_value(3))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertIsNone(cache.get("key1"))
+        for key in ("key0", "key2", "key3"):
+            self.assertIsNotNone(cache.get(key))
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+    def test_eviction_is_shared(self):
+        entry_bytes = self._get_entry_bytes()
+        other = self._get_cache(segment_bytes=1)
+        other.put("key0", _get_value(0))
+        self._set_mtime(other, "key0", 100)
+        cache = self._get_cache(max_bytes=int(1.5 * entry_bytes), segment_bytes=1)
+        cache.put("key1", _get_value(1))
+        # the segment of the other cache counts against the budget and is evicted
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertIsNone(other.get("key0"))
+        self.assertIsNotNone(other.get("key1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
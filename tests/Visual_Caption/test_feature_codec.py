@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import unittest
+
+import numpy as np
+
+from visual_caption.utils import feature_codec
+
+
+def _get_features(num_vectors, dim=1536, seed=0):
+    features = np.random.RandomState(seed).randn(num_vectors, dim).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+class FeatureCodecTest(unittest.TestCase):
+    def test_float32(self):
+        features = _get_features(3)
+        values, scales = feature_codec.encode_features(features, 'float32')
+        self.assertIsNone(scales)
+        np.testing.assert_array_equal(feature_codec.decode_features(values, scales), features)
+
+    def test_float16(self):
+        features = _get_features(3)
+        values, scales = feature_codec.encode_features(features, 'float16')
+        self.assertEqual(values.dtype, np.float16)
+        self.assertIsNone(scales)
+        decoded = feature_codec.decode_features(values)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, features, atol=1e-4)
+
+    def test_int8(self):
+        features = _get_features(5)
+        values, scales = feature_codec.encode_features(features, 'int8')
+        self.assertEqual(values.dtype, np.int8)
+        self.assertEqual(values.shape, features.shape)
+        self.assertEqual(scales.shape, (5,))
+        self.assertEqual(scales.dtype, np.float32)
+        # the largest value of each vector is stored as +-127
+        np.testing.assert_array_equal(np.max(np.abs(values), axis=1), feature_codec.INT8_MAX)
+        decoded = feature_codec.decode_features(values, scales)
+        # rounding error is at most half a step of the scale
+        self.assertTrue(np.all(np.abs(decoded - features) <= scales[:, np.newaxis] / 2 + 1e-7))
+        cosines = np.sum(decoded * features, axis=1) / np.linalg.norm(decoded, axis=1)
+        self.assertGreater(np.min(cosines), 0.999)
+
+    def test_int8_single_and_zero_vectors(self):
+        feature = _get_features(1)[0]
+        values, scales = feature_codec.encode_features(feature, 'int8')
+        self.assertEqual(values.shape, feature.shape)
+        self.assertEqual(scales.shape, (1,))
+        np.testing.assert_allclose(feature_codec.decode_features(values, scales), feature, atol=scales[0])
+
+        values, scales = feature_codec.encode_features(np.zeros([2, 8]), 'int8')
+        np.testing.assert_array_equal(feature_codec.decode_features(values, scales), np.zeros([2, 8]))
+
+    def test_unknown_dtype(self):
+        with self.assertRaises(ValueError):
+            feature_codec.encode_features(_get_features(1), 'int4')
+
+
+if __name__ == '__main__':
+    unittest.main()
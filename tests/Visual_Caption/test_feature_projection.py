@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from visual_caption.utils import feature_projection
+
+
+def _get_low_rank_features(num_vectors=500, dim=64, rank=8, seed=0):
+    """features of a rank subspace with a small noise, shifted off the origin"""
+    rng = np.random.RandomState(seed)
+    features = np.dot(rng.randn(num_vectors, rank), rng.randn(rank, dim)) + 0.01 * rng.randn(num_vectors, dim)
+    return (features + 3.0).astype(np.float32)
+
+
+class FeatureProjectionTest(unittest.TestCase):
+    def test_pca(self):
+        features = _get_low_rank_features()
+        projection = feature_projection.fit_projection(features, 8, method='pca')
+        self.assertEqual(projection["matrix"].shape, (64, 8))
+        self.assertEqual(projection["matrix"].dtype, np.float32)
+        np.testing.assert_allclose(projection["mean"], np.mean(features, axis=0), rtol=1e-5)
+        # the rank of the sample is kept
+        self.assertGreater(projection["explained_variance"], 0.99)
+        np.testing.assert_allclose(np.dot(projection["matrix"].T, projection["matrix"]), np.eye(8), atol=1e-5)
+
+        projected = feature_projection.project(features, projection)
+        self.assertEqual(projected.shape, (500, 8))
+        self.assertEqual(projected.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(projected, axis=1), 1.0, rtol=1e-5)
+        # projecting a single vector is the same as projecting it in a batch
+        np.testing.assert_allclose(feature_projection.project(features[3], projection), projected[3], atol=1e-6)
+
+    def test_random(self):
+        features = _get_low_rank_features()
+        projection = feature_projection.fit_projection(features, 16, method='random', seed=1)
+        self.assertIsNone(projection["explained_variance"])
+        np.testing.assert_array_equal(projection["mean"], np.zeros(64))
+        np.testing.assert_array_equal(
+            projection["matrix"], feature_projection.fit_projection(features, 16, method='random', seed=1)["matrix"])
+        self.assertEqual(feature_projection.project(features, projection).shape, (500, 16))
+
+    def test_invalid_params(self):
+        features = _get_low_rank_features()
+        with self.assertRaises(ValueError):
+            feature_projection.fit_projection(features, 65)
+        with self.assertRaises(ValueError):
+            feature_projection.fit_projection(features, 8, method='svd')
+
+    def test_save_and_load(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            features = _get_low_rank_features()
+            for method in feature_projection.PROJECTION_METHODS:
+                projection = feature_projection.fit_projection(features, 8, method=method)
+                projection_file = os.path.join(data_dir, "feature_projection_{}.npz".format(method))
+                feature_projection.save_projection(projection, projection_file)
+                loaded = feature_projection.load_projection(projection_file)
+                self.assertEqual(feature_projection.get_projection_info(loaded),
+                                 feature_projection.get_projection_info(projection))
+                np.testing.assert_array_equal(feature_projection.project(features, loaded),
+                                              feature_projection.project(features, projection))
+            self.assertEqual(feature_projection.get_projection_info(loaded),
+                             {"method": "random", "dim_in": 64, "dim_out": 8, "explained_variance": None})
+        finally:
+            shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
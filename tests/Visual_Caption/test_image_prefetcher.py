@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import random
+import threading
+import time
+import unittest
+
+from visual_caption.utils.image_prefetcher import ImagePrefetcher
+
+
+def _slow_load(item):
+    """items finish decoding out of order"""
+    time.sleep(random.uniform(0, 0.01))
+    return item * 10
+
+
+class ImagePrefetcherTest(unittest.TestCase):
+    def test_order(self):
+        items = list(range(50))
+        with ImagePrefetcher(items, load_fn=_slow_load, num_threads=4, queue_size=8) as prefetcher:
+            results = list(prefetcher)
+        self.assertEqual([(item, item * 10) for item in items], results)
+        stats = prefetcher.get_stats()
+        self.assertEqual(len(items), stats["num_images"])
+        self.assertEqual(0, stats["queue_depth"])
+
+    def test_generator_items(self):
+        with ImagePrefetcher((item for item in range(5)), load_fn=_slow_load) as prefetcher:
+            self.assertEqual([0, 1, 2, 3, 4], [item for item, _ in prefetcher])
+
+    def test_empty(self):
+        with ImagePrefetcher([], load_fn=_slow_load) as prefetcher:
+            self.assertEqual([], list(prefetcher))
+
+    def test_load_error(self):
+        def load_fn(item):
+            if item == 3:
+                raise IOError("broken image {}".format(item))
+            return item
+
+        results = list()
+        with ImagePrefetcher(range(10), load_fn=load_fn, num_threads=2) as prefetcher:
+            with self.assertRaises(IOError):
+                for item, image in prefetcher:
+                    results.append(item)
+        self.assertEqual([0, 1, 2], results)
+
+    def test_items_error(self):
+        def items():
+            yield 0
+            yield 1
+            raise ValueError("bad item file")
+
+        results = list()
+        with ImagePrefetcher(items(), load_fn=_slow_load) as prefetcher:
+            with self.assertRaises(ValueError):
+                for item, image in prefetcher:
+                    results.append(item)
+        self.assertEqual([0, 1], results)
+
+    def test_close_before_end(self):
+        # the producer blocked on a full queue of an endless item stream stops on close
+        loaded = list()
+
+        def load_fn(item):
+            loaded.append(item)
+            return item
+
+        def endless_items():
+            item = 0
+            while True:
+                yield item
+                item += 1
+
+        num_threads = threading.active_count()
+        prefetcher = ImagePrefetcher(endless_items(), load_fn=load_fn, num_threads=2, queue_size=4)
+        for item, image in prefetcher:
+            if item == 2:
+                break
+        prefetcher.close()
+        self.assertFalse(prefetcher._producer.is_alive())
+        # loading stays bounded by the queue size ahead of the consumer
+        self.assertLessEqual(len(loaded), 3 + 4 + 2)
+        self.assertEqual(num_threads, threading.active_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from visual_caption.utils import image_source
+
+
+class ImageSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.image_dir = os.path.join(self.data_dir, "images")
+        os.makedirs(self.image_dir)
+        self.images = dict()
+        for idx in range(5):
+            name = "{:04d}.jpg".format(idx)
+            self.images[name] = os.urandom(100 + 37 * idx)
+            with open(os.path.join(self.image_dir, name), mode='wb') as f:
+                f.write(self.images[name])
+        self.names = sorted(self.images)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _make_zip(self):
+        zip_file = os.path.join(self.data_dir, "images.zip")
+        with zipfile.ZipFile(zip_file, mode='w') as f:
+            for name in self.names:
+                f.write(os.path.join(self.image_dir, name), arcname="train/" + name)
+        return zip_file
+
+    def _make_tar(self, file_name, mode):
+        tar_file = os.path.join(self.data_dir, file_name)
+        with tarfile.open(tar_file, mode=mode) as tar:
+            for name in self.names:
+                tar.add(os.path.join(self.image_dir, name), arcname="train/" + name)
+        return tar_file
+
+    def _assert_source(self, source, source_type):
+        self.assertIsInstance(source, source_type)
+        self.assertEqual(self.names, source.list_names())
+        for name in self.names:
+            self.assertIn(name, source)
+            self.assertEqual(self.images[name], source.read(name))
+        self.assertNotIn("missing.jpg", source)
+        self.assertEqual(sorted(self.images.items()), list(source.iter_items()))
+
+    def test_dir(self):
+        source = image_source.get_image_source(self.image_dir)
+        self._assert_source(source, image_source.DirImageSource)
+        with self.assertRaises(KeyError):
+            source.read("missing.jpg")
+
+    def test_zip(self):
+        source = image_source.get_image_source(self._make_zip())
+        self._assert_source(source, image_source.ZipImageSource)
+        source.close()
+
+    def test_tar(self):
+        source = image_source.get_image_source(self._make_tar("images.tar", 'w'))
+        self._assert_source(source, image_source.TarImageSource)
+        source.close()
+
+    def test_compressed_tar(self):
+        for file_name, mode in [("images.tar.gz", 'w:gz'), ("images.tar.bz2", 'w:bz2')]:
+            source = image_source.get_image_source(self._make_tar(file_name, mode))
+            self.assertIsInstance(source, image_source.CompressedTarImageSource)
+            self.assertEqual(self.names, source.list_names())
+            self.assertIn(self.names[0], source)
+            self.assertEqual(sorted(self.images.items()), list(source.iter_items()))
+            with self.assertRaises(ValueError):
+                source.read(self.names[0])
+
+    def test_blob(self):
+        blob_dir = os.path.join(self.data_dir, "blobs")
+        tar_source = image_source.get_image_source(self._make_tar("images.tar.gz", 'w:gz'))
+        # a small shard size puts the images into several shards
+        count = image_source.pack_blob_shards(tar_source, blob_dir, shard_bytes=250)
+        self.assertEqual(len(self.names), count)
+        self.assertTrue(image_source.is_blob_dir(blob_dir))
+        shards = [name for name in os.listdir(blob_dir) if name.endswith(image_source.BLOB_SUFFIX)]
+        self.assertGreater(len(shards), 1)
+        source = image_source.get_image_source(blob_dir)
+        self._assert_source(source, image_source.BlobImageSource)
+        source.close()
+
+    def test_unknown_source(self):
+        unknown_file = os.path.join(self.data_dir, "images.txt")
+        with open(unknown_file, mode='w') as f:
+            f.write("not an archive")
+        with self.assertRaises(ValueError):
+            image_source.get_image_source(unknown_file)
+
+    def test_read_image_file(self):
+        zip_file = self._make_zip()
+        tar_file = self._make_tar("images.tar", 'w')
+        name = self.names[2]
+        # plain files, then paths inside archives
+        self.assertEqual(self.images[name], image_source.read_image_file(os.path.join(self.image_dir, name)))
+        self.assertEqual(self.images[name], image_source.read_image_file(os.path.join(zip_file, name)))
+        self.assertEqual(self.images[name], image_source.read_image_file(os.path.join(tar_file, name)))
+        self.assertEqual(self.images[name], image_source.open_image_file(os.path.join(zip_file, name)).read())
+        with self.assertRaises(KeyError):
+            image_source.read_image_file(os.path.join(zip_file, "missing.jpg"))
+
+
+if __name__ == '__main__':
+    unittest.main()
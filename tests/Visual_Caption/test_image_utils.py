@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from visual_caption.utils import image_utils
+
+
+def _two_color_image(height, width):
+    """red top half and blue bottom half, the left quarter of the top half is green"""
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:height // 2, :, 0] = 255
+    image[:height // 2, :width // 4] = [0, 255, 0]
+    image[height // 2:, :, 2] = 255
+    return image
+
+
+class DecodeImageTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.jpeg_file = os.path.join(self.data_dir, "wide.jpg")
+        Image.fromarray(_two_color_image(600, 800)).save(self.jpeg_file, quality=95)
+        self.png_file = os.path.join(self.data_dir, "wide.png")
+        Image.fromarray(_two_color_image(600, 800)).save(self.png_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _assert_orientation(self, image):
+        (height, width) = image.shape[:2]
+        top_right = image[height // 4, width * 3 // 4].astype(np.int32)
+        top_left = image[height // 4, width // 8].astype(np.int32)
+        bottom = image[height * 3 // 4, width // 2].astype(np.int32)
+        self.assertGreater(top_right[0], 200)
+        self.assertGreater(top_left[1], 200)
+        self.assertGreater(bottom[2], 200)
+        self.assertLess(bottom[0], 60)
+
+    def test_full_size(self):
+        image, original_shape = image_utils.decode_image(self.jpeg_file)
+        self.assertEqual((600, 800, 3), image.shape)
+        self.assertEqual(np.uint8, image.dtype)
+        self.assertEqual((600, 800, 3), original_shape)
+        self._assert_orientation(image)
+
+    def test_draft_scale(self):
+        # 1/4 of the DCT scale keeps the shorter side at 150
+        image, original_shape = image_utils.decode_image(self.jpeg_file, min_size=150)
+        self.assertEqual((150, 200, 3), image.shape)
+        self.assertEqual((600, 800, 3), original_shape)
+        self._assert_orientation(image)
+
+    def test_draft_keeps_min_size(self):
+        # 1/8 would give a shorter side of 75, so 1/4 is used
+        image, _ = image_utils.decode_image(self.jpeg_file, min_size=100)
+        self.assertEqual((150, 200, 3), image.shape)
+        image, _ = image_utils.decode_image(self.jpeg_file, min_size=1000)
+        self.assertEqual((600, 800, 3), image.shape)
+
+    def test_png_is_not_scaled(self):
+        image, original_shape = image_utils.decode_image(self.png_file, min_size=150)
+        self.assertEqual((600, 800, 3), image.shape)
+        self.assertEqual((600, 800, 3), original_shape)
+        self._assert_orientation(image)
+
+    def test_gray_to_rgb(self):
+        gray_file = os.path.join(self.data_dir, "gray.jpg")
+        Image.fromarray(np.full((40, 60), 128, dtype=np.uint8)).save(gray_file)
+        image = image_utils.load_image(gray_file)
+        self.assertEqual((40, 60, 3), image.shape)
+
+    def test_load_resized_image(self):
+        image = image_utils.load_resized_image(self.jpeg_file, (299, 299))
+        self.assertEqual((299, 299, 3), image.shape)
+        image = image_utils.load_resized_image(self.jpeg_file, (90, 120))
+        self.assertEqual((90, 120, 3), image.shape)
+        self._assert_orientation(image)
+
+    def test_resize_image(self):
+        image = _two_color_image(60, 80)
+        self.assertIs(image, image_utils.resize_image(image, (60, 80)))
+        resized = image_utils.resize_image(image, (30, 40))
+        self.assertEqual((30, 40, 3), resized.shape)
+        self._assert_orientation(resized)
+
+    def test_decode_from_zip(self):
+        zip_file = os.path.join(self.data_dir, "images.zip")
+        with zipfile.ZipFile(zip_file, mode='w') as f:
+            f.write(self.jpeg_file, arcname="images/wide.jpg")
+        image, original_shape = image_utils.decode_image(os.path.join(zip_file, "wide.jpg"), min_size=150)
+        self.assertEqual((150, 200, 3), image.shape)
+        self.assertEqual((600, 800, 3), original_shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from visual_caption.utils import jsonl_utils, shard_utils
+
+
+class JsonLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.data_dir, "detect_train.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _write_records(self, file_path, image_ids):
+        with jsonl_utils.JsonLinesWriter(file_path, flush_every=2) as writer:
+            for image_id in image_ids:
+                writer.write({"image_id": image_id, "boxes": np.arange(4, dtype=np.int32)})
+
+    def _load_image_ids(self, file_path, start=0):
+        return [record["image_id"] for record in jsonl_utils.load_jsonl_generator(file_path, start=start)]
+
+    def test_round_trip(self):
+        self._write_records(self.file_path, ["a.jpg", "b.jpg", "c.jpg"])
+        records = list(jsonl_utils.load_jsonl_generator(self.file_path))
+        self.assertEqual([record["image_id"] for record in records], ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertEqual(records[0]["boxes"], [0, 1, 2, 3])
+        self.assertEqual(self._load_image_ids(self.file_path, start=2), ["c.jpg"])
+        self.assertEqual(jsonl_utils.count_jsonl_records(self.file_path), 3)
+        self.assertEqual(jsonl_utils.load_jsonl_keys(self.file_path, "image_id"), {"a.jpg", "b.jpg", "c.jpg"})
+
+    def test_truncate_partial_line(self):
+        self._write_records(self.file_path, ["a.jpg", "b.jpg"])
+        size = os.path.getsize(self.file_path)
+        with open(self.file_path, mode='ab') as f:
+            f.write(b'{"image_id": "c.j')
+        # the partial line is skipped by readers and dropped by truncation
+        self.assertEqual(self._load_image_ids(self.file_path), ["a.jpg", "b.jpg"])
+        self.assertEqual(jsonl_utils.count_jsonl_records(self.file_path), 2)
+        self.assertEqual(jsonl_utils.truncate_partial_line(self.file_path, block_size=4), len(b'{"image_id": "c.j'))
+        self.assertEqual(os.path.getsize(self.file_path), size)
+        self.assertEqual(jsonl_utils.truncate_partial_line(self.file_path), 0)
+
+    def test_truncate_single_partial_line(self):
+        with open(self.file_path, mode='wb') as f:
+            f.write(b'{"image_id"')
+        self.assertEqual(jsonl_utils.truncate_partial_line(self.file_path), len(b'{"image_id"'))
+        self.assertEqual(os.path.getsize(self.file_path), 0)
+        self.assertEqual(jsonl_utils.truncate_partial_line(os.path.join(self.data_dir, "missing.jsonl")), 0)
+
+    def test_writer_resumes_after_partial_line(self):
+        self._write_records(self.file_path, ["a.jpg"])
+        with open(self.file_path, mode='ab') as f:
+            f.write(b'{"image_id": "b.j')
+        self._write_records(self.file_path, ["b.jpg"])
+        self.assertEqual(self._load_image_ids(self.file_path), ["a.jpg", "b.jpg"])
+
+    def test_merge_part_files(self):
+        part_files = [shard_utils.get_part_file(self.file_path, shard_index, 3) for shard_index in range(3)]
+        self._write_records(self.file_path, ["a.jpg"])
+        self._write_records(part_files[0], ["b.jpg", "c.jpg"])
+        # the second part was not written, the last part was interrupted
+        self._write_records(part_files[2], ["d.jpg"])
+        with open(part_files[2], mode='ab') as f:
+            f.write(b'{"image_id": "e.j')
+        jsonl_utils.merge_jsonl_files(part_files, self.file_path)
+        self.assertEqual(self._load_image_ids(self.file_path), ["a.jpg", "b.jpg", "c.jpg", "d.jpg"])
+        for part_file in part_files:
+            self.assertFalse(os.path.exists(part_file))
+        self.assertFalse(os.path.exists(self.file_path + ".tmp"))
+
+    def test_merge_resumed_target_in_input_order(self):
+        image_ids = ["{}.jpg".format(index) for index in range(9)]
+        part_files = [shard_utils.get_part_file(self.file_path, shard_index, 3) for shard_index in range(3)]
+        # the target of an interrupted run holds the first images of each shard,
+        # the resumed workers write the remaining ones into their parts
+        self._write_records(self.file_path, ["0.jpg", "3.jpg", "4.jpg", "6.jpg"])
+        self._write_records(part_files[0], ["1.jpg", "2.jpg"])
+        self._write_records(part_files[1], ["5.jpg"])
+        self._write_records(part_files[2], ["7.jpg", "8.jpg"])
+        with open(part_files[2], mode='ab') as f:
+            f.write(b'{"image_id": "9.j')
+        jsonl_utils.merge_jsonl_files(part_files, self.file_path,
+                                      sort_key=lambda record: image_ids.index(record["image_id"]))
+        self.assertEqual(self._load_image_ids(self.file_path), image_ids)
+        for part_file in part_files:
+            self.assertFalse(os.path.exists(part_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
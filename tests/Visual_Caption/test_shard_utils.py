@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from visual_caption.utils import shard_utils
+
+
+class ShardRangesTest(unittest.TestCase):
+    def test_shard_ranges_cover_items(self):
+        for num_items, num_shards in [(10, 3), (3, 5), (0, 2), (64, 64)]:
+            shard_ranges = shard_utils.get_shard_ranges(num_items, num_shards)
+            self.assertEqual([shard_index for shard_index, _, _ in shard_ranges], list(range(num_shards)))
+            self.assertEqual(shard_ranges[0][1], 0)
+            self.assertEqual(shard_ranges[-1][2], num_items)
+            for (_, _, end), (_, start, _) in zip(shard_ranges[:-1], shard_ranges[1:]):
+                self.assertEqual(end, start)
+            sizes = [end - start for _, start, end in shard_ranges]
+            self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_worker_blocks_are_contiguous(self):
+        shard_ranges = shard_utils.get_shard_ranges(100, 10)
+        blocks = shard_utils.get_worker_blocks(shard_ranges, 3)
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual([len(block) for block in blocks], [3, 3, 4])
+        self.assertEqual([shard_range for block in blocks for shard_range in block], shard_ranges)
+        for block in blocks:
+            for (_, _, end), (_, start, _) in zip(block[:-1], block[1:]):
+                self.assertEqual(end, start)
+
+    def test_more_workers_than_shards(self):
+        blocks = shard_utils.get_worker_blocks(shard_utils.get_shard_ranges(10, 2), 4)
+        self.assertEqual(sum(len(block) for block in blocks), 2)
+
+
+class DoneMarkerTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.shard_file = os.path.join(self.data_dir, shard_utils.get_shard_name("train", 0, 1))
+        with open(self.shard_file, mode='wb') as f:
+            f.write(b'records')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file))
+        shard_info = shard_utils.get_shard_info(self.shard_file, num_records=3)
+        shard_utils.write_done_marker(self.shard_file, shard_info)
+        self.assertEqual(shard_utils.load_done_marker(self.shard_file), shard_info)
+
+    def test_changed_shard_is_unfinished(self):
+        shard_utils.write_done_marker(self.shard_file, shard_utils.get_shard_info(self.shard_file, 3))
+        with open(self.shard_file, mode='ab') as f:
+            f.write(b'more records')
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file))
+
+    def test_missing_shard_is_unfinished(self):
+        shard_utils.write_done_marker(self.shard_file, shard_utils.get_shard_info(self.shard_file, 3))
+        os.remove(self.shard_file)
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file))
+
+    def test_build_params(self):
+        build_params = {"feature_dtype": "int8", "dim_visual_feature": 512, "crop_size": (299, 299)}
+        shard_utils.write_done_marker(self.shard_file, shard_utils.get_shard_info(self.shard_file, 3),
+                                      build_params=build_params)
+        self.assertIsNotNone(shard_utils.load_done_marker(self.shard_file, build_params=build_params))
+        self.assertNotIn("build_params", shard_utils.load_done_marker(self.shard_file, build_params=build_params))
+        # a shard built with other params is rebuilt
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file, build_params=dict(
+            build_params, feature_dtype="float16")))
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file))
+
+    def test_marker_without_build_params(self):
+        # markers written before build params were recorded only match builds without params
+        shard_utils.write_done_marker(self.shard_file, shard_utils.get_shard_info(self.shard_file, 3))
+        self.assertIsNone(shard_utils.load_done_marker(self.shard_file, build_params={"feature_dtype": "float32"}))
+
+    def test_file_identity(self):
+        identity = shard_utils.get_file_identity(self.shard_file)
+        self.assertEqual(identity["size"], len(b'records'))
+        self.assertEqual(shard_utils.get_file_identity(self.shard_file), identity)
+        with open(self.shard_file, mode='ab') as f:
+            f.write(b'more records')
+        self.assertNotEqual(shard_utils.get_file_identity(self.shard_file), identity)
+        self.assertIsNone(shard_utils.get_file_identity(os.path.join(self.data_dir, "missing")))
+
+    def test_manifest(self):
+        shard_info = shard_utils.get_shard_info(self.shard_file, num_records=3)
+        shard_utils.write_manifest(self.data_dir, [shard_info], data_mode="train")
+        manifest = shard_utils.load_manifest(self.data_dir)
+        self.assertEqual(manifest["num_records"], 3)
+        self.assertEqual(manifest["num_bytes"], len(b'records'))
+        self.assertEqual(manifest["data_mode"], "train")
+        self.assertEqual(manifest["shards"], [shard_info])
+        self.assertIsNone(shard_utils.load_manifest(os.path.join(self.data_dir, "missing")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -49,4 +49,25 @@ class BaseDataConfig(BaseConfig):
         # Number of threads for preprocessing. Should be a multiple of 2.
         self.num_preprocess_threads = 4
         self.output_buffer_size = 1000
+        # number of parsed elements in the shuffle buffer, shards are shuffled and
+        # interleaved before, so a small buffer is enough
+        self.shuffle_buffer_size = 256
+        # shuffle the list of shard files each epoch
+        self.shuffle_files = True
+        # number of shards read in parallel and consecutive records taken from each of them
+        self.interleave_cycle_length = 4
+        self.interleave_block_length = 1
+        # bytes of read buffer for each shard, None for the default buffer
+        self.read_buffer_size = 8 * 1024 * 1024
+
+        # number of validation batches for internal evaluation during training, None for all
+        self.num_valid_batches = 100
+        # cache of these validation batches after the first pass:
+        # None for no cache, '' for in memory, or a file path for an on-disk cache,
+        # relative to valid_data_dir, the cache key of the data and batching params is appended
+        self.valid_cache_file = "valid_cache"
+        # number of serialized records parsed together by batched parsing ops
+        self.parse_batch_size = 64
+        # number of batches prefetched ahead of model computation
+        self.prefetch_buffer_size = 2
         self.random_seed = 123
@@ -4,11 +4,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
+import hashlib
+import json
 import os
 from abc import ABCMeta, abstractmethod
 
 import tensorflow as tf
 
+from visual_caption.utils import shard_utils
+
 
 class BaseDataReader(object):
     __metaclass__ = ABCMeta
@@ -18,22 +22,69 @@ class BaseDataReader(object):
 
         # default batch_size from data reader config
         self._batch_size = self.data_config.reader_batch_size
+        # dataset initializers are built once and reused, each dataset has its own iterator
+        self._init_ops = dict()
+        self._switch_ops = dict()
+        self._iterator_handle = None
+        # names of features in each batch, None for all features
+        self.features = None
+        self._data_iterator = None
+        # epoch and number of batches to skip of training data, fed to the train initializer
+        self.train_epoch = None
+        self.train_skip_batches = None
         self._build_context_and_feature()
-        self.data_iterator = self.get_data_iterator()
         pass
 
+    def select_features(self, features=None):
+        """
+        select the features of each batch, features not selected are skipped by
+        parsing, padding and batching, it must be called before the data iterator is built
+        :param features: names of selected features, None for all features
+        """
+        if features is not None:
+            features = tuple(features)
+        if features == self.features:
+            return
+        if self._data_iterator is not None:
+            raise ValueError("features {} can't be selected, data iterator is built with features {}"
+                             .format(features, self.features))
+        self.features = features
+        self._build_context_and_feature()
+
+    @property
+    def data_iterator(self):
+        if self._data_iterator is None:
+            self._data_iterator = self.get_data_iterator()
+        return self._data_iterator
+
     def get_data_iterator(self):
         """
-        get a data iterator for all dataset including train,valid and test
+        get a data iterator for all dataset including train,valid and test,
+        it reads from the iterator of the dataset whose init op ran last,
+        so evaluation during training doesn't reset the position of train data
         :return:
         """
         dataset = self._get_dataset(self.data_config.train_data_dir)
-        data_iterator = tf.data.Iterator.from_structure(
+        # string handle of the iterator in use, set by init ops and never saved into checkpoints
+        self._iterator_handle = tf.Variable("", trainable=False, collections=[], name="data_iterator_handle")
+        data_iterator = tf.data.Iterator.from_string_handle(
+            self._iterator_handle.value(),
             output_types=dataset.output_types,
             output_shapes=dataset.output_shapes
         )
         return data_iterator
 
+    def _make_init_op(self, name, dataset):
+        """
+        :return: op initializing the iterator of dataset and switching the data iterator to it
+        """
+        if self._data_iterator is None:  # the handle is created with the data iterator
+            self._data_iterator = self.get_data_iterator()
+        iterator = dataset.make_initializable_iterator()
+        self._switch_ops[name] = tf.assign(self._iterator_handle, iterator.string_handle())
+        self._init_ops[name] = tf.group(iterator.initializer, self._switch_ops[name])
+        return self._init_ops[name]
+
     def get_next_batch(self, batch_size=None):
         if batch_size:
             self._batch_size = batch_size
@@ -41,44 +92,146 @@ class BaseDataReader(object):
         return next_batch
 
     def get_train_init_op(self):
-        print("train_data_dir={}".format(self.data_config.train_data_dir))
-        _train_dataset = self._get_dataset(data_dir=self.data_config.train_data_dir)
-        initializer = self.data_iterator.make_initializer(_train_dataset)
-        return initializer
+        """
+        train data of each epoch is shuffled with the seed random_seed + epoch,
+        so the order of an epoch is the same when it is resumed,
+        the epoch and the batches to skip are fed by get_train_feed_dict
+        """
+        if "train" not in self._init_ops:
+            print("train_data_dir={}".format(self.data_config.train_data_dir))
+            self.train_epoch = tf.placeholder_with_default(
+                tf.constant(0, dtype=tf.int64), shape=[], name="train_epoch")
+            self.train_skip_batches = tf.placeholder_with_default(
+                tf.constant(0, dtype=tf.int64), shape=[], name="train_skip_batches")
+            _train_dataset = self._get_dataset(data_dir=self.data_config.train_data_dir,
+                                               shuffle_files=self.data_config.shuffle_files,
+                                               seed=self.data_config.random_seed + self.train_epoch,
+                                               skip_batches=self.train_skip_batches)
+            self._make_init_op("train", _train_dataset)
+        return self._init_ops["train"]
 
-    def get_valid_init_op(self):
-        print("valid_data_dir={}".format(self.data_config.valid_data_dir))
-        _valid_dataset = self._get_dataset(data_dir=self.data_config.valid_data_dir)
-        initializer = self.data_iterator.make_initializer(_valid_dataset)
-        return initializer
+    def get_train_switch_op(self):
+        """
+        switch the data iterator back to train data at the position where it stopped,
+        such as after an evaluation during training
+        """
+        self.get_train_init_op()
+        return self._switch_ops["train"]
+
+    def get_train_feed_dict(self, epoch=0, skip_batches=0):
+        """
+        feed dict of the train initializer
+        :param epoch: epoch of training data
+        :param skip_batches: number of batches of the epoch already trained, which are skipped
+        """
+        self.get_train_init_op()
+        return {self.train_epoch: epoch, self.train_skip_batches: skip_batches}
+
+    def get_valid_init_op(self, cached=False):
+        """
+        :param cached: if True, only the first data_config.num_valid_batches batches are used,
+            they are cached into data_config.valid_cache_file after the first pass,
+            which is used by internal evaluation during training
+        """
+        init_op_name = "valid_cached" if cached else "valid"
+        if init_op_name not in self._init_ops:
+            print("valid_data_dir={}".format(self.data_config.valid_data_dir))
+            _valid_dataset = self._get_dataset(data_dir=self.data_config.valid_data_dir)
+            if cached:
+                num_valid_batches = self.data_config.num_valid_batches
+                valid_cache_file = self._get_valid_cache_file()
+                if num_valid_batches is not None:
+                    _valid_dataset = _valid_dataset.take(num_valid_batches)
+                if valid_cache_file is not None:
+                    print("valid_cache_file={}".format(valid_cache_file))
+                    _valid_dataset = _valid_dataset.cache(filename=valid_cache_file)
+            self._make_init_op(init_op_name, _valid_dataset)
+        return self._init_ops[init_op_name]
+
+    def _get_valid_cache_file(self):
+        """
+        data_config.valid_cache_file relative to valid_data_dir, suffixed with a key of the validation data
+        and batching params, so a cache of rebuilt data or other features is never read
+        """
+        valid_cache_file = self.data_config.valid_cache_file
+        if not valid_cache_file:  # None for no cache, '' for in memory
+            return valid_cache_file
+        data_dir = self.data_config.valid_data_dir
+        manifest = shard_utils.load_manifest(data_dir)
+        data_files = [shard["md5"] for shard in manifest["shards"]] if manifest is not None \
+            else self._get_data_files(data_dir)
+        cache_key = json.dumps([data_files, self.data_config.num_valid_batches,
+                                self.data_config.reader_batch_size, self.features], sort_keys=True)
+        return "{}-{}".format(os.path.join(data_dir, valid_cache_file),
+                              hashlib.md5(cache_key.encode('utf-8')).hexdigest()[:8])
 
     def get_test_init_op(self):
-        print("test_data_dir={}".format(self.data_config.test_data_dir))
-        _test_dataset = self._get_dataset(data_dir=self.data_config.test_data_dir)
-        initializer = self.data_iterator.make_initializer(_test_dataset)
-        return initializer
+        if "test" not in self._init_ops:
+            print("test_data_dir={}".format(self.data_config.test_data_dir))
+            _test_dataset = self._get_dataset(data_dir=self.data_config.test_data_dir)
+            self._make_init_op("test", _test_dataset)
+        return self._init_ops["test"]
 
-    def _get_dataset(self, data_dir):
+    def _get_data_files(self, data_dir):
         """
-        get tf.data.TFRecordDataset from give data_dir and mapping them into dataset
+        shard files listed in the manifest of data_dir,
+        or files matching data_config.input_file_pattern if there is no manifest
+        """
+        manifest = shard_utils.load_manifest(data_dir)
+        if manifest is not None:
+            data_files = [os.path.join(data_dir, shard["file"]) for shard in manifest["shards"]]
+        else:
+            file_pattern = self.data_config.input_file_pattern or "*" + shard_utils.SHARD_SUFFIX
+            data_files = tf.gfile.Glob(os.path.join(data_dir, file_pattern))
+        return sorted(data_files)
+
+    def _get_dataset(self, data_dir, shuffle_files=False, seed=None, skip_batches=None):
+        """
+        get tf.data.TFRecordDataset from give data_dir and mapping them into dataset,
+        shards are read by parallel interleave, optionally in a shuffled order each epoch
         :param data_dir:
+        :param shuffle_files: whether shuffle the shard files each epoch
+        :param seed: seed of shuffling and sampling, data_config.random_seed if None
+        :param skip_batches: number of leading batches to skip
         :return:
         """
-        filenames = os.listdir(data_dir)
-        data_files = []
-        for filename in filenames:
-            data_file = os.path.join(data_dir, filename)
-            data_files.append(data_file)
-        dataset = tf.data.TFRecordDataset(data_files)
+        if seed is None:
+            seed = self.data_config.random_seed
+        data_files = self._get_data_files(data_dir)
+        read_buffer_size = self.data_config.read_buffer_size
+        dataset = tf.data.Dataset.from_tensor_slices(data_files)
+        if shuffle_files:
+            dataset = dataset.shuffle(buffer_size=len(data_files), seed=seed)
+        dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+            lambda data_file: tf.data.TFRecordDataset(data_file, buffer_size=read_buffer_size),
+            cycle_length=self.data_config.interleave_cycle_length,
+            block_length=self.data_config.interleave_block_length))
         # parsing tf_record
-        dataset = dataset.map(self._parse_tf_example)
+        dataset = self._parse_dataset(dataset)
         # mapping dataset
-        dataset = self._mapping_dataset(dataset)  # mapping to target format
+        dataset = self._mapping_dataset(dataset, seed)  # mapping to target format
+        if skip_batches is not None:
+            dataset = dataset.skip(skip_batches)
+        # overlap input pipeline with model computation
+        dataset = dataset.prefetch(self.data_config.prefetch_buffer_size)
+        return dataset
+
+    def _parse_dataset(self, dataset):
+        """
+        batch serialized records, parse each batch with batched parsing ops
+        in parallel and unbatch the parsed records again
+        :param dataset: dataset of serialized records
+        :return: dataset of parsed records
+        """
+        dataset = dataset.batch(self.data_config.parse_batch_size)
+        dataset = dataset.map(self._parse_tf_examples,
+                              num_parallel_calls=self.data_config.num_preprocess_threads)
+        dataset = dataset.apply(tf.contrib.data.unbatch())
         return dataset
 
     @abstractmethod
-    def _mapping_dataset(self, dataset):
-        """mapping data to necessary format  """
+    def _mapping_dataset(self, dataset, seed):
+        """mapping data to necessary format, seed is used by shuffling and sampling"""
         raise NotImplementedError()
         pass
 
@@ -89,7 +242,7 @@ class BaseDataReader(object):
         pass
 
     @abstractmethod
-    def _parse_tf_example(self):
-        """parsing tfrecord parsing"""
+    def _parse_tf_examples(self, serialized_examples):
+        """parsing a batch of serialized tfrecords"""
         raise NotImplementedError()
         pass
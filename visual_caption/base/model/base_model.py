@@ -4,6 +4,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
+import json
 import logging
 import os
 from abc import ABCMeta, abstractmethod
@@ -13,6 +14,9 @@ from tensorflow.contrib.learn import ModeKeys
 
 from visual_caption.utils.decorator_utils import timeit, define_scope
 
+# suffix of the input state file saved next to each checkpoint
+INPUT_STATE_SUFFIX = ".input_state.json"
+
 
 class BaseModel(object):
     """
@@ -21,6 +25,9 @@ class BaseModel(object):
 
     __metaclass__ = ABCMeta
 
+    # names of the features consumed from data_reader batches, None for all features
+    input_features = None
+
     def __init__(self, model_config, data_reader, mode):
 
         self.model_config = model_config
@@ -35,6 +42,8 @@ class BaseModel(object):
 
         # for model data pipeline
         self.batch_size = self.model_config.batch_size
+        if self.input_features is not None:
+            self.data_reader.select_features(self.input_features)
         self.next_batch = self.data_reader.get_next_batch(batch_size=self.batch_size)
         self.initializer = tf.random_uniform_initializer(
             minval=-self.model_config.initializer_scale,
@@ -67,6 +76,10 @@ class BaseModel(object):
         self._build_summaries()
         # create a model saver to save or restore model
         self.model_server = tf.train.Saver()
+        # kept checkpoints of a previous run are managed by the new saver, it starts with an empty list
+        checkpoint_state = tf.train.get_checkpoint_state(self.model_config.checkpoint_dir)
+        if checkpoint_state is not None:
+            self.model_server.recover_last_checkpoints(checkpoint_state.all_model_checkpoint_paths)
 
     @timeit
     @define_scope(scope_name='global_step')
@@ -174,14 +187,64 @@ class BaseModel(object):
         return '/gpu:%d' % gpu_id
 
     @timeit
-    def save_model(self, sess, global_step):
+    def save_model(self, sess, global_step, epoch=None, batch=0):
+        """
+        :param sess:
+        :param global_step:
+        :param epoch: if not None, the position of training data (epoch, batch) and the random seed
+            are saved next to the checkpoint, training resumes from it by restore_input_state
+        :param batch: number of batches of the epoch already trained
+        :return:
+        """
         model_name = self.model_config.model_name
         checkpoint_dir = self.model_config.checkpoint_dir
         if not os.path.isdir(checkpoint_dir):
             os.makedirs(checkpoint_dir)
-        self.model_server.save(sess, os.path.join(checkpoint_dir, model_name), global_step=global_step)
+        checkpoint_path = self.model_server.save(
+            sess, os.path.join(checkpoint_dir, model_name), global_step=global_step)
+        if epoch is not None:
+            self._save_input_state(checkpoint_path, global_step, epoch, batch)
         self.logger.info("save model {} at step {}".format(model_name, global_step))
 
+    def _save_input_state(self, checkpoint_path, global_step, epoch, batch):
+        input_state = {
+            "global_step": int(global_step),
+            "epoch": int(epoch),
+            "batch": int(batch),
+            "random_seed": self.data_reader.data_config.random_seed,
+        }
+        state_file = checkpoint_path + INPUT_STATE_SUFFIX
+        with open(state_file + ".tmp", mode='w') as f:
+            json.dump(input_state, f, indent=2, sort_keys=True)
+        os.rename(state_file + ".tmp", state_file)
+        # remove input states of checkpoints deleted by the saver
+        checkpoint_dir = os.path.dirname(checkpoint_path)
+        for file_name in os.listdir(checkpoint_dir):
+            if not file_name.endswith(INPUT_STATE_SUFFIX):
+                continue
+            if not tf.train.checkpoint_exists(os.path.join(checkpoint_dir, file_name[:-len(INPUT_STATE_SUFFIX)])):
+                os.remove(os.path.join(checkpoint_dir, file_name))
+
+    def restore_input_state(self, checkpoint_path=None):
+        """
+        position of training data saved with the checkpoint
+        :param checkpoint_path: if checkpoint is None, use the last checkpoint
+        :return: (epoch, batch) to resume training data from, (0, 0) if not saved
+        """
+        if checkpoint_path is None:
+            checkpoint_path = tf.train.latest_checkpoint(self.model_config.checkpoint_dir)
+        if not checkpoint_path or not os.path.isfile(checkpoint_path + INPUT_STATE_SUFFIX):
+            return 0, 0
+        with open(checkpoint_path + INPUT_STATE_SUFFIX, mode='r') as f:
+            input_state = json.load(f)
+        random_seed = self.data_reader.data_config.random_seed
+        if input_state["random_seed"] != random_seed:
+            self.logger.warning("input state of {} is saved with random_seed={}, but current random_seed={}, "
+                                "resumed data order is different".format(
+                                    checkpoint_path, input_state["random_seed"], random_seed))
+        print("resume training data from epoch={}, batch={}".format(input_state["epoch"], input_state["batch"]))
+        return input_state["epoch"], input_state["batch"]
+
     @timeit
     def restore_model(self, sess, checkpoint_path=None):
         """
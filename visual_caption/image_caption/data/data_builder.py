@@ -4,7 +4,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
+import io
+import multiprocessing
 import os
+import shutil
 import sys
 
 import ijson
@@ -14,14 +17,26 @@ from tensorflow.contrib.learn import ModeKeys
 
 from visual_caption.base.data.base_data_builder import BaseDataBuilder
 from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.image_caption.data.data_detector import DETECT_CHUNK_SIZE, get_detection_cache_key, get_image_id
 from visual_caption.image_caption.data.data_loader import ImageCaptionDataLoader
-from visual_caption.image_caption.feature.feature_extractor import FeatureExtractor
-from visual_caption.utils import image_utils
+from visual_caption.image_caption.data import detection_store
+from visual_caption.image_caption.data.data_reader import Vocabulary
+from visual_caption.image_caption.feature.faster_rcnn_detector import FasterRCNNDetector, DetectorConfig
+from visual_caption.image_caption.feature.feature_batcher import FeatureBatcher
+from visual_caption.image_caption.feature.feature_extractor import FeatureExtractor, FEATURE_PARAMS, \
+    CANVAS_PARAMS, CROP_PARAMS, ROI_PARAMS, inception_resnet_v2_ckpt
+from visual_caption.utils import feature_cache, feature_codec, feature_projection, image_source, image_utils, \
+    jsonl_utils, shard_utils
 from visual_caption.utils.decorator_utils import timeit
+from visual_caption.utils.image_prefetcher import ImagePrefetcher
 
 import numpy as np
 from object_detection.utils import dataset_util
 
+PROJECTION_FILE_NAME = "feature_projection.npz"  # copy of the projection in the tfrecord dir
+# preprocessing params of each region_feature_mode, part of feature cache keys
+REGION_MODE_PARAMS = {"crop_resize": CROP_PARAMS, "roi": ROI_PARAMS, "crop": CANVAS_PARAMS}
+
 
 class ImageCaptionDataBuilder(BaseDataBuilder):
     """
@@ -33,59 +48,73 @@ class ImageCaptionDataBuilder(BaseDataBuilder):
         super(ImageCaptionDataBuilder, self).__init__(data_config)
         # visual feature extractor based on inception_resnet_v2
         self.data_loader = ImageCaptionDataLoader(data_config=data_config)
+        self.vocabulary = Vocabulary(vocab_file=data_config.vocab_char_txt,
+                                     start_word=data_config.token_start,
+                                     end_word=data_config.token_end,
+                                     unk_word=data_config.token_unknown)
+        self._vocab_version = shard_utils.get_file_checksum(data_config.vocab_char_txt)
         self.feature_extractor = None
+        self.feature_cache = None
+        if data_config.feature_cache_dir is not None:
+            self.feature_cache = feature_cache.FeatureCache(data_config.feature_cache_dir,
+                                                            max_bytes=data_config.feature_cache_max_bytes)
+        self._feature_model_id = feature_cache.get_model_id(inception_resnet_v2_ckpt)
+        # the fused build decodes each image once for detection and features at the larger decode size,
+        # its detection and feature cache keys carry that size: detections are shared with data_detector
+        # if feature_decode_min_size <= DetectorConfig.decode_min_size, features with the two-pass build if >=
+        self.detector_config = DetectorConfig()
+        decode_sizes = [self.detector_config.decode_min_size, data_config.feature_decode_min_size]
+        self.detector_config.decode_min_size = None if None in decode_sizes else max(decode_sizes)
+        self._detector = None
+        # features are projected when they are written, the feature cache keeps the original features
+        self.feature_projection = None
+        self._projection_checksum = None
+        if data_config.use_feature_projection:
+            self.feature_projection = feature_projection.load_projection(data_config.feature_projection_file)
+            self._projection_checksum = shard_utils.get_file_checksum(data_config.feature_projection_file)
         pass
 
-    def _to_tf_example(self, mode, image_data):
+    def _to_tf_example(self, mode, image_data, visual_data=None):
         """
         Convert python dictionary format data of one image to tf.Example proto.
+        All captions of the image share one record: the visual context is stored once,
+        caption token ids are packed into one 'caption/ids' buffer and split back
+        by 'caption/lengths' in the data reader.
         Args:
             image_data: information of one image, include
                 bounding box, labels of bounding box,
-                height, width, encoded pixel data.
+                height, width, encoded pixel data and captions.
+            visual_data: result of _load_visual_data, it is loaded from image_data['image_file'] if None
         Returns:
             example: The converted tf.Example
         """
-        if self.feature_extractor is None:
-            self.feature_extractor = FeatureExtractor()
+        if visual_data is None:
+            visual_data = self._load_visual_data(image_data)
+        self._extract_missing_features(image_data, visual_data)
         image_id = image_data['image_id']
-        image_path = image_data['image_file']
-        image_raw_data = image_utils.load_image(image_path)
-        (image_height, image_width, image_depth) = image_raw_data.shape
-        image_feature = self.feature_extractor.get_feature_from_rawdata(image_raw_data)
+        (image_height, image_width, image_depth) = visual_data['image_shape']
+        image_feature = visual_data['image_feature']
+
+        bbox_list, bbox_labels_ids = self._get_bboxes(image_data)
+        bbox_number = len(bbox_list)
+        bboxes_data = np.reshape(np.asarray(bbox_list, dtype=np.int64), (-1))
+        bbox_features = visual_data['bbox_features']
+
+        captions = image_data['captions']
+        caption_lengths = [len(caption) for caption in captions]
+        caption_ids = np.asarray(
+            [self.vocabulary.word_to_id(char) for caption in captions for char in caption],
+            dtype=self.data_config.caption_ids_dtype)
+
+        if self.feature_projection is not None:
+            image_feature = feature_projection.project(image_feature, self.feature_projection)
+            bbox_features = feature_projection.project(bbox_features, self.feature_projection)
+
+        # features are stored in feature_dtype, int8 features with the scale of each vector
+        feature_dtype = self.data_config.feature_dtype
+        image_feature, image_feature_scale = feature_codec.encode_features(image_feature, feature_dtype)
+        bbox_features, bbox_feature_scales = feature_codec.encode_features(bbox_features, feature_dtype)
 
-        bboxes = image_data['bboxes']
-        bbox_number = len(bboxes)
-        max_bbox_number = self.data_config.num_max_bbox
-        if bbox_number > max_bbox_number:
-            bbox_number = max_bbox_number
-        bbox_raw_data_list = list()
-        bbox_labels_ids = list()
-        bbox_labels_names = list()
-
-        bbox_list = list()
-        for idx in range(bbox_number):
-            bbox = bboxes[idx]
-            xmin = bbox['x_min']
-            ymin = bbox['y_min']
-            xmax = bbox['x_max']
-            ymax = bbox['y_max']
-
-            bbox_list.append([xmin, ymin, xmax, ymax])
-            bbox_labels_ids.append(bbox['class_id'])
-            bbox_labels_names.append(bbox['class_name'])
-
-            x_width = xmax - xmin
-            y_height = ymax - ymin
-            bbox_raw_data = image_utils.crop_image(
-                image_raw_data, xmin=xmin, ymin=ymin,
-                width=x_width, height=y_height)
-            bbox_raw_data_list.append(bbox_raw_data)
-
-        bboxes_data = np.reshape(bbox_list, (-1))
-        bbox_features = self.feature_extractor.get_feature_from_rawdata_list(
-            bbox_raw_data_list)
-        bbox_features = np.asarray(bbox_features)
         # image_id_encoded = [char.encode() for char in image_id]
         tf_context = tf.train.Features(feature={
             # image data
@@ -99,96 +128,602 @@ class ImageCaptionDataBuilder(BaseDataBuilder):
             'bbox/number': dataset_util.int64_feature(bbox_number),
             'bbox/labels': dataset_util.int64_list_feature(bbox_labels_ids),
             'bbox/bboxes': dataset_util.int64_list_feature(bboxes_data),
-            'bbox/features': dataset_util.bytes_feature(bbox_features.tobytes())
+            'bbox/features': dataset_util.bytes_feature(bbox_features.tobytes()),
+
+            # caption
+            'caption/number': dataset_util.int64_feature(len(captions)),
+            'caption/lengths': dataset_util.int64_list_feature(caption_lengths),
+            'caption/ids': dataset_util.bytes_feature(caption_ids.tobytes()),
         })
+        if feature_dtype == 'int8':
+            tf_context.feature['image/feature_scale'].CopyFrom(
+                dataset_util.bytes_feature(image_feature_scale.tobytes()))
+            tf_context.feature['bbox/feature_scales'].CopyFrom(
+                dataset_util.bytes_feature(bbox_feature_scales.tobytes()))
+        tf_example = tf.train.Example(features=tf_context)
+        return tf_example
 
-        tf_example_list = list()
-        captions = image_data['captions']
-        for caption in captions:
-            caption_encoded = [char.encode() for char in caption]
-            feature_lists = tf.train.FeatureLists(feature_list={
-                'caption': self._bytes_feature_list(caption_encoded), })
-            tf_example = tf.train.SequenceExample(
-                context=tf_context, feature_lists=feature_lists)
-            tf_example_list.append(tf_example)
-        return tf_example_list
-
-    def _write_tf_examples(self, tf_writer, tf_batch):
-        for tf_example in tf_batch:
-            tf_writer.write(tf_example.SerializeToString())
-        print("saved {} tf_records".format(len(tf_batch)))
-        pass
+    def _get_feature_cache_keys(self, image_data, content_hash, decode_min_size):
+        """
+        :param decode_min_size: min size the image is decoded at for feature extraction
+        :return: cache keys of the whole image feature and the region features of image_data
+        """
+        bbox_list, _ = self._get_bboxes(image_data)
+        mode = self.data_config.region_feature_mode
+        params = dict(FEATURE_PARAMS, mode=mode, mode_params=REGION_MODE_PARAMS[mode],
+                      decode_min_size=decode_min_size)
+        image_key = feature_cache.make_key("image_feature", content_hash, self._feature_model_id, params)
+        region_key = feature_cache.make_key("region_feature", content_hash, self._feature_model_id,
+                                            dict(params, bboxes=bbox_list))
+        return image_key, region_key
 
-    def _build_tfrecords(self, data_mode, output_dir=None, detected_data_file=None):
+    def _lookup_cached_features(self, image_data, content_hash, decode_min_size):
         """
-        convert detected_data_file to tfrecords
-        :param detected_data_file: bboxes data file for images
-        :param tfrecord_file:
-        :return:
+        :param decode_min_size: min size the image is decoded at if some feature is missing
+        :return: dict of image_shape, image_feature and bbox_features of image_data from the feature cache,
+            None for missing features, image_raw_data to be set for extraction and the cache keys
         """
-        shard_size = 1000
-        time_begin = time.time()
-        shard_data = []
-        count = 0
-        start = 1
+        visual_data = {"image_shape": None, "image_feature": None, "bbox_features": None,
+                       "image_raw_data": None, "cache_keys": None}
+        if self.feature_cache is None:
+            return visual_data
+        image_key, region_key = self._get_feature_cache_keys(image_data, content_hash, decode_min_size)
+        visual_data["cache_keys"] = (image_key, region_key)
+        image_entry = self.feature_cache.get(image_key)
+        if image_entry is not None:
+            visual_data["image_shape"] = tuple(image_entry["image_shape"])
+            visual_data["image_feature"] = image_entry["image_feature"]
+        region_entry = self.feature_cache.get(region_key)
+        if region_entry is not None:
+            visual_data["bbox_features"] = region_entry["bbox_features"]
+        return visual_data
+
+    def _load_visual_data(self, image_data):
+        """
+        look up the features of image_data in the feature cache by the content of its image file,
+        the image is decoded only if some feature is missing, it runs in prefetcher threads
+        :return: visual_data of _lookup_cached_features with image_raw_data if some feature is missing
+        """
+        image_file = image_data['image_file']
+        content_hash = None
+        if self.feature_cache is not None:
+            # the image is read once for its content hash and decoding
+            image_file = io.BytesIO(image_source.read_image_file(image_data['image_file']))
+            content_hash = feature_cache.get_bytes_hash(image_file.getvalue())
+        visual_data = self._lookup_cached_features(image_data, content_hash,
+                                                   self.data_config.feature_decode_min_size)
+        if visual_data["image_feature"] is None or visual_data["bbox_features"] is None:
+            visual_data["image_raw_data"], visual_data["image_shape"] = image_utils.decode_image(
+                image_file, min_size=self.data_config.feature_decode_min_size)
+        return visual_data
+
+    @property
+    def detector(self):
+        """detector of the fused build, its session is created on first use, one for each process"""
+        if self._detector is None:
+            self._detector = FasterRCNNDetector(self.detector_config)
+        return self._detector
+
+    def _load_fused_data(self, image_data):
+        """
+        read the image of image_data once and look up its detection and features in the feature cache,
+        the image is decoded once for both detection and feature extraction if any of them is missing,
+        at detector_config.decode_min_size which both cache keys carry, it runs in prefetcher threads
+        :return: dict of content_hash, cached image_dict of detection, visual_data of cached features
+            (None if the detection is not cached), and image_raw_data with its full size image_shape
+        """
+        image_bytes = image_source.read_image_file(image_data['image_file'])
+        fused_data = {"content_hash": None, "image_dict": None, "visual_data": None,
+                      "image_raw_data": None, "image_shape": None}
+        if self.feature_cache is not None:
+            fused_data["content_hash"] = feature_cache.get_bytes_hash(image_bytes)
+            fused_data["image_dict"] = self.feature_cache.get(
+                get_detection_cache_key(self.detector_config, fused_data["content_hash"]))
+        if fused_data["image_dict"] is not None:
+            fused_data["visual_data"] = self._lookup_cached_features(
+                dict(image_data, **fused_data["image_dict"]), fused_data["content_hash"],
+                self.detector_config.decode_min_size)
+            if fused_data["visual_data"]["image_feature"] is not None and \
+                    fused_data["visual_data"]["bbox_features"] is not None:
+                return fused_data
+        fused_data["image_raw_data"], fused_data["image_shape"] = image_utils.decode_image(
+            io.BytesIO(image_bytes), min_size=self.detector_config.decode_min_size)
+        return fused_data
+
+    def _detect_fused(self, prefetcher, detect_writer=None):
+        """
+        detect images of prefetcher missing in the feature cache in chunks of DETECT_CHUNK_SIZE
+        and yield (image_data, visual_data) in order, image_data carries the detected bboxes
+        :param detect_writer: JsonLinesWriter of detection records for debugging, None to skip them
+        """
+        chunk = list()
+        for image_data, fused_data in prefetcher:
+            chunk.append((image_data, fused_data))
+            if len(chunk) < DETECT_CHUNK_SIZE:
+                continue
+            for item in self._detect_fused_chunk(chunk, detect_writer):
+                yield item
+            chunk = list()
+        for item in self._detect_fused_chunk(chunk, detect_writer):
+            yield item
+
+    def _detect_fused_chunk(self, chunk, detect_writer):
+        missing = [idx for idx, (_, fused_data) in enumerate(chunk) if fused_data["image_dict"] is None]
+        if len(missing) > 0:
+            image_dicts = self.detector.detect_arrays([chunk[idx][1]["image_raw_data"] for idx in missing],
+                                                      original_shapes=[chunk[idx][1]["image_shape"] for idx in missing])
+            for idx, image_dict in zip(missing, image_dicts):
+                fused_data = chunk[idx][1]
+                fused_data["image_dict"] = image_dict
+                if self.feature_cache is not None:
+                    self.feature_cache.put(get_detection_cache_key(self.detector_config, fused_data["content_hash"]),
+                                           image_dict)
+        results = list()
+        for image_data, fused_data in chunk:
+            image_data = dict(image_data, **fused_data["image_dict"])
+            if detect_writer is not None:
+                detect_writer.write(image_data)
+            visual_data = fused_data["visual_data"]
+            if visual_data is None:
+                visual_data = self._lookup_cached_features(image_data, fused_data["content_hash"],
+                                                           self.detector_config.decode_min_size)
+            if visual_data["image_feature"] is None or visual_data["bbox_features"] is None:
+                visual_data["image_raw_data"] = fused_data["image_raw_data"]
+                visual_data["image_shape"] = fused_data["image_shape"]
+            results.append((image_data, visual_data))
+        return results
+
+    def _get_feature_batcher(self):
+        """
+        batcher of feature extraction across images, a batch has feature_batch_size crops in crop modes
+        and feature_batch_size images in roi mode
+        """
+        mode = self.data_config.region_feature_mode
+        if mode == "roi":
+            return FeatureBatcher(self._extract_roi_batch, self.data_config.feature_batch_size,
+                                  split_images=False)
+        if mode == "crop":
+            return FeatureBatcher(self._extract_canvas_batch, self.data_config.feature_batch_size)
+        if mode == "crop_resize":
+            return FeatureBatcher(self._extract_crop_batch, self.data_config.feature_batch_size)
+        raise ValueError("Unknown region_feature_mode {}, expected one of {}"
+                         .format(mode, sorted(REGION_MODE_PARAMS)))
+
+    def _get_feature_extractor(self):
+        """the extractor is loaded on the first cache miss"""
+        if self.feature_extractor is None:
+            self.feature_extractor = FeatureExtractor()
+        return self.feature_extractor
+
+    def _extract_crop_batch(self, image_raw_data_list, boxes_list):
+        return self._get_feature_extractor().get_batch_crop_features(image_raw_data_list, boxes_list)
+
+    def _extract_canvas_batch(self, image_raw_data_list, boxes_list):
+        """
+        features of the original "crop" mode, each box is kept on a zero canvas of the image size
+        which is resized to 299 x 299 as a whole, the whole image box is the image itself
+        """
+        features_list = list()
+        for image_raw_data, boxes in zip(image_raw_data_list, boxes_list):
+            (height, width) = image_raw_data.shape[:2]
+            canvases = list()
+            for min_0, min_1, max_0, max_1 in boxes * np.asarray([height, width, height, width]):
+                canvas = image_utils.crop_image(image_raw_data, xmin=min_0, ymin=min_1,
+                                                width=max_0 - min_0, height=max_1 - min_1)
+                canvases.append(canvas.astype(np.uint8))
+            features_list.append(np.asarray(
+                self._get_feature_extractor().get_feature_from_rawdata_list(canvases), dtype=np.float32))
+        return features_list
+
+    def _extract_roi_batch(self, image_raw_data_list, boxes_list):
+        """roi features of crop boxes of images, the first box of each image is the whole image"""
+        image_features, region_features_list = self._get_feature_extractor().get_roi_features(
+            image_raw_data_list, [boxes[1:] for boxes in boxes_list])
+        return [np.concatenate([[image_feature], region_features])
+                for image_feature, region_features in zip(image_features, region_features_list)]
+
+    def _add_to_batcher(self, batcher, image_data, visual_data):
+        """
+        add the decoded image of visual_data with the whole image box and its bboxes to batcher
+        :return: list of ((image_data, visual_data), features) completed by batcher
+        """
+        image_raw_data = visual_data.pop("image_raw_data", None)
+        boxes = None
+        if image_raw_data is not None:
+            bbox_list, _ = self._get_bboxes(image_data)
+            # bboxes are in full size pixels, the image may be decoded at reduced scale
+            (height, width) = visual_data["image_shape"][:2]
+            boxes = np.asarray(bbox_list, dtype=np.float32).reshape(-1, 4) / \
+                    np.asarray([height, width, height, width], dtype=np.float32)
+            boxes = np.concatenate([[[0.0, 0.0, 1.0, 1.0]], boxes])
+        return batcher.add((image_data, visual_data), image_raw_data, boxes)
+
+    def _set_missing_features(self, visual_data, features):
+        """
+        fill features missing in visual_data from rows of extracted features, the whole image first
+        and then the bboxes, and put them into the feature cache
+        """
+        if features is None:
+            return
+        missing_image, missing_region = visual_data["image_feature"] is None, visual_data["bbox_features"] is None
+        if missing_image:
+            visual_data["image_feature"] = features[0]
+        if missing_region:
+            visual_data["bbox_features"] = features[1:]
+        cache_keys = visual_data["cache_keys"]
+        if cache_keys is None:
+            return
+        if missing_image:
+            self.feature_cache.put(cache_keys[0], {
+                "image_shape": np.asarray(visual_data["image_shape"], dtype=np.int64),
+                "image_feature": visual_data["image_feature"]})
+        if missing_region:
+            self.feature_cache.put(cache_keys[1], {"bbox_features": visual_data["bbox_features"]})
+
+    def _extract_missing_features(self, image_data, visual_data):
+        """extract features missing in visual_data of a single image"""
+        if visual_data.get("image_raw_data") is None:
+            return
+        batcher = self._get_feature_batcher()
+        for (_, visual_data), features in self._add_to_batcher(batcher, image_data, visual_data) + batcher.flush():
+            self._set_missing_features(visual_data, features)
 
+    def _get_bboxes(self, image_data):
+        """
+        boxes and class ids of the top num_max_bbox detections of an image,
+        from compact bbox arrays, or from the bboxes dict list of earlier detection files
+        :return: (list of [x_min, y_min, x_max, y_max], list of class_id)
+        """
+        max_bbox_number = self.data_config.num_max_bbox
+        if 'bbox_boxes' in image_data:
+            bbox_list = [list(box) for box in image_data['bbox_boxes'][:max_bbox_number]]
+            bbox_labels_ids = list(image_data['bbox_class_ids'][:max_bbox_number])
+        else:
+            bboxes = image_data['bboxes'][:max_bbox_number]
+            bbox_list = [[bbox['x_min'], bbox['y_min'], bbox['x_max'], bbox['y_max']] for bbox in bboxes]
+            bbox_labels_ids = [bbox['class_id'] for bbox in bboxes]
+        return bbox_list, bbox_labels_ids
+
+    def _load_detected_generator(self, detected_data_file, start=0):
+        """
+        yield (index, image_data) of detected_data_file from index start in streaming fashion,
+        detected_data_file is a detection store, json lines (.jsonl) or a json list
+        """
+        if detection_store.is_store(detected_data_file):
+            # random access, images before start are not read
+            store = detection_store.DetectionStore(detected_data_file)
+            for idx, image_data in enumerate(store.iter_from(start), start=start):
+                yield idx, image_data
+            return
+        if jsonl_utils.is_jsonl_file(detected_data_file):
+            for idx, image_data in enumerate(jsonl_utils.load_jsonl_generator(detected_data_file, start=start),
+                                             start=start):
+                yield idx, image_data
+            return
         with open(file=detected_data_file, mode='rb') as f:
             items = ijson.items(f, "item")
-            for image_data in items:
-                # convert each image data into tf_example list
-                tf_example_list = self._to_tf_example(
-                    mode=ModeKeys.INFER, image_data=image_data)
-                for tf_example in tf_example_list:
-                    shard_data.append(tf_example)
-                count += 1
-                if count % 10 == 0:
-                    print("build {} image data".format(count))
-                if count % shard_size == 0:  # save shard data and change shard tf_writer
-                    tfrecord_file_name = data_mode + "_data" + "_" + str(start) + "_" + str(count) + '.tfrecords'
-                    tfrecord_file = os.path.join(output_dir, tfrecord_file_name)
-                    tf_writer = tf.python_io.TFRecordWriter(tfrecord_file)
-                    self._write_tf_examples(tf_writer, shard_data)
-                    sys.stdout.flush()
-                    print("converted image data {}-{} into {}, elapsed {} sec."
-                          .format(start, count, tfrecord_file, time.time() - time_begin))
-                    shard_data = []
-                    time_begin = time.time()
-                    start = count + 1
-
-            if len(shard_data) > 0:
-                tfrecord_file_name = data_mode + "_data" + "_" + str(start) + "_" + str(count) + '.tfrecords'
-                tfrecord_file = os.path.join(output_dir, tfrecord_file_name)
-                tf_writer = tf.python_io.TFRecordWriter(tfrecord_file)
-                self._write_tf_examples(tf_writer, shard_data)
-                sys.stdout.flush()
-                print("converted image data {}-{} into {}, elapsed {} sec."
-                      .format(start, count, tfrecord_file, time.time() - time_begin))
+            for idx, image_data in enumerate(items):
+                if idx >= start:
+                    yield idx, image_data
+
+    def _count_detected_images(self, detected_data_file):
+        if detection_store.is_store(detected_data_file):
+            return len(detection_store.DetectionStore(detected_data_file))
+        if jsonl_utils.is_jsonl_file(detected_data_file):
+            return jsonl_utils.count_jsonl_records(detected_data_file)
+        count = 0
+        for _ in self._load_detected_generator(detected_data_file):
+            count += 1
+        return count
+
+    def _load_source_generator(self, fused_source, start=0):
+        """
+        yield (index, image_data) of the images of fused_source from index start in streaming fashion
+        :param fused_source: dict of image_dir and caption_file, images of image_dir get a placeholder
+            caption if caption_file is None
+        """
+        image_dir = fused_source["image_dir"]
+        if fused_source.get("caption_file") is None:
+            names = image_source.get_image_source(image_dir).list_names()
+            for idx, name in enumerate(names[start:], start=start):
+                yield idx, {"image_id": get_image_id(name), "image_file": os.path.join(image_dir, name),
+                            "captions": ["This is a test caption text"]}
+            return
+        data_gen = self.data_loader.load_raw_generator(json_data_file=fused_source["caption_file"],
+                                                       image_dir=image_dir)
+        idx = 0
+        for batch_data in data_gen:
+            for image_data in batch_data:
+                if idx >= start:
+                    yield idx, image_data
+                idx += 1
+
+    def _count_source_images(self, fused_source):
+        count = 0
+        for _ in self._load_source_generator(fused_source):
+            count += 1
+        return count
+
+    def _build_shard(self, shard_file, data_gen, start, end, fused=False, shard_params=None):
+        """
+        stream images [start, end) of data_gen into shard_file,
+        records are written to a temp file which is renamed when the shard is finished,
+        a completion marker is saved afterwards
+        :param fused: images of data_gen have no bboxes yet, each image is decoded once,
+            detected and its features are extracted in the same pass
+        :param shard_params: params of the shard kept in its completion marker, see _get_shard_params
+        :return: shard info for manifest
+        """
+        tmp_file = shard_file + shard_utils.TMP_SUFFIX
+        time_begin = time.time()
+
+        def _shard_items():
+            # stops right after the last image of the shard, data_gen is shared by the next shard
+            for idx, image_data in data_gen:
+                if idx < start:
+                    continue
+                yield image_data
+                if idx + 1 >= end:
+                    break
+
+        # images are decoded in background threads while features of previous images are extracted,
+        # images with cached features are not decoded
+        prefetcher = ImagePrefetcher(_shard_items(),
+                                     load_fn=self._load_fused_data if fused else self._load_visual_data,
+                                     num_threads=self.data_config.image_prefetch_threads,
+                                     queue_size=self.data_config.image_prefetch_size)
+        # crops of several images are extracted in full batches, records are written in order
+        # once all features of their image are extracted
+        batcher = self._get_feature_batcher()
+
+        def _write_completed(completed):
+            for (image_data, visual_data), features in completed:
+                self._set_missing_features(visual_data, features)
+                # convert each image data into one tf_example with all its captions
+                tf_example = self._to_tf_example(
+                    mode=ModeKeys.INFER, image_data=image_data, visual_data=visual_data)
+                tf_writer.write(tf_example.SerializeToString())
+                counter["count"] += 1
+                if counter["count"] % 10 == 0:
+                    print("build {} image data for {}, prefetch {}, batcher {}, cache {}"
+                          .format(counter["count"], shard_file, prefetcher.get_stats(), batcher.get_stats(),
+                                  self.feature_cache.get_stats() if self.feature_cache is not None else None))
+
+        # detection records of the fused build are only written for debugging
+        detect_writer = None
+        if fused and self.data_config.fused_detect_debug:
+            detect_file = os.path.join(self.data_config.detect_dir,
+                                       os.path.basename(shard_file) + jsonl_utils.JSONL_SUFFIX)
+            if os.path.isfile(detect_file):  # the shard is rebuilt from its first image
+                os.remove(detect_file)
+            detect_writer = jsonl_utils.JsonLinesWriter(detect_file)
+
+        counter = {"count": 0}
+        with prefetcher, tf.python_io.TFRecordWriter(tmp_file) as tf_writer:
+            items = self._detect_fused(prefetcher, detect_writer) if fused else prefetcher
+            for image_data, visual_data in items:
+                _write_completed(self._add_to_batcher(batcher, image_data, visual_data))
+            _write_completed(batcher.flush())
+        if detect_writer is not None:
+            detect_writer.close()
+        count = counter["count"]
+        print("extracted features of {} in {} runs, batcher {}".format(shard_file, batcher.num_runs,
+                                                                       batcher.get_stats()))
+        shard_utils.finalize_file(tmp_file, shard_file)
+        shard_info = shard_utils.get_shard_info(shard_file, count)
+        shard_utils.write_done_marker(shard_file, shard_info, build_params=shard_params)
+        sys.stdout.flush()
+        print("converted image data {}-{} into {}, elapsed {} sec."
+              .format(start, end - 1, shard_file, time.time() - time_begin))
+        return shard_info
+
+    def _build_shards(self, split_name, output_dir, detected_data_file, shard_ranges, num_shards,
+                      fused_source=None, source_params=None):
+        """
+        convert images of given shard ranges in detected_data_file, or fused_source
+        if it is not None, into tfrecord shards,
+        finished shards of a previous run are skipped and building resumes
+        at the first incomplete shard
+        :param shard_ranges: sorted list of (shard_index, start, end) of one contiguous block
+        :param source_params: number of images and identity of the source, see _get_source_params
+        :return: list of shard info for manifest
+        """
+        shard_infos = list()
+        pending_shards = list()
+        for shard_index, start, end in shard_ranges:
+            shard_file = os.path.join(output_dir, shard_utils.get_shard_name(
+                split_name, shard_index, num_shards))
+            shard_params = self._get_shard_params(start, end, source_params)
+            shard_info = shard_utils.load_done_marker(shard_file, build_params=shard_params)
+            if shard_info is not None:
+                print("skip finished shard {}".format(shard_file))
+                shard_infos.append(shard_info)
+            else:
+                pending_shards.append((shard_file, start, end, shard_params))
+        if len(pending_shards) == 0:
+            return shard_infos
+
+        # one pass over detected_data_file for all pending shards of this worker,
+        # from the first image of its first pending shard
+        first_start = pending_shards[0][1]
+        if fused_source is not None:
+            data_gen = self._load_source_generator(fused_source, start=first_start)
+        else:
+            data_gen = self._load_detected_generator(detected_data_file, start=first_start)
+        for shard_file, start, end, shard_params in pending_shards:
+            shard_info = self._build_shard(shard_file=shard_file, data_gen=data_gen,
+                                           start=start, end=end, fused=fused_source is not None,
+                                           shard_params=shard_params)
+            shard_infos.append(shard_info)
+        return shard_infos
+
+    def _get_build_params(self):
+        """
+        params the content of shards depends on, kept in done markers and the manifest,
+        finished shards built with other params are rebuilt
+        """
+        dim_visual_feature = self.data_config.dim_visual_feature
+        if self.feature_projection is not None:
+            dim_visual_feature = feature_projection.get_projection_info(self.feature_projection)["dim_out"]
+        return {
+            # caption ids of records are tokenized by the vocabulary
+            "vocab_version": self._vocab_version,
+            "num_max_bbox": self.data_config.num_max_bbox,
+            "caption_ids_dtype": self.data_config.caption_ids_dtype,
+            "feature_dtype": self.data_config.feature_dtype,
+            "region_feature_mode": self.data_config.region_feature_mode,
+            "dim_visual_feature": dim_visual_feature,
+            "feature_projection_checksum": self._projection_checksum,
+        }
+
+    def _get_shard_params(self, start, end, source_params):
+        """
+        params of a shard kept in its completion marker: the build params, the image range of the shard
+        and the source it is read from, a shard of a changed or extended source is rebuilt
+        as its range holds other images
+        """
+        return dict(self._get_build_params(), start=start, end=end, **(source_params or dict()))
+
+    def _get_source_params(self, num_images, detected_data_file=None, fused_source=None):
+        """
+        number of images and identity of the source by size and modification time of its files,
+        a detection store is identified by its header which is rewritten with the store
+        """
+        if fused_source is not None:
+            image_dir = fused_source["image_dir"]
+            caption_file = fused_source.get("caption_file")
+            source = {
+                # images added to a directory change num_images, an archive is identified as a file
+                "image_dir": shard_utils.get_file_identity(image_dir) or os.path.abspath(image_dir),
+                "caption_file": shard_utils.get_file_identity(caption_file) if caption_file else None,
+            }
+        elif detection_store.is_store(detected_data_file):
+            source = shard_utils.get_file_identity(
+                os.path.join(detected_data_file, detection_store.HEADER_FILE_NAME))
+        else:
+            source = shard_utils.get_file_identity(detected_data_file)
+        return {"num_images": num_images, "source": source}
+
+    @timeit
+    def _build_tfrecords(self, data_mode, split_name, output_dir=None, detected_data_file=None,
+                         fused_source=None):
+        """
+        convert detected_data_file to tfrecord shards named like train-00003-of-00064,
+        with fused_source images are detected and their features extracted in the same pass instead,
+        images are split into builder_num_shards contiguous ranges, each of builder_num_workers
+        processes builds one contiguous block of shards with its own FeatureExtractor.
+        rerunning it skips finished shards and resumes at the first incomplete one.
+        a manifest.json with per-shard record counts, byte sizes, checksums and
+        the vocabulary version of caption ids is written into output_dir
+        :param detected_data_file: bboxes data file for images
+        :param fused_source: dict of image_dir and caption_file of the fused build, None to read detected_data_file
+        :param output_dir: dir for tfrecord shards
+        :return:
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        if fused_source is not None:
+            num_images = self._count_source_images(fused_source)
+        else:
+            num_images = self._count_detected_images(detected_data_file)
+        num_shards = min(self.data_config.builder_num_shards, max(num_images, 1))
+        num_workers = min(self.data_config.builder_num_workers, num_shards)
+        shard_ranges = shard_utils.get_shard_ranges(num_images, num_shards)
+        source_params = self._get_source_params(num_images, detected_data_file=detected_data_file,
+                                                fused_source=fused_source)
+        print("building {} images of {} into {} shards with {} workers"
+              .format(num_images, fused_source or detected_data_file, num_shards, num_workers))
+
+        # each worker reads only its own contiguous block of images
+        worker_args = list()
+        for worker_shard_ranges in shard_utils.get_worker_blocks(shard_ranges, num_workers):
+            worker_args.append((self.data_config, split_name, output_dir, detected_data_file,
+                                worker_shard_ranges, num_shards, fused_source, source_params))
+        if num_workers <= 1:
+            shard_infos = self._build_shards(*worker_args[0][1:])
+        else:
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(processes=num_workers) as pool:
+                worker_results = pool.starmap(_build_shards_worker, worker_args)
+            shard_infos = [info for infos in worker_results for info in infos]
+
+        # the projection is saved alongside the data it is applied to
+        build_params = self._get_build_params()
+        projection_info = None
+        if self.feature_projection is not None:
+            shutil.copyfile(self.data_config.feature_projection_file,
+                            os.path.join(output_dir, PROJECTION_FILE_NAME))
+            projection_info = dict(feature_projection.get_projection_info(self.feature_projection),
+                                   file=PROJECTION_FILE_NAME)
+
+        manifest_file = shard_utils.write_manifest(
+            output_dir, shard_infos, data_mode=data_mode, split_name=split_name,
+            detected_data_file=None if fused_source is not None else detected_data_file,
+            fused_source=fused_source, num_images=num_images,
+            vocab_file=self.data_config.vocab_char_txt,
+            feature_projection=projection_info, **build_params)
+        print("saved manifest of {} shards into {}".format(len(shard_infos), manifest_file))
         pass
 
+    def _get_detected_data_file(self, store_dir, detect_file):
+        """the detection store is read if it is built, otherwise the json lines file of the detector"""
+        if detection_store.is_store(store_dir):
+            return store_dir
+        return detect_file
+
+    def _get_fused_source(self, image_dir, caption_file=None):
+        """source of the fused build if data_config.fused_build, otherwise None"""
+        if not self.data_config.fused_build:
+            return None
+        return {"image_dir": image_dir, "caption_file": caption_file}
+
     def build_train_data(self):
-        detect_file = self.data_config.detect_train_file
+        detect_file = self._get_detected_data_file(self.data_config.detect_train_store,
+                                                   self.data_config.detect_train_file)
         output_dir = self.data_config.train_data_dir
         self._build_tfrecords(data_mode=ModeKeys.TRAIN,
+                              split_name="train",
                               detected_data_file=detect_file,
-                              output_dir=output_dir)
+                              output_dir=output_dir,
+                              fused_source=self._get_fused_source(self.data_config.train_image_dir,
+                                                                  self.data_config.train_json_data))
 
     def build_valid_data(self):
-        detect_file = self.data_config.detect_valid_file
+        detect_file = self._get_detected_data_file(self.data_config.detect_valid_store,
+                                                   self.data_config.detect_valid_file)
         output_dir = self.data_config.valid_data_dir
         self._build_tfrecords(data_mode=ModeKeys.TRAIN,
+                              split_name="valid",
                               detected_data_file=detect_file,
-                              output_dir=output_dir)
+                              output_dir=output_dir,
+                              fused_source=self._get_fused_source(self.data_config.valid_image_dir,
+                                                                  self.data_config.valid_json_data))
         pass
 
     def build_test_data(self):
-        detect_file = self.data_config.detect_test_file
+        detect_file = self._get_detected_data_file(self.data_config.detect_test_store,
+                                                   self.data_config.detect_test_file)
         output_dir = self.data_config.test_data_dir
         self._build_tfrecords(data_mode=ModeKeys.INFER,
+                              split_name="test",
                               detected_data_file=detect_file,
-                              output_dir=output_dir)
+                              output_dir=output_dir,
+                              fused_source=self._get_fused_source(self.data_config.test_image_dir))
         pass
 
 
+def _build_shards_worker(data_config, split_name, output_dir, detected_data_file,
+                         shard_ranges, num_shards, fused_source=None, source_params=None):
+    """entry of builder worker process, it owns a separate builder and FeatureExtractor session"""
+    data_builder = ImageCaptionDataBuilder(data_config=data_config)
+    return data_builder._build_shards(split_name=split_name,
+                                      output_dir=output_dir,
+                                      detected_data_file=detected_data_file,
+                                      shard_ranges=shard_ranges,
+                                      num_shards=num_shards,
+                                      fused_source=fused_source,
+                                      source_params=source_params)
+
 
 def main(_):
     data_config = ImageCaptionDataConfig()
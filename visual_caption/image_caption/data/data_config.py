@@ -14,6 +14,11 @@ TOKEN_UNKNOWN = "<UNKNOWN>"
 TOKEN_PAD = '<PAD>'
 TOKEN_UNKNOWN_ID = 0
 
+# caption sampling modes for per-image tfrecords
+CAPTION_MODE_ALL = 'all'  # expand every caption of an image
+CAPTION_MODE_RANDOM = 'random'  # one random caption per image and epoch
+CAPTION_MODE_SAMPLE = 'sample'  # num_caption_samples random captions per image and epoch
+
 MODEL_NAME = 'image_caption'
 MODE = 'train'
 
@@ -36,6 +41,37 @@ class ImageCaptionDataConfig(BaseDataConfig):
 
         self.num_max_bbox = 36
         self.num_visual_features = self.num_max_bbox + 1
+        # region features of bboxes: "crop_resize" runs the backbone on each bbox cut and resized in the graph,
+        # "roi" pools them from the conv feature map of the single whole-image pass,
+        # "crop" is the original mode of tfrecords built before crop_resize, each bbox on a zero canvas
+        # of the whole image size, which is kept for comparable rebuilds of earlier data
+        self.region_feature_mode = "crop_resize"
+        # crops of several images are gathered into runs of feature_batch_size crops (images in roi mode)
+        self.feature_batch_size = 40
+        # jpeg images are decoded at reduced scale with the shorter side at least feature_decode_min_size
+        # before crops are resized to 299 x 299, None to decode at full size
+        self.feature_decode_min_size = 600
+        # fused build: the builder decodes each image once, detects it and extracts its features
+        # in the same pass without the detection files, which are written per shard into detect_dir
+        # only with fused_detect_debug
+        self.fused_build = False
+        self.fused_detect_debug = False
+
+        # each tfrecord holds one image with all of its captions,
+        # the data reader expands or samples them on the fly
+        self.caption_sample_mode = CAPTION_MODE_ALL
+        self.num_caption_samples = 1
+        # dtype of packed caption token ids in tfrecords, 'int16' is enough for char vocabulary
+        self.caption_ids_dtype = 'int32'
+        # storage dtype of image and bbox features in tfrecords (utils/feature_codec),
+        # 'float16' halves and 'int8' quarters record size, features are dequantized by the reader
+        self.feature_dtype = 'float32'
+
+        # batch captions in buckets of similar length, boundaries are caption lengths
+        # without start and end tokens, None for one padded batch over the whole stream
+        self.bucket_boundaries = None  # such as [10, 13, 16, 20]
+        # batch size of each bucket, len(bucket_boundaries) + 1 values, None for batch_size
+        self.bucket_batch_sizes = None
 
         # for raw data
         self.train_rawdata_dir = os.path.join(
@@ -60,12 +96,38 @@ class ImageCaptionDataConfig(BaseDataConfig):
             self.valid_rawdata_dir, "caption_validation_images_20170910")
         self.test_image_dir = os.path.join(
             self.test_rawdata_dir, "caption_test1_images_20170923")
+        # image dirs may also be the zip/tar archives of the distribution or blob dirs of
+        # image_packer (utils/image_source), which avoid opening every small image file
+        self.image_blob_dir = os.path.join(self.model_data_dir, "image_blobs")
+        self.image_blob_shard_bytes = 1 << 30
 
-        # for image region detection dir
+        # for image region detection dir, detection results are appended to json lines files
         self.detect_dir = os.path.join(self.model_data_dir, "detect")
-        self.detect_train_file = os.path.join(self.detect_dir, 'detect_train.json')
-        self.detect_valid_file = os.path.join(self.detect_dir, 'detect_valid.json')
-        self.detect_test_file = os.path.join(self.detect_dir, 'detect_test.json')
+        self.detect_train_file = os.path.join(self.detect_dir, 'detect_train.jsonl')
+        self.detect_valid_file = os.path.join(self.detect_dir, 'detect_valid.jsonl')
+        self.detect_test_file = os.path.join(self.detect_dir, 'detect_test.jsonl')
+        # finished detection results are converted into memory mapped columnar stores read by the builder
+        self.detect_train_store = os.path.join(self.detect_dir, 'detect_train.store')
+        self.detect_valid_store = os.path.join(self.detect_dir, 'detect_valid.store')
+        self.detect_test_store = os.path.join(self.detect_dir, 'detect_test.store')
+        self.detect_flush_every = 100  # detection results are flushed to disk every n images
+        # images are split into detector_num_workers shards detected by separate processes,
+        # each pinned to its own slice of cpu cores
+        self.detector_num_workers = 1
+        self.detector_inter_op_threads = 2
+        # images are decoded by image_prefetch_threads threads ahead of detection and feature extraction,
+        # at most image_prefetch_size images ahead
+        self.image_prefetch_threads = 4
+        self.image_prefetch_size = 32
+        # detections, image features and region features are cached by image content hash,
+        # model and preprocessing params in feature_cache_dir, such as model_data_dir/feature_cache,
+        # None to disable; least recently used segments of all workers are evicted above feature_cache_max_bytes
+        self.feature_cache_dir = None
+        self.feature_cache_max_bytes = 50 << 30
+        # projection of visual features fitted by feature_projector, applied by the builder
+        # with use_feature_projection, runners take dim_visual_feature from data_reader.get_dim_visual_feature()
+        self.feature_projection_file = os.path.join(self.model_data_dir, "feature_projection.npz")
+        self.use_feature_projection = False
 
         # for tfrecord dir
 
@@ -84,6 +146,11 @@ class ImageCaptionDataConfig(BaseDataConfig):
         self.test_tf_data_file = os.path.join(
             self.test_data_dir, "image_caption_test")
 
+        # for tfrecord building, images are split into builder_num_shards shards
+        # and built by builder_num_workers processes
+        self.builder_num_shards = 64
+        self.builder_num_workers = 1
+
         # for prepare txt data
         self.prepare_dir = os.path.join(self.model_data_dir, "prepare")
         self.caption_char_txt = os.path.join(self.prepare_dir, "caption_char.txt")
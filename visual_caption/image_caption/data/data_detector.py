@@ -4,7 +4,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
-import json
+import io
+import multiprocessing
 import os
 import time
 
@@ -12,11 +13,14 @@ import tensorflow as tf
 
 from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
 from visual_caption.image_caption.data.data_loader import ImageCaptionDataLoader
+from visual_caption.image_caption.data import detection_store
+from visual_caption.utils import feature_cache, image_source, image_utils, jsonl_utils, shard_utils
 from visual_caption.utils.decorator_utils import timeit
-from visual_caption.image_caption.feature.faster_rcnn_detector import FasterRCNNDetector, DetectorConfig
+from visual_caption.utils.image_prefetcher import ImagePrefetcher
+from visual_caption.image_caption.feature.faster_rcnn_detector import FasterRCNNDetector, DetectorConfig, \
+    get_detection_params
 
-detector_config = DetectorConfig()
-faster_rcnn_detector = FasterRCNNDetector(detector_config)
+DETECT_CHUNK_SIZE = 80  # images of a chunk are grouped by resolution and detected together
 
 
 def get_image_id(image_filepath):
@@ -27,76 +31,242 @@ def get_image_id(image_filepath):
     return image_id
 
 
+def get_detection_cache_key(detector_config, content_hash):
+    """feature cache key of the detection of an image by detector_config"""
+    return feature_cache.make_key("detection", content_hash, feature_cache.get_model_id(detector_config.model_ckpt),
+                                  get_detection_params(detector_config))
+
+
+def get_worker_cores(num_workers):
+    """
+    split the cpu cores available to this process into num_workers contiguous slices
+    :return: list of core lists, None for each worker if cpu affinity is not supported
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * num_workers
+    cores = sorted(os.sched_getaffinity(0))
+    worker_cores = list()
+    for worker_index in range(num_workers):
+        start = worker_index * len(cores) // num_workers
+        end = (worker_index + 1) * len(cores) // num_workers
+        worker_cores.append(cores[start:max(end, start + 1)])
+    return worker_cores
+
+
 class ImageCaptionDataDetector(object):
     """
     a special data builder for mscoco data
 
     in order to detect the regions of objects in mscoco image
     convert coco metadata to metadata with bboxes
-    saved to json data
+    appended to json lines data as images are detected,
+    rerunning it skips images already detected in the target file.
+    with data_config.detector_num_workers > 1, images are split into contiguous shards
+    detected by worker processes into part files, which are merged in original order
     """
 
-    def __init__(self, data_config):
+    def __init__(self, data_config, detector_config=None):
         self.data_config = data_config
         self.data_loader = ImageCaptionDataLoader()
-        self.detector = faster_rcnn_detector
+        self.detector_config = detector_config or DetectorConfig()
+        self._detector = None
+        self.feature_cache = None
+        if data_config.feature_cache_dir is not None:
+            self.feature_cache = feature_cache.FeatureCache(data_config.feature_cache_dir,
+                                                            max_bytes=data_config.feature_cache_max_bytes)
+
+    @property
+    def detector(self):
+        """detector session is created on first use, one for each process"""
+        if self._detector is None:
+            self._detector = FasterRCNNDetector(self.detector_config)
+        return self._detector
+
+    def _load_image_or_detection(self, image_file):
+        """
+        look up the detection of image_file in the feature cache by its content,
+        the image is decoded only on a cache miss
+        :return: (cache key, cached image_dict or None, (decoded image, full size shape) or None)
+        """
+        min_size = self.detector_config.decode_min_size
+        if self.feature_cache is None:
+            return None, None, image_utils.decode_image(image_file, min_size=min_size)
+        # the image is read once for its content hash and decoding
+        image_bytes = image_source.read_image_file(image_file)
+        cache_key = get_detection_cache_key(self.detector_config, feature_cache.get_bytes_hash(image_bytes))
+        image_dict = self.feature_cache.get(cache_key)
+        if image_dict is not None:
+            return cache_key, image_dict, None
+        return cache_key, None, image_utils.decode_image(io.BytesIO(image_bytes), min_size=min_size)
 
     @timeit
     def build_bbox_data(self, caption_file, image_dir, target_file):
         print('[caption file is {},image_dir is {}]'.format(caption_file,image_dir))
+        num_workers = self.data_config.detector_num_workers
+        if num_workers <= 1:
+            self._detect_caption_images(caption_file=caption_file, image_dir=image_dir,
+                                        target_file=target_file)
+            return
+        num_images = 0
+        for batch_data in self.data_loader.load_raw_generator(
+                json_data_file=caption_file, image_dir=image_dir):
+            num_images += len(batch_data)
+        worker_kwargs = list()
+        for shard_index, start, end in shard_utils.get_shard_ranges(num_images, num_workers):
+            worker_kwargs.append({
+                "caption_file": caption_file, "image_dir": image_dir,
+                "target_file": shard_utils.get_part_file(target_file, shard_index, num_workers),
+                "skip_file": target_file, "start": start, "end": end})
+        # records are merged in the order of images in caption_file
+        self._detect_in_workers("_detect_caption_images", worker_kwargs, target_file,
+                                sort_key=lambda record: record['id'])
+
+    def build_bbox_test_data(self, test_image_dir, target_file):
+        image_files = image_source.get_image_source(test_image_dir).list_names()[:1001]  # for partial data
+        num_workers = self.data_config.detector_num_workers
+        if num_workers <= 1:
+            self._detect_test_images(test_image_dir=test_image_dir, image_files=image_files,
+                                     target_file=target_file)
+            return
+        worker_kwargs = list()
+        for shard_index, start, end in shard_utils.get_shard_ranges(len(image_files), num_workers):
+            worker_kwargs.append({
+                "test_image_dir": test_image_dir, "image_files": image_files[start:end],
+                "target_file": shard_utils.get_part_file(target_file, shard_index, num_workers),
+                "skip_file": target_file})
+        image_indices = {get_image_id(image_file): index for index, image_file in enumerate(image_files)}
+        self._detect_in_workers("_detect_test_images", worker_kwargs, target_file,
+                                sort_key=lambda record: image_indices.get(record['image_id'], -1))
+
+    def _detect_in_workers(self, method_name, worker_kwargs, target_file, sort_key):
+        """
+        run method_name with each of worker_kwargs in a separate process pinned to a slice of cores,
+        and merge the part files of all workers and the records target_file already holds
+        in input order
+        :param sort_key: function of a record to the index of its image in the input
+        """
+        num_workers = len(worker_kwargs)
+        worker_cores = get_worker_cores(num_workers)
+        worker_args = [(self.data_config, worker_cores[worker_index], method_name, kwargs)
+                       for worker_index, kwargs in enumerate(worker_kwargs)]
+        print("detecting {} shards of {} with {} workers".format(num_workers, target_file, num_workers))
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=num_workers) as pool:
+            pool.starmap(_detect_worker, worker_args)
+        jsonl_utils.merge_jsonl_files([kwargs["target_file"] for kwargs in worker_kwargs], target_file,
+                                      sort_key=sort_key)
+        print("merged {} shards into {}".format(num_workers, target_file))
+
+    def _load_detected_ids(self, target_file, skip_file=None):
+        detected_ids = jsonl_utils.load_jsonl_keys(target_file, key="image_id")
+        if skip_file is not None:
+            detected_ids |= jsonl_utils.load_jsonl_keys(skip_file, key="image_id")
+        print("skip {} images already detected in {}".format(len(detected_ids), target_file))
+        return detected_ids
+
+    def _detect_caption_images(self, caption_file, image_dir, target_file, skip_file=None,
+                               start=0, end=None):
+        """
+        detect images [start, end) of caption_file and append them to target_file,
+        images already in target_file or skip_file are skipped
+        """
+        detected_ids = self._load_detected_ids(target_file, skip_file)
         data_gen = self.data_loader.load_raw_generator(
             json_data_file=caption_file, image_dir=image_dir)
-        # convert metadata of each image to bbox record
-        image_list = list()  # batch data for images
-        start = time.time()
-        for batch, batch_data in enumerate(data_gen):
-            for idx, image_data in enumerate(batch_data):
-                image_filename =image_data['image_file']
-                image_dict = self.detector.detect_image(
-                    image_path=image_filename)
-                image_dict['id'] = image_data['id']
-                image_dict['url'] = image_data['url']
-                image_dict["image_id"] = image_data['image_id']
-                image_dict["image_file"] = image_data['image_file']
-                image_dict["captions"] = image_data['captions']
-
-                image_list.append(image_dict)
-                length = len(image_list)
-                if length % 100 == 0:
-                    elapsed = time.time() - start
-                    print("detected {} images for {}, elapsed {}."
-                          .format(length, caption_file, elapsed))
-            # if batch >= 10:  # for partial data
-            #     break
-        with open(target_file, 'w') as fp:
-            json.dump(image_list, fp=fp, sort_keys=True)
-            print("dumped metadata from {} to {}".format(caption_file, target_file))
 
-    def build_bbox_test_data(self, test_image_dir, target_file):
-        image_list = list()  # batch data for images
-        start = time.time()
-        image_files = os.listdir(test_image_dir)
-        for idx, image_file in enumerate(image_files):
-            image_file_path = os.path.join(test_image_dir, image_file)
-            image_dict = self.detector.detect_image(image_path=image_file_path)
-            image_id = get_image_id(image_file)
-
-            image_dict["image_id"] = image_id
-            image_dict["image_filepath"] = image_file_path
+        def _pending_items():
+            for batch_data in data_gen:
+                for image_data in batch_data:
+                    if image_data['id'] < start or image_data['image_id'] in detected_ids:
+                        continue
+                    if end is not None and image_data['id'] >= end:
+                        return
+                    yield image_data
+
+        def _to_bbox_record(image_data, image_dict):
+            # convert metadata of each image to bbox record
+            image_dict['id'] = image_data['id']
+            image_dict['url'] = image_data['url']
+            image_dict["image_id"] = image_data['image_id']
+            image_dict["image_file"] = image_data['image_file']
+            image_dict["captions"] = image_data['captions']
+            return image_dict
+
+        self._detect_items(items=_pending_items(), image_file_key='image_file',
+                           to_record=_to_bbox_record, target_file=target_file)
+
+    def _detect_test_images(self, test_image_dir, image_files, target_file, skip_file=None):
+        """
+        detect image_files of test_image_dir and append them to target_file,
+        images already in target_file or skip_file are skipped
+        """
+        detected_ids = self._load_detected_ids(target_file, skip_file)
+        items = [{"image_id": get_image_id(image_file),
+                  "image_filepath": os.path.join(test_image_dir, image_file)}
+                 for image_file in image_files if get_image_id(image_file) not in detected_ids]
+
+        def _to_bbox_record(image_data, image_dict):
+            image_dict["image_id"] = image_data["image_id"]
+            image_dict["image_filepath"] = image_data["image_filepath"]
             image_dict["captions"] = ["This is a test caption text"]
-            image_list.append(image_dict)
-            length = len(image_list)
-            if length % 10 == 0:
-                elapsed = time.time() - start
-                print("detected {} images for {}, elapsed {}."
-                      .format(length, test_image_dir, elapsed))
-            if idx >= 1000:  # for partial data
-                break
-
-        with open(target_file, 'w') as fp:
-            json.dump(image_list, fp=fp, sort_keys=True)
-            print("dumped metadata from {} to {}".format(
-                test_image_dir, target_file))
+            return image_dict
+
+        self._detect_items(items=items, image_file_key='image_filepath',
+                           to_record=_to_bbox_record, target_file=target_file)
+
+    def _detect_items(self, items, image_file_key, to_record, target_file):
+        """
+        detect images of items in chunks of DETECT_CHUNK_SIZE and append their records to target_file,
+        images are decoded by an ImagePrefetcher while the previous chunk is detected,
+        images detected before with the same detector and params are read from the feature cache
+        :param items: iterable of image data dicts
+        :param image_file_key: key of image file path in image data
+        :param to_record: function of (image_data, image_dict) to the record written
+        """
+        begin = time.time()
+        prefetcher = ImagePrefetcher(items,
+                                     load_fn=lambda image_data: self._load_image_or_detection(
+                                         image_data[image_file_key]),
+                                     num_threads=self.data_config.image_prefetch_threads,
+                                     queue_size=self.data_config.image_prefetch_size)
+        writer = jsonl_utils.JsonLinesWriter(target_file, self.data_config.detect_flush_every)
+        with prefetcher, writer:
+            chunk_data, chunk_loaded = list(), list()
+            for image_data, loaded in prefetcher:
+                chunk_data.append(image_data)
+                chunk_loaded.append(loaded)
+                if len(chunk_data) < DETECT_CHUNK_SIZE:
+                    continue
+                self._detect_chunk(chunk_data, chunk_loaded, to_record, writer)
+                chunk_data, chunk_loaded = list(), list()
+                print("detected {} images for {}, elapsed {}, prefetch {}, cache {}."
+                      .format(writer.count, target_file, time.time() - begin, prefetcher.get_stats(),
+                              self._get_cache_stats()))
+            if len(chunk_data) > 0:
+                self._detect_chunk(chunk_data, chunk_loaded, to_record, writer)
+            print("appended {} detected images to {}, elapsed {}, prefetch {}, cache {}"
+                  .format(writer.count, target_file, time.time() - begin, prefetcher.get_stats(),
+                          self._get_cache_stats()))
+
+    def _detect_chunk(self, chunk_data, chunk_loaded, to_record, writer):
+        """
+        detect images of the chunk missing in the feature cache and write records of all images in order
+        :param chunk_loaded: list of (cache key, cached image_dict or None, (decoded image, full size shape) or None)
+        """
+        image_dicts = [image_dict for _, image_dict, _ in chunk_loaded]
+        missing = [idx for idx, image_dict in enumerate(image_dicts) if image_dict is None]
+        if len(missing) > 0:
+            detected_dicts = self.detector.detect_arrays([chunk_loaded[idx][2][0] for idx in missing],
+                                                         original_shapes=[chunk_loaded[idx][2][1] for idx in missing])
+            for idx, image_dict in zip(missing, detected_dicts):
+                image_dicts[idx] = image_dict
+                if self.feature_cache is not None:
+                    self.feature_cache.put(chunk_loaded[idx][0], image_dict)
+        for image_data, image_dict in zip(chunk_data, image_dicts):
+            writer.write(to_record(image_data, image_dict))
+
+    def _get_cache_stats(self):
+        return self.feature_cache.get_stats() if self.feature_cache is not None else None
 
     @timeit
     def build_train_data(self):
@@ -107,6 +277,7 @@ class ImageCaptionDataDetector(object):
             caption_file=caption_file,
             image_dir=image_dir,
             target_file=detect_file)
+        detection_store.build_store(detect_file, self.data_config.detect_train_store)
 
     @timeit
     def build_valid_data(self):
@@ -117,6 +288,7 @@ class ImageCaptionDataDetector(object):
             caption_file=caption_file,
             image_dir=image_dir,
             target_file=detect_file)
+        detection_store.build_store(detect_file, self.data_config.detect_valid_store)
 
     @timeit
     def build_test_data(self):
@@ -124,6 +296,7 @@ class ImageCaptionDataDetector(object):
         detect_file = self.data_config.detect_test_file
         self.build_bbox_test_data(
             test_image_dir=image_dir, target_file=detect_file)
+        detection_store.build_store(detect_file, self.data_config.detect_test_store)
 
     @timeit
     def build_all_bbox(self):
@@ -138,5 +311,19 @@ def main(_):
     data_detector.build_all_bbox()
 
 
+def _detect_worker(data_config, cpu_cores, method_name, kwargs):
+    """
+    entry of detector worker process, it is pinned to cpu_cores and
+    owns a separate detector session whose intra op threads match the cores
+    """
+    detector_config = DetectorConfig()
+    if cpu_cores is not None:
+        os.sched_setaffinity(0, cpu_cores)
+        detector_config.intra_op_threads = len(cpu_cores)
+    detector_config.inter_op_threads = data_config.detector_inter_op_threads
+    data_detector = ImageCaptionDataDetector(data_config, detector_config=detector_config)
+    getattr(data_detector, method_name)(**kwargs)
+
+
 if __name__ == '__main__':
     tf.app.run()
@@ -30,7 +30,8 @@ class ImageCaptionDataLoader(BaseDataLoader):
         """
         load json file and yield data in batch
         :param json_data_file:
-        :param image_dir:
+        :param image_dir: image dir, zip or tar of the original distribution or blob dir of packed images,
+            image_file of each image is a path inside it read by utils/image_source
         :return:
         """
         batch_data = []
@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Report of caption padding removed by length-bucketed batching
+import bisect
+import random
+
+import tensorflow as tf
+
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+
+tf.flags.DEFINE_string("bucket_boundaries", "10,13,16,20",
+                       "comma separated caption length boundaries of buckets")
+tf.flags.DEFINE_integer("batch_size", 200, "batch size of each bucket")
+FLAGS = tf.flags.FLAGS
+
+
+def load_caption_lengths(caption_char_txt):
+    """
+    caption lengths from caption char txt, each line is like: <S> 这 是 一 个 例 子 </S>
+    start and end tokens are not counted
+    """
+    caption_lengths = list()
+    with open(caption_char_txt, mode='r', encoding='utf-8') as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) > 2:
+                caption_lengths.append(len(tokens) - 2)
+    return caption_lengths
+
+
+def _batch_steps(batch_lengths):
+    """(real steps, padded steps) of one batch, input ids have start and end tokens"""
+    seq_lengths = [length + 2 for length in batch_lengths]
+    return sum(seq_lengths), max(seq_lengths) * len(seq_lengths)
+
+
+def padded_batch_steps(caption_lengths, batch_size):
+    real_steps, padded_steps = 0, 0
+    for begin in range(0, len(caption_lengths), batch_size):
+        batch_real, batch_padded = _batch_steps(caption_lengths[begin:begin + batch_size])
+        real_steps += batch_real
+        padded_steps += batch_padded
+    return real_steps, padded_steps
+
+
+def bucketed_batch_steps(caption_lengths, bucket_boundaries, bucket_batch_sizes):
+    """same batching as tf.contrib.data.bucket_by_sequence_length over the stream"""
+    buckets = [list() for _ in range(len(bucket_boundaries) + 1)]
+    real_steps, padded_steps = 0, 0
+    for length in caption_lengths:
+        bucket_id = bisect.bisect_right(bucket_boundaries, length)
+        bucket = buckets[bucket_id]
+        bucket.append(length)
+        if len(bucket) == bucket_batch_sizes[bucket_id]:
+            batch_real, batch_padded = _batch_steps(bucket)
+            real_steps += batch_real
+            padded_steps += batch_padded
+            del bucket[:]
+    for bucket in buckets:  # partial batches at the end of the stream
+        if len(bucket) > 0:
+            batch_real, batch_padded = _batch_steps(bucket)
+            real_steps += batch_real
+            padded_steps += batch_padded
+    return real_steps, padded_steps
+
+
+def padding_report(caption_lengths, batch_size, bucket_boundaries,
+                   bucket_batch_sizes=None, random_seed=123):
+    """
+    compare padded RNN steps of one padded batch with length-bucketed batching
+    on a shuffled stream of caption lengths
+    :return: dict of real steps, padded steps and padding ratios
+    """
+    if bucket_batch_sizes is None:
+        bucket_batch_sizes = [batch_size] * (len(bucket_boundaries) + 1)
+    caption_lengths = list(caption_lengths)
+    random.Random(random_seed).shuffle(caption_lengths)
+    real_steps, padded_steps = padded_batch_steps(caption_lengths, batch_size)
+    _, bucketed_steps = bucketed_batch_steps(
+        caption_lengths, bucket_boundaries, bucket_batch_sizes)
+    return {
+        "num_captions": len(caption_lengths),
+        "real_steps": real_steps,
+        "padded_steps": padded_steps,
+        "bucketed_steps": bucketed_steps,
+        "padded_ratio": (padded_steps - real_steps) / padded_steps,
+        "bucketed_ratio": (bucketed_steps - real_steps) / bucketed_steps,
+        "removed_steps": (padded_steps - bucketed_steps) / padded_steps,
+    }
+
+
+def main(_):
+    data_config = ImageCaptionDataConfig()
+    bucket_boundaries = [int(value) for value in FLAGS.bucket_boundaries.split(",")]
+    caption_lengths = load_caption_lengths(data_config.caption_char_txt)
+    report = padding_report(caption_lengths, batch_size=FLAGS.batch_size,
+                            bucket_boundaries=bucket_boundaries)
+    print("captions={num_captions}, real steps={real_steps}".format(**report))
+    print("padded batching:   steps={padded_steps}, padding={padded_ratio:.2%}".format(**report))
+    print("bucketed batching: steps={bucketed_steps}, padding={bucketed_ratio:.2%}".format(**report))
+    print("bucketing removes {removed_steps:.2%} of RNN steps".format(**report))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -5,13 +5,44 @@ from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
 # Data Reader class for AI_Challenge_2017
+import os
+
 import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.learn import ModeKeys
 from tensorflow.python.ops import lookup_ops
 
 from visual_caption.base.data.base_data_reader import BaseDataReader
-from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig, \
+    CAPTION_MODE_ALL, CAPTION_MODE_RANDOM, CAPTION_MODE_SAMPLE
+from visual_caption.utils import shard_utils
+
+# names of features in each batch, models select the features they consume
+IMAGE_FEATURES = ('image_id', 'image_height', 'image_width', 'image_depth', 'image_feature')
+BBOX_FEATURES = ('bbox_shape', 'bbox_number', 'bbox_labels', 'bboxes', 'bbox_features')
+CAPTION_FEATURES = ('caption_ids', 'fw_target_ids', 'bw_target_ids',
+                    'caption_length', 'fw_target_length', 'bw_target_length')
+ALL_FEATURES = IMAGE_FEATURES + BBOX_FEATURES + CAPTION_FEATURES
+
+# tfrecord keys parsed for each feature, caption keys are always parsed
+_FEATURE_RECORD_KEYS = {
+    'image_id': ('image/image_id',),
+    'image_height': ('image/height',),
+    'image_width': ('image/width',),
+    'image_depth': ('image/depth',),
+    'image_feature': ('image/feature',),
+    'bbox_shape': ('bbox/number',),
+    'bbox_number': ('bbox/number',),
+    'bbox_labels': ('bbox/number', 'bbox/labels'),
+    'bboxes': ('bbox/number', 'bbox/bboxes'),
+    'bbox_features': ('bbox/number', 'bbox/features'),
+}
+_CAPTION_RECORD_KEYS = ('caption/number', 'caption/lengths', 'caption/ids')
+# scales of int8 features are parsed besides the features
+_SCALE_RECORD_KEYS = {
+    'image_feature': ('image/feature_scale',),
+    'bbox_features': ('bbox/feature_scales',),
+}
 
 
 class Vocabulary(object):
@@ -78,6 +109,7 @@ class ImageCaptionDataReader(BaseDataReader):
       """
 
     def __init__(self, data_config):
+        # vocab_table is kept for models, captions in tfrecords are already token ids
         self.vocab_table = lookup_ops.index_table_from_file(
             vocabulary_file=data_config.vocab_char_txt,
             default_value=0)
@@ -85,106 +117,266 @@ class ImageCaptionDataReader(BaseDataReader):
                                      start_word=data_config.token_start,
                                      end_word=data_config.token_end,
                                      unk_word=data_config.token_unknown)
+        self.caption_ids_dtype = data_config.caption_ids_dtype
+        self.feature_dtype = data_config.feature_dtype
+        self.dim_visual_feature = data_config.dim_visual_feature
+        self._decode_params = None
+        self._check_manifest(data_config)
         super(ImageCaptionDataReader, self).__init__(
             data_config=data_config)
 
-    def _mapping_dataset(self, dataset):
+    def _check_manifest(self, data_config):
+        """
+        check the vocabulary version of built tfrecords against current vocabulary,
+        and take the caption ids dtype, feature dtype and feature dim the tfrecords were built with
+        """
+        manifest = shard_utils.load_manifest(data_config.train_data_dir)
+        if manifest is None:
+            return
+        self._decode_params = self._get_decode_params(manifest, data_config)
+        vocab_version = shard_utils.get_file_checksum(data_config.vocab_char_txt)
+        if manifest.get("vocab_version") != vocab_version:
+            tf.logging.warn("tfrecords in %s are built with vocabulary version %s, "
+                            "but current vocabulary %s has version %s",
+                            data_config.train_data_dir, manifest.get("vocab_version"),
+                            data_config.vocab_char_txt, vocab_version)
+        self.caption_ids_dtype = self._decode_params["caption_ids_dtype"]
+        self.feature_dtype = self._decode_params["feature_dtype"]
+        # projected features have the dim of the projection
+        self.dim_visual_feature = self._decode_params["dim_visual_feature"]
+        if self.dim_visual_feature != data_config.dim_visual_feature:
+            tf.logging.info("tfrecords in %s hold visual features of dim %d instead of data_config %d",
+                            data_config.train_data_dir, self.dim_visual_feature, data_config.dim_visual_feature)
+
+    def get_dim_visual_feature(self):
+        """dim of visual features in the tfrecords, models must be built with it"""
+        return self.dim_visual_feature
+
+    @staticmethod
+    def _get_decode_params(manifest, data_config):
+        """params of a manifest records are decoded with, all splits must agree on them"""
+        return {
+            "vocab_version": manifest.get("vocab_version"),
+            "caption_ids_dtype": manifest.get("caption_ids_dtype", data_config.caption_ids_dtype),
+            # tfrecords built before feature dtypes hold float32 features
+            "feature_dtype": manifest.get("feature_dtype", 'float32'),
+            "dim_visual_feature": manifest.get("dim_visual_feature", data_config.dim_visual_feature),
+            "feature_projection_checksum": manifest.get("feature_projection_checksum"),
+        }
+
+    def _get_dataset(self, data_dir, shuffle_files=False, seed=None, skip_batches=None):
+        """records of data_dir are decoded with the params of train tfrecords, they must be built alike"""
+        manifest = shard_utils.load_manifest(data_dir)
+        if manifest is not None and self._decode_params is not None:
+            decode_params = self._get_decode_params(manifest, self.data_config)
+            if decode_params != self._decode_params:
+                raise ValueError("tfrecords in {} are built with {}, but train tfrecords with {}, rebuild them alike"
+                                 .format(data_dir, decode_params, self._decode_params))
+        return super(ImageCaptionDataReader, self)._get_dataset(
+            data_dir, shuffle_files=shuffle_files, seed=seed, skip_batches=skip_batches)
+
+    def _get_features(self):
+        """names of selected features in each batch"""
+        if self.features is None:
+            return ALL_FEATURES
+        return self.features
+
+    def _mapping_dataset(self, dataset, seed):
         num_threads = self.data_config.num_preprocess_threads
-        dim_visual_feature = self.data_config.dim_visual_feature
-        buffer_size = self.data_config.output_buffer_size
-        random_seed = self.data_config.random_seed
+        buffer_size = self.data_config.shuffle_buffer_size
+
+        # expand per-image records into per-caption elements
+        dataset = dataset.flat_map(
+            lambda parsed_example: self._select_captions(parsed_example, seed=seed))
+
         if self.data_config.mode == ModeKeys.TRAIN:
             dataset = dataset.shuffle(
-                buffer_size=buffer_size, seed=random_seed)
+                buffer_size=buffer_size, seed=seed)
+
+        dataset = self._batching_dataset(dataset)
+
+        # add token ids of input, forward and backward targets and their lengths
+        dataset = dataset.map(self._build_caption_ids, num_parallel_calls=num_threads)
+        return dataset
+        pass
 
-        # add target and add prefix to caption and suffix to
-        token_start = self.data_config.token_start
-        token_end = self.data_config.token_end
+    def _get_padded_shapes_and_values(self, element_names):
+        """
+        padded shapes and values of per-caption elements, captions are padded with token_pad_id
+        :param element_names: names of features in each element
+        """
+        dim_visual_feature = self.dim_visual_feature
         token_pad = self.data_config.token_pad
         token_pad_id = self.vocabulary.vocab[token_pad]
+        padded_shapes = {
+            'image_id': tf.TensorShape([]),
+            'image_height': tf.TensorShape([]),
+            'image_width': tf.TensorShape([]),
+            'image_depth': tf.TensorShape([]),
+            'image_feature': tf.TensorShape([dim_visual_feature]),
+
+            'bbox_shape': tf.TensorShape([None]),
+            'bbox_number': tf.TensorShape([]),
+            'bbox_labels': tf.TensorShape([None]),
+            'bboxes': tf.TensorShape([None]),
+            'bbox_features': tf.TensorShape([None, None]),
+
+            'caption': tf.TensorShape([None]),
+            'caption_length': tf.TensorShape([]),
+        }
+        padding_values = {
+            'image_id': token_pad,
+            'image_height': np.int32(0),
+            'image_width': np.int32(0),
+            'image_depth': np.int32(0),
+            'image_feature': np.float32(0),
+
+            'bbox_shape': np.int32(0),
+            'bbox_number': np.int32(0),
+            'bbox_labels': np.int64(0),
+            'bboxes': np.int64(0),
+            'bbox_features': np.float32(0),
+
+            'caption': np.int32(token_pad_id),
+            'caption_length': np.int32(0),
+        }
+        padded_shapes = {name: padded_shapes[name] for name in element_names}
+        padding_values = {name: padding_values[name] for name in element_names}
+        return padded_shapes, padding_values
 
-        dataset = dataset.map(
-            lambda image_id, image_height, image_width, image_depth, image_feature,
-                   bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                   caption: (
-                image_id, image_height, image_width, image_depth, image_feature,
-                bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                # tf.slice(caption, begin=[], size=[0, ])
-
-                tf.concat(([token_start], caption, [token_end]), axis=0),
-                tf.concat((caption, [token_end], [token_end]), axis=0),
-                tf.concat(([token_start], [token_start], caption), axis=0)
-
-            ), num_parallel_calls=num_threads)
-
-        # add caption_ids and target_ids
-        dataset = dataset.map(
-            lambda image_id, image_height, image_width, image_depth, image_feature,
-                   bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                   caption, fw_target, bw_target: (
-                image_id, image_height, image_width, image_depth, image_feature,
-                bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                caption, fw_target, bw_target,
-                tf.cast(self.vocab_table.lookup(caption), tf.int32),
-                tf.cast(self.vocab_table.lookup(fw_target), tf.int32),
-                tf.cast(self.vocab_table.lookup(bw_target), tf.int32)
-            ), num_parallel_calls=num_threads)
-
-        # Add in sequence lengths.
-        dataset = dataset.map(
-            lambda image_id, image_height, image_width, image_depth, image_feature,
-                   bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                   caption, fw_target, bw_target,
-                   caption_ids, fw_target_ids, bw_target_ids: (
-                image_id, image_height, image_width, image_depth, image_feature,
-                bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                caption, fw_target, bw_target, caption_ids, fw_target_ids, bw_target_ids,
-                tf.size(caption_ids), tf.size(fw_target_ids), tf.size(bw_target_ids),  # caption_length
-            ), num_parallel_calls=num_threads)
-
-        def batching_func(x):
-            return x.padded_batch(
+    def _batching_dataset(self, dataset):
+        """
+        batch per-caption elements, captions are bucketed by length if
+        data_config.bucket_boundaries is set, otherwise padded to the longest caption of the batch
+        """
+        padded_shapes, padding_values = self._get_padded_shapes_and_values(
+            dataset.output_shapes.keys())
+        bucket_boundaries = self.data_config.bucket_boundaries
+        if not bucket_boundaries:
+            return dataset.padded_batch(
                 batch_size=self.data_config.batch_size,
-                padded_shapes=(
-                    tf.TensorShape([]),  # image_id
-                    tf.TensorShape([]),  # width
-                    tf.TensorShape([]),  # height
-                    tf.TensorShape([]),  # depth
-                    tf.TensorShape([dim_visual_feature]),  # image_feature
-
-                    tf.TensorShape([None]),  # image_bbox_shape
-                    tf.TensorShape([]),  # number of bboxes
-                    tf.TensorShape([None]),  # labels
-                    tf.TensorShape([None]),  # bboxes
-                    tf.TensorShape([None, None]),  # image_bbox_features
-
-                    tf.TensorShape([None]),  # caption
-                    tf.TensorShape([None]),  # fw_target
-                    tf.TensorShape([None]),  # bw_target
-                    tf.TensorShape([None]),  # caption_ids
-                    tf.TensorShape([None]),  # fw_target_ids
-                    tf.TensorShape([None]),  # bw_target_ids
-
-                    tf.TensorShape([]),  # caption_length
-                    tf.TensorShape([]),  # fw_target_length
-                    tf.TensorShape([]),  # bw_target_length
-                ),
-                padding_values=(
-                    token_pad, np.int32(0), np.int32(0), np.int32(0), np.float32(0),
-                    np.int32(0), np.int32(0), np.int64(0), np.int64(0), np.float32(0),
-
-                    token_pad, token_pad, token_pad,
-                    np.int32(token_pad_id), np.int32(token_pad_id), np.int32(token_pad_id),
-                    np.int32(0), np.int32(0), np.int32(0)
-                )
-            )
-
-        dataset = batching_func(dataset)
+                padded_shapes=padded_shapes,
+                padding_values=padding_values)
+
+        bucket_batch_sizes = self.data_config.bucket_batch_sizes
+        if bucket_batch_sizes is None:
+            bucket_batch_sizes = [self.data_config.batch_size] * (len(bucket_boundaries) + 1)
+        return dataset.apply(tf.contrib.data.bucket_by_sequence_length(
+            element_length_func=lambda element: element['caption_length'],
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=bucket_batch_sizes,
+            padded_shapes=padded_shapes,
+            padding_values=padding_values))
+
+    def _build_caption_ids(self, element):
+        """
+        build input, forward target and backward target ids for a padded batch of captions
+        by slicing <S> <S> caption </S> </S> of each row:
+            input:     <S> caption </S>
+            fw_target: caption </S> </S>
+            bw_target: <S> <S> caption
+        positions beyond caption_length are filled with token_pad_id,
+        only the selected features are kept in the batch
+        """
+        element = dict(element)
+        captions = element.pop('caption')
+        caption_lengths = element.pop('caption_length')
+
+        token_pad_id = self.vocabulary.vocab[self.data_config.token_pad]
+        batch_size = tf.shape(captions)[0]
+        max_length = tf.shape(captions)[1]
+
+        start_ids = tf.fill([batch_size, 2], self.vocabulary.start_id)
+        pad_ids = tf.fill([batch_size, 2], token_pad_id)
+        padded_captions = tf.concat((start_ids, captions, pad_ids), axis=1)
+        positions = tf.expand_dims(tf.range(max_length + 4), axis=0)
+        expanded_lengths = tf.expand_dims(caption_lengths, axis=1)
+        end_mask = tf.logical_and(positions >= expanded_lengths + 2,
+                                  positions < expanded_lengths + 4)
+        padded_captions = tf.where(end_mask,
+                                   tf.fill(tf.shape(padded_captions), self.vocabulary.end_id),
+                                   padded_captions)
+
+        seq_lengths = caption_lengths + 2
+        seq_mask = tf.sequence_mask(seq_lengths, maxlen=max_length + 2)
+        seq_pads = tf.fill([batch_size, max_length + 2], token_pad_id)
+        element['caption_ids'] = tf.where(seq_mask, padded_captions[:, 1:-1], seq_pads)
+        element['fw_target_ids'] = tf.where(seq_mask, padded_captions[:, 2:], seq_pads)
+        element['bw_target_ids'] = tf.where(seq_mask, padded_captions[:, :-2], seq_pads)
+        element['caption_length'] = seq_lengths
+        element['fw_target_length'] = seq_lengths
+        element['bw_target_length'] = seq_lengths
+        return {name: element[name] for name in self._get_features()}
+
+    def _select_captions(self, parsed_example, seed=None):
+        """
+        decode variable length fields of one parsed image record and
+        expand it into a dataset of its captions,
+        according to data_config.caption_sample_mode:
+            all:    every caption of the image
+            random: one random caption each epoch
+            sample: num_caption_samples random captions each epoch
+        captions are sampled by stateless random ops seeded by seed and the record content,
+        so the same seed always selects the same captions
+        """
+        if seed is None:
+            seed = self.data_config.random_seed
+        features = self._get_features()
+        dim_visual_feature = self.dim_visual_feature
+        element = {name: parsed_example[name]
+                   for name in IMAGE_FEATURES + ('bbox_number',) if name in features}
+
+        # variable length fields are padded by batched parsing, trim them
+        bbox_number = parsed_example.get('bbox_number')
+        if 'bbox_shape' in features:
+            element['bbox_shape'] = tf.stack([bbox_number, dim_visual_feature])
+        if 'bbox_labels' in features:
+            element['bbox_labels'] = parsed_example['bbox_labels'][:bbox_number]
+        if 'bboxes' in features:
+            element['bboxes'] = parsed_example['bboxes'][:bbox_number * 4]
+        if 'bbox_features' in features:
+            element['bbox_features'] = self._decode_features(
+                parsed_example['bbox_features'], parsed_example.get('bbox_feature_scales'),
+                tf.stack([bbox_number, dim_visual_feature]))
+
+        caption_number = parsed_example['caption_number']
+        caption_lengths = parsed_example['caption_lengths'][:caption_number]
+        captions = tf.decode_raw(parsed_example['caption_ids'], tf.as_dtype(self.caption_ids_dtype))
+        captions = tf.cast(captions, tf.int32)
+
+        sample_mode = self.data_config.caption_sample_mode
+        caption_offsets = tf.cumsum(caption_lengths, exclusive=True)
+        caption_indices = tf.range(caption_number)
+        if sample_mode == CAPTION_MODE_RANDOM:
+            num_samples = 1
+        elif sample_mode == CAPTION_MODE_SAMPLE:
+            num_samples = self.data_config.num_caption_samples
+        elif sample_mode == CAPTION_MODE_ALL:
+            num_samples = None
+        else:
+            raise ValueError("Unknown caption_sample_mode %s" % sample_mode)
+        if num_samples is not None:
+            record_seed = tf.string_to_hash_bucket_fast(parsed_example['caption_ids'], 2 ** 31 - 1)
+            random_values = tf.contrib.stateless.stateless_random_uniform(
+                shape=[caption_number],
+                seed=tf.stack([tf.cast(seed, tf.int64), record_seed]))
+            caption_indices = tf.nn.top_k(
+                random_values, k=tf.minimum(num_samples, caption_number)).indices
+
+        def _slice_caption(caption_index):
+            caption_length = caption_lengths[caption_index]
+            caption = tf.slice(captions,
+                               begin=[caption_offsets[caption_index]],
+                               size=[caption_length])
+            return dict(element, caption=caption, caption_length=caption_length)
+
+        dataset = tf.data.Dataset.from_tensor_slices(caption_indices)
+        dataset = dataset.map(_slice_caption)
         return dataset
-        pass
 
     def _build_context_and_feature(self):
-        self.context_features = {
+        """only the tfrecord keys of selected features are parsed"""
+        context_features = {
             'image/image_id': tf.FixedLenFeature([], dtype=tf.string),
             'image/height': tf.FixedLenFeature([], dtype=tf.int64),
             'image/width': tf.FixedLenFeature([], dtype=tf.int64),
@@ -195,71 +387,150 @@ class ImageCaptionDataReader(BaseDataReader):
             'bbox/labels': tf.VarLenFeature(tf.int64),
             'bbox/bboxes': tf.VarLenFeature(tf.int64),
             'bbox/features': tf.FixedLenFeature([], dtype=tf.string),
+            # float32 scale of each int8 feature vector
+            'image/feature_scale': tf.FixedLenFeature([], dtype=tf.string),
+            'bbox/feature_scales': tf.FixedLenFeature([], dtype=tf.string),
+
+            'caption/number': tf.FixedLenFeature([], dtype=tf.int64),
+            'caption/lengths': tf.VarLenFeature(tf.int64),
+            # packed token ids of all captions
+            'caption/ids': tf.FixedLenFeature([], dtype=tf.string),
         }
-        self.sequence_features = {
-            'caption': tf.FixedLenSequenceFeature([], dtype=tf.string),
-        }
+        features = self._get_features()
+        unknown_features = [name for name in features if name not in ALL_FEATURES]
+        if unknown_features:
+            raise ValueError("Unknown features %s" % unknown_features)
+        record_keys = set(_CAPTION_RECORD_KEYS)
+        for name in features:
+            record_keys.update(_FEATURE_RECORD_KEYS.get(name, ()))
+            if self.feature_dtype == 'int8':
+                record_keys.update(_SCALE_RECORD_KEYS.get(name, ()))
+        self.context_features = {key: context_features[key] for key in record_keys}
         pass
 
-    def _parse_tf_example(self, serialized_example):
-        # parsing sequence example
-        context, sequence = tf.parse_single_sequence_example(
-            serialized_example,
-            context_features=self.context_features,
-            sequence_features=self.sequence_features
+    def _parse_tf_examples(self, serialized_examples):
+        """
+        parsing a batch of serialized examples, fixed size fields are decoded for the whole batch,
+        variable length fields are decoded per image in _select_captions
+        """
+        examples = tf.parse_example(
+            serialized_examples,
+            features=self.context_features
         )
 
-        image_id = context['image/image_id']
-        image_height = tf.cast(context['image/height'], tf.int32)
-        image_width = tf.cast(context['image/width'], tf.int32)
-        image_depth = tf.cast(context['image/depth'], tf.int32)
-
-        # image_rawdata = tf.decode_raw(context['image/raw_data'], tf.float32)
-        # image_shape = tf.stack([image_height, image_width, image_depth])
-        # image_rawdata = tf.reshape(image_rawdata, image_shape)
-
-        image_feature = tf.decode_raw(context['image/feature'], tf.float32)
-
-        # # Since information about shape is lost reshape it
-        bbox_number = tf.cast(context['bbox/number'], tf.int32)
-        bbox_labels = tf.sparse_tensor_to_dense(context['bbox/labels'], default_value=0)
-        bboxes = tf.sparse_tensor_to_dense(context['bbox/bboxes'], default_value=0)
-        # bboxes_shape = tf.stack([bbox_number, 4])
-        # bboxes = tf.reshape(bboxes, bboxes_shape)
-
-        bbox_features = context['bbox/features']
-        bbox_features = tf.decode_raw(bbox_features, tf.float32)
-        # bbox_features = tf.sparse_tensor_to_dense(context['bbox/features'], default_value=0)
-        bbox_features_shape = tf.stack([bbox_number, self.data_config.dim_visual_feature])
-        bbox_features = tf.reshape(bbox_features, bbox_features_shape)
-
-        caption = sequence["caption"]
-        parsed_example = (image_id, image_height, image_width, image_depth, image_feature,
-                          bbox_features_shape, bbox_number, bbox_labels, bboxes, bbox_features,
-                          caption)
-        return parsed_example
+        parsed_examples = dict()
+        if 'image/image_id' in examples:
+            parsed_examples['image_id'] = examples['image/image_id']
+        for name, key in (('image_height', 'image/height'),
+                          ('image_width', 'image/width'),
+                          ('image_depth', 'image/depth'),
+                          ('bbox_number', 'bbox/number')):
+            if key in examples:
+                parsed_examples[name] = tf.cast(examples[key], tf.int32)
+        if 'image/feature' in examples:
+            parsed_examples['image_feature'] = self._decode_features(
+                examples['image/feature'], examples.get('image/feature_scale'),
+                [-1, self.dim_visual_feature])
+
+        # sparse fields are padded to the longest record of the batch
+        if 'bbox/labels' in examples:
+            parsed_examples['bbox_labels'] = tf.sparse_tensor_to_dense(
+                examples['bbox/labels'], default_value=0)
+        if 'bbox/bboxes' in examples:
+            parsed_examples['bboxes'] = tf.sparse_tensor_to_dense(
+                examples['bbox/bboxes'], default_value=0)
+        if 'bbox/features' in examples:
+            parsed_examples['bbox_features'] = examples['bbox/features']
+        if 'bbox/feature_scales' in examples:
+            parsed_examples['bbox_feature_scales'] = examples['bbox/feature_scales']
+
+        parsed_examples['caption_number'] = tf.cast(examples['caption/number'], tf.int32)
+        parsed_examples['caption_lengths'] = tf.cast(tf.sparse_tensor_to_dense(
+            examples['caption/lengths'], default_value=0), tf.int32)
+        parsed_examples['caption_ids'] = examples['caption/ids']
+        return parsed_examples
         pass
 
+    def _decode_features(self, feature_bytes, scale_bytes, shape):
+        """
+        dequantize features stored in feature_dtype to float32 of shape [num_vectors, dim],
+        int8 features are multiplied by the float32 scale of each vector
+        """
+        features = tf.decode_raw(feature_bytes, tf.as_dtype(self.feature_dtype))
+        features = tf.reshape(tf.cast(features, tf.float32), shape)
+        if self.feature_dtype == 'int8':
+            scales = tf.reshape(tf.decode_raw(scale_bytes, tf.float32), [-1, 1])
+            features = features * scales
+        return features
+
     pass
 
 
-def print_output(batch_data):
-    (id_batch, width_batch, height_batch, depth_batch, feature_batch,
-     bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features,
-     caption_batch, fw_target_batch, bw_target_batch,
-     caption_ids, fw_target_ids, bw_target_ids,
-     caption_lengths, fw_target_lengths, bw_target_lengths) = batch_data
-    for idx, image_id in enumerate(id_batch):
+def _sample_records(data_dir, num_records):
+    """
+    yield feature maps of up to num_records float32 records of tfrecords in data_dir, outside of the graph,
+    records are taken evenly from the beginning of each shard
+    """
+    manifest = shard_utils.load_manifest(data_dir)
+    if manifest is not None and manifest.get("feature_dtype", 'float32') != 'float32':
+        raise ValueError("tfrecords in {} are built with {} features".format(data_dir, manifest["feature_dtype"]))
+    data_files = sorted(tf.gfile.Glob(os.path.join(data_dir, "*" + shard_utils.SHARD_SUFFIX)))
+    records_per_shard = int(np.ceil(num_records / max(len(data_files), 1)))
+    count = 0
+    for data_file in data_files:
+        for idx, record in enumerate(tf.python_io.tf_record_iterator(data_file)):
+            if idx >= records_per_shard or count >= num_records:
+                break
+            count += 1
+            yield tf.train.Example.FromString(record).features.feature
+
+
+def load_record_features(data_dir, num_records, dim_visual_feature):
+    """
+    sample float32 features of tfrecords in data_dir for offline analysis
+    :return: (image features [num_records, dim], bbox features [num_bboxes, dim])
+    """
+    image_features, bbox_features = list(), list()
+    for feature in _sample_records(data_dir, num_records):
+        image_features.append(np.frombuffer(feature['image/feature'].bytes_list.value[0], dtype=np.float32))
+        bbox_features.append(np.frombuffer(feature['bbox/features'].bytes_list.value[0], dtype=np.float32)
+                             .reshape(-1, dim_visual_feature))
+    return np.stack(image_features), np.concatenate(bbox_features)
+
+
+def load_record_captions(data_dir, num_records, caption_ids_dtype):
+    """
+    sample float32 image features and reference captions of tfrecords in data_dir for offline evaluation
+    :return: (image ids, image features [num_records, dim], list of lists of caption token ids of each image)
+    """
+    image_ids, image_features, captions = list(), list(), list()
+    for feature in _sample_records(data_dir, num_records):
+        image_ids.append(feature['image/image_id'].bytes_list.value[0].decode('utf-8'))
+        image_features.append(np.frombuffer(feature['image/feature'].bytes_list.value[0], dtype=np.float32))
+        caption_ids = np.frombuffer(feature['caption/ids'].bytes_list.value[0], dtype=caption_ids_dtype)
+        offsets = np.cumsum([0] + list(feature['caption/lengths'].int64_list.value))
+        captions.append([caption_ids[begin:end].tolist() for begin, end in zip(offsets[:-1], offsets[1:])])
+    return image_ids, np.stack(image_features), captions
+
+
+def print_output(batch_data, vocabulary):
+    def _to_text(token_ids, length):
+        return "".join([vocabulary.id_to_word(token_id) for token_id in token_ids[:length]])
+
+    caption_lengths = batch_data['caption_length']
+    for idx, image_id in enumerate(batch_data['image_id']):
         caption_length = caption_lengths[idx]
         print("image: image_id={0:}, width={1:4d}, height={2:4d}, feature_shape={3:4d}, caption_length={12:2d}"
               "\n\tbbox: features_shape={4:}, num={5:2d}, labels={6:}, bboxes={7:}, features={8:}"
               "\n\tcaption=[{9:}]\n\tfw_target=[{10:}]\n\tbw_target=[{11:}]".
-              format(image_id, width_batch[idx], height_batch[idx], len(feature_batch[idx]),
-                     bbox_shape_batch[idx], bbox_num[idx], len(bbox_labels[idx]),
-                     len(bboxes[idx]) // 4, len(bbox_features[idx]),
-                     str.strip("".join([token.decode() for token in caption_batch[idx][:caption_length]])),
-                     str.strip("".join([token.decode() for token in fw_target_batch[idx][:caption_length]])),
-                     str.strip("".join([token.decode() for token in bw_target_batch[idx][:caption_length]])),
+              format(image_id, batch_data['image_width'][idx], batch_data['image_height'][idx],
+                     len(batch_data['image_feature'][idx]),
+                     batch_data['bbox_shape'][idx], batch_data['bbox_number'][idx],
+                     len(batch_data['bbox_labels'][idx]), len(batch_data['bboxes'][idx]) // 4,
+                     len(batch_data['bbox_features'][idx]),
+                     _to_text(batch_data['caption_ids'][idx], caption_length),
+                     _to_text(batch_data['fw_target_ids'][idx], caption_length),
+                     _to_text(batch_data['bw_target_ids'][idx], caption_length),
                      caption_length))
 
     return batch_data
@@ -278,7 +549,7 @@ def main(_):
         while True:
             try:
                 batch_data = sess.run(next_batch)
-                print_output(batch_data)
+                print_output(batch_data, data_reader.vocabulary)
                 step += 1
             except tf.errors.OutOfRangeError:  # ==> "End of validation dataset"
                 print("data reader finished at step={0}".format(step))
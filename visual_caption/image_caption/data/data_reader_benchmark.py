@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Benchmark of ImageCaptionDataReader input pipeline on synthetic tfrecord shards
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+from object_detection.utils import dataset_util
+
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.image_caption.data.data_reader import ImageCaptionDataReader
+from visual_caption.utils import feature_codec, shard_utils
+
+tf.flags.DEFINE_integer("num_shards", 4, "number of synthetic shards")
+tf.flags.DEFINE_integer("records_per_shard", 500, "number of images in each synthetic shard")
+tf.flags.DEFINE_integer("num_batches", 100, "number of batches read for each pipeline")
+tf.flags.DEFINE_integer("batch_size", 200, "reader batch size")
+tf.flags.DEFINE_string("feature_dtype", "float32", "storage dtype of visual features: float32, float16 or int8")
+tf.flags.DEFINE_string("selected_features", "image_id,image_feature,caption_ids,fw_target_ids,caption_length",
+                       "comma separated features selected by the projected pipeline")
+FLAGS = tf.flags.FLAGS
+
+NUM_SYNTHETIC_VOCAB = 4000
+NUM_CAPTIONS_PER_IMAGE = 5
+
+
+def build_synthetic_vocab(vocab_file, data_config):
+    tokens = [data_config.token_start, data_config.token_end,
+              data_config.token_unknown, data_config.token_pad]
+    tokens.extend(["t{}".format(idx) for idx in range(NUM_SYNTHETIC_VOCAB)])
+    with open(vocab_file, mode='w', encoding='utf-8') as f:
+        for token in tokens:
+            f.write(token + "\n")
+
+
+def build_synthetic_shards(data_dir, data_config, num_shards, records_per_shard):
+    """write shards with the same record layout as ImageCaptionDataBuilder"""
+    dim_visual_feature = data_config.dim_visual_feature
+    rng = np.random.RandomState(data_config.random_seed)
+    for shard_index in range(num_shards):
+        shard_file = os.path.join(data_dir, shard_utils.get_shard_name(
+            "train", shard_index, num_shards))
+        with tf.python_io.TFRecordWriter(shard_file) as tf_writer:
+            for idx in range(records_per_shard):
+                bbox_number = data_config.num_max_bbox
+                image_feature = rng.rand(dim_visual_feature).astype(np.float32)
+                bbox_features = rng.rand(bbox_number, dim_visual_feature).astype(np.float32)
+                bboxes = rng.randint(0, 500, size=bbox_number * 4)
+                caption_lengths = rng.randint(8, data_config.num_caption_max_length,
+                                              size=NUM_CAPTIONS_PER_IMAGE)
+                caption_ids = rng.randint(4, NUM_SYNTHETIC_VOCAB, size=np.sum(caption_lengths))
+                caption_ids = caption_ids.astype(data_config.caption_ids_dtype)
+                image_feature, image_feature_scale = feature_codec.encode_features(
+                    image_feature, data_config.feature_dtype)
+                bbox_features, bbox_feature_scales = feature_codec.encode_features(
+                    bbox_features, data_config.feature_dtype)
+                tf_example = tf.train.Example(features=tf.train.Features(feature={
+                    'image/image_id': dataset_util.bytes_feature(
+                        "{}_{}.jpg".format(shard_index, idx).encode()),
+                    'image/height': dataset_util.int64_feature(480),
+                    'image/width': dataset_util.int64_feature(640),
+                    'image/depth': dataset_util.int64_feature(3),
+                    'image/feature': dataset_util.bytes_feature(image_feature.tobytes()),
+                    'bbox/number': dataset_util.int64_feature(bbox_number),
+                    'bbox/labels': dataset_util.int64_list_feature(
+                        rng.randint(1, 90, size=bbox_number).tolist()),
+                    'bbox/bboxes': dataset_util.int64_list_feature(bboxes.tolist()),
+                    'bbox/features': dataset_util.bytes_feature(bbox_features.tobytes()),
+                    'caption/number': dataset_util.int64_feature(NUM_CAPTIONS_PER_IMAGE),
+                    'caption/lengths': dataset_util.int64_list_feature(caption_lengths.tolist()),
+                    'caption/ids': dataset_util.bytes_feature(caption_ids.tobytes()),
+                }))
+                if data_config.feature_dtype == 'int8':
+                    tf_example.features.feature['image/feature_scale'].CopyFrom(
+                        dataset_util.bytes_feature(image_feature_scale.tobytes()))
+                    tf_example.features.feature['bbox/feature_scales'].CopyFrom(
+                        dataset_util.bytes_feature(bbox_feature_scales.tobytes()))
+                tf_writer.write(tf_example.SerializeToString())
+
+
+def get_legacy_dataset(data_reader, data_dir):
+    """
+    the pipeline before batched parsing: one record per parse op without parallelism,
+    chained per-caption maps and no prefetch
+    """
+    data_config = data_reader.data_config
+    vocabulary = data_reader.vocabulary
+    data_files = sorted(tf.gfile.Glob(os.path.join(data_dir, "*" + shard_utils.SHARD_SUFFIX)))
+
+    def _parse_tf_example(serialized_example):
+        parsed_examples = data_reader._parse_tf_examples(tf.expand_dims(serialized_example, 0))
+        return {name: tensor[0] for name, tensor in parsed_examples.items()}
+
+    def _add_caption_ids(element):
+        element = dict(element)
+        caption = element.pop('caption')
+        element.pop('caption_length')
+        element['caption_ids'] = tf.concat(([vocabulary.start_id], caption, [vocabulary.end_id]), axis=0)
+        element['fw_target_ids'] = tf.concat((caption, [vocabulary.end_id], [vocabulary.end_id]), axis=0)
+        element['bw_target_ids'] = tf.concat(([vocabulary.start_id], [vocabulary.start_id], caption), axis=0)
+        return element
+
+    def _add_lengths(element):
+        return dict(element,
+                    caption_length=tf.size(element['caption_ids']),
+                    fw_target_length=tf.size(element['fw_target_ids']),
+                    bw_target_length=tf.size(element['bw_target_ids']))
+
+    dataset = tf.data.TFRecordDataset(data_files)
+    dataset = dataset.map(_parse_tf_example)
+    dataset = dataset.flat_map(data_reader._select_captions)
+    dataset = dataset.map(_add_caption_ids)
+    dataset = dataset.map(_add_lengths)
+    dataset = dataset.padded_batch(
+        batch_size=data_config.batch_size,
+        padded_shapes={name: tf.TensorShape([None] * len(shape))
+                       for name, shape in dataset.output_shapes.items()})
+    return dataset
+
+
+def time_dataset(dataset, num_batches):
+    """
+    :return: (images per second, captions per second)
+    """
+    next_batch = dataset.make_one_shot_iterator().get_next()
+    num_captions = 0
+    with tf.Session() as sess:
+        sess.run(tf.tables_initializer())
+        sess.run(next_batch)  # warm up
+        begin = time.time()
+        for _ in range(num_batches):
+            try:
+                batch_data = sess.run(next_batch)
+            except tf.errors.OutOfRangeError:
+                break
+            num_captions += len(batch_data['caption_length'])
+        elapsed = time.time() - begin
+    return num_captions / NUM_CAPTIONS_PER_IMAGE / elapsed, num_captions / elapsed
+
+
+def main(_):
+    data_config = ImageCaptionDataConfig()
+    data_config.batch_size = FLAGS.batch_size
+    data_config.feature_dtype = FLAGS.feature_dtype
+    benchmark_dir = tempfile.mkdtemp(prefix="image_caption_reader_")
+    data_config.train_data_dir = os.path.join(benchmark_dir, "train")
+    data_config.vocab_char_txt = os.path.join(benchmark_dir, "vocab_char.txt")
+    os.makedirs(data_config.train_data_dir)
+    build_synthetic_vocab(data_config.vocab_char_txt, data_config)
+    build_synthetic_shards(data_config.train_data_dir, data_config,
+                           num_shards=FLAGS.num_shards,
+                           records_per_shard=FLAGS.records_per_shard)
+    print("built {} synthetic shards with {} features into {}".format(
+        FLAGS.num_shards, data_config.feature_dtype, data_config.train_data_dir))
+
+    results = list()
+    with tf.Graph().as_default():
+        data_reader = ImageCaptionDataReader(data_config=data_config)
+        dataset = get_legacy_dataset(data_reader, data_config.train_data_dir)
+        results.append(("before", time_dataset(dataset, FLAGS.num_batches)))
+    with tf.Graph().as_default():
+        data_reader = ImageCaptionDataReader(data_config=data_config)
+        dataset = data_reader._get_dataset(data_config.train_data_dir)
+        results.append(("after", time_dataset(dataset, FLAGS.num_batches)))
+    with tf.Graph().as_default():
+        data_reader = ImageCaptionDataReader(data_config=data_config)
+        data_reader.select_features(FLAGS.selected_features.split(","))
+        dataset = data_reader._get_dataset(data_config.train_data_dir)
+        results.append(("selected", time_dataset(dataset, FLAGS.num_batches)))
+    for name, (images_per_sec, captions_per_sec) in results:
+        print("{:8s}: records/sec={:10.2f}, captions/sec={:10.2f}"
+              .format(name, images_per_sec, captions_per_sec))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,207 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Columnar binary store of detection results
+"""
+a detection store is a directory of flat binary columns which are memory mapped:
+    boxes.bin           int16   [num_boxes, 4]   x_min, y_min, x_max, y_max
+    class_ids.bin       uint8   [num_boxes]
+    scores.bin          float16 [num_boxes]
+    box_offsets.bin     int64   [num_images + 1] boxes of image i are [box_offsets[i], box_offsets[i + 1])
+    images.jsonl        per-image metadata without boxes, such as image_id, width, height and captions
+    image_offsets.bin   int64   [num_images + 1] byte offsets of each line of images.jsonl
+    store.json          number of images, boxes and dtypes of the columns, written last
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from visual_caption.utils import jsonl_utils
+
+STORE_SUFFIX = ".store"
+HEADER_FILE_NAME = "store.json"
+
+BOX_DTYPE = np.int16
+CLASS_ID_DTYPE = np.uint8
+SCORE_DTYPE = np.float16
+OFFSET_DTYPE = np.int64
+
+# keys of the compact bbox arrays of image dicts, see FasterRCNNDetector._build_image_dict
+BBOX_KEYS = ('bbox_boxes', 'bbox_class_ids', 'bbox_scores')
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(str(path), HEADER_FILE_NAME))
+
+
+def _get_bbox_arrays(image_data):
+    """compact bbox arrays of an image dict, the bboxes dict list of earlier detection files is converted"""
+    if 'bbox_boxes' in image_data:
+        boxes = image_data['bbox_boxes']
+        class_ids = image_data['bbox_class_ids']
+        scores = image_data['bbox_scores']
+    else:
+        bboxes = image_data.get('bboxes', list())
+        boxes = [[bbox['x_min'], bbox['y_min'], bbox['x_max'], bbox['y_max']] for bbox in bboxes]
+        class_ids = [bbox['class_id'] for bbox in bboxes]
+        scores = [bbox['confidence'] for bbox in bboxes]
+    boxes = np.asarray(boxes, dtype=BOX_DTYPE).reshape(-1, 4)
+    class_ids = np.asarray(class_ids, dtype=CLASS_ID_DTYPE).reshape(-1)
+    scores = np.asarray(scores, dtype=SCORE_DTYPE).reshape(-1)
+    return boxes, class_ids, scores
+
+
+class DetectionStoreWriter(object):
+    """
+    write image dicts into a detection store in streaming fashion,
+    the store is written into a temp directory which is renamed on close
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._tmp_dir = store_dir + ".tmp"
+        if os.path.isdir(self._tmp_dir):
+            shutil.rmtree(self._tmp_dir)
+        os.makedirs(self._tmp_dir)
+        self._files = {name: open(os.path.join(self._tmp_dir, name), mode='wb')
+                       for name in ("boxes.bin", "class_ids.bin", "scores.bin", "images.jsonl")}
+        self._box_offsets = [0]
+        self._image_offsets = [0]
+
+    def write(self, image_data):
+        boxes, class_ids, scores = _get_bbox_arrays(image_data)
+        self._files["boxes.bin"].write(boxes.tobytes())
+        self._files["class_ids.bin"].write(class_ids.tobytes())
+        self._files["scores.bin"].write(scores.tobytes())
+        self._box_offsets.append(self._box_offsets[-1] + len(boxes))
+
+        meta = {key: value for key, value in image_data.items()
+                if key not in BBOX_KEYS and key != 'bboxes'}
+        line = (json.dumps(meta, sort_keys=True, ensure_ascii=False) + "\n").encode('utf-8')
+        self._files["images.jsonl"].write(line)
+        self._image_offsets.append(self._image_offsets[-1] + len(line))
+
+    @property
+    def num_images(self):
+        return len(self._box_offsets) - 1
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        np.asarray(self._box_offsets, dtype=OFFSET_DTYPE).tofile(
+            os.path.join(self._tmp_dir, "box_offsets.bin"))
+        np.asarray(self._image_offsets, dtype=OFFSET_DTYPE).tofile(
+            os.path.join(self._tmp_dir, "image_offsets.bin"))
+        header = {
+            "num_images": self.num_images,
+            "num_boxes": self._box_offsets[-1],
+            "box_dtype": np.dtype(BOX_DTYPE).name,
+            "class_id_dtype": np.dtype(CLASS_ID_DTYPE).name,
+            "score_dtype": np.dtype(SCORE_DTYPE).name,
+        }
+        with open(os.path.join(self._tmp_dir, HEADER_FILE_NAME), mode='w') as f:
+            json.dump(header, f, indent=2, sort_keys=True)
+        if os.path.isdir(self.store_dir):
+            shutil.rmtree(self.store_dir)
+        os.rename(self._tmp_dir, self.store_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class DetectionStore(object):
+    """
+    memory mapped reader of a detection store with random access by index or image id,
+    image dicts have the layout of FasterRCNNDetector results with compact bbox arrays
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, HEADER_FILE_NAME), mode='r') as f:
+            self.header = json.load(f)
+        self.num_images = self.header["num_images"]
+        num_boxes = self.header["num_boxes"]
+        self.boxes = self._memmap("boxes.bin", self.header["box_dtype"], (num_boxes, 4))
+        self.class_ids = self._memmap("class_ids.bin", self.header["class_id_dtype"], (num_boxes,))
+        self.scores = self._memmap("scores.bin", self.header["score_dtype"], (num_boxes,))
+        self.box_offsets = self._memmap("box_offsets.bin", OFFSET_DTYPE, (self.num_images + 1,))
+        self.image_offsets = self._memmap("image_offsets.bin", OFFSET_DTYPE, (self.num_images + 1,))
+        images_file = os.path.join(store_dir, "images.jsonl")
+        self._images = np.memmap(images_file, dtype=np.uint8, mode='r') \
+            if os.path.getsize(images_file) > 0 else np.zeros([0], dtype=np.uint8)
+        self._image_index = None
+
+    def _memmap(self, file_name, dtype, shape):
+        if shape[0] == 0:  # empty files can't be memory mapped
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.store_dir, file_name), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.num_images
+
+    def get_meta(self, index):
+        line = self._images[self.image_offsets[index]:self.image_offsets[index + 1]].tobytes()
+        return json.loads(line.decode('utf-8'))
+
+    def get_bbox_arrays(self, index):
+        """:return: (boxes, class_ids, scores) of image index, views of the memory mapped columns"""
+        begin, end = self.box_offsets[index], self.box_offsets[index + 1]
+        return self.boxes[begin:end], self.class_ids[begin:end], self.scores[begin:end]
+
+    def get(self, index):
+        image_data = self.get_meta(index)
+        boxes, class_ids, scores = self.get_bbox_arrays(index)
+        image_data['bbox_boxes'] = np.asarray(boxes, dtype=np.int32)
+        image_data['bbox_class_ids'] = np.asarray(class_ids, dtype=np.int32)
+        image_data['bbox_scores'] = np.asarray(scores, dtype=np.float32)
+        return image_data
+
+    def get_by_image_id(self, image_id):
+        """image dict of image_id, the image id table is built on first use"""
+        if self._image_index is None:
+            self._image_index = {self.get_meta(index)['image_id']: index
+                                 for index in range(self.num_images)}
+        return self.get(self._image_index[image_id])
+
+    def iter_from(self, start):
+        """yield image dicts from index start, earlier images are not read"""
+        for index in range(start, self.num_images):
+            yield self.get(index)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+
+def build_store(detected_data_file, store_dir):
+    """
+    convert detection results of a json lines file into a detection store
+    :return: number of images
+    """
+    with DetectionStoreWriter(store_dir) as writer:
+        for image_data in jsonl_utils.load_jsonl_generator(detected_data_file):
+            writer.write(image_data)
+    print("converted {} images of {} into detection store {}"
+          .format(writer.num_images, detected_data_file, store_dir))
+    return writer.num_images
+
+
+def export_json(store_dir, json_file):
+    """export a detection store to a json list of image dicts for debugging"""
+    store = DetectionStore(store_dir)
+    with open(json_file, mode='w') as f:
+        f.write("[\n")
+        for index, image_data in enumerate(store):
+            if index > 0:
+                f.write(",\n")
+            f.write(json.dumps(image_data, sort_keys=True, ensure_ascii=False, default=jsonl_utils._to_json))
+        f.write("\n]\n")
+    print("exported {} images of {} into {}".format(len(store), store_dir, json_file))
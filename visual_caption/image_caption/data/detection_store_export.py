@@ -0,0 +1,22 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Export a detection store to a json list of image dicts for debugging
+import tensorflow as tf
+
+from visual_caption.image_caption.data import detection_store
+
+tf.flags.DEFINE_string("export_store_dir", None, "detection store to export")
+tf.flags.DEFINE_string("export_json_file", None, "target json file of the export")
+FLAGS = tf.flags.FLAGS
+
+
+def main(_):
+    detection_store.export_json(FLAGS.export_store_dir, FLAGS.export_json_file)
+
+
+if __name__ == '__main__':
+    tf.app.run()
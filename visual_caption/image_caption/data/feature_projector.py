@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Fit the projection of visual features on a sample of the training tfrecords
+"""
+usage:
+    1. build train data with float32 features and no projection
+    2. fit the projection, it is saved into data_config.feature_projection_file
+    3. rebuild the data with use_feature_projection, features are read from the feature cache
+       if feature_cache_dir was set for the first build
+"""
+import numpy as np
+import tensorflow as tf
+
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.image_caption.data.data_reader import load_record_features
+from visual_caption.utils import feature_projection, shard_utils
+
+tf.flags.DEFINE_string("projection_method", "pca", "pca or random")
+tf.flags.DEFINE_integer("projection_dim", 512, "dim of projected visual features")
+tf.flags.DEFINE_integer("num_records", 2000, "number of training records sampled for fitting")
+tf.flags.DEFINE_string("projection_file", None, "output file, data_config.feature_projection_file if None")
+FLAGS = tf.flags.FLAGS
+
+
+def main(_):
+    data_config = ImageCaptionDataConfig()
+    data_dir = data_config.train_data_dir
+    manifest = shard_utils.load_manifest(data_dir) or dict()
+    if manifest.get("feature_projection") is not None:
+        raise ValueError("tfrecords in {} are already projected, rebuild them without projection".format(data_dir))
+    projection_file = FLAGS.projection_file or data_config.feature_projection_file
+    # image and bbox features share the projection as they share the visual embedding layer of models
+    image_features, bbox_features = load_record_features(data_dir, FLAGS.num_records,
+                                                         data_config.dim_visual_feature)
+    features = np.concatenate([image_features, bbox_features])
+    projection = feature_projection.fit_projection(features, FLAGS.projection_dim, method=FLAGS.projection_method,
+                                                   seed=data_config.random_seed)
+    feature_projection.save_projection(projection, projection_file)
+    print("fitted {} projection on {} features of {} records: {}, saved into {}"
+          .format(FLAGS.projection_method, len(features), len(image_features),
+                  feature_projection.get_projection_info(projection), projection_file))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Report of visual feature error, record size and caption quality of each feature dtype on float32 tfrecords
+import numpy as np
+import tensorflow as tf
+from tensorflow.contrib.learn import ModeKeys
+
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.image_caption.data.data_reader import ImageCaptionDataReader, load_record_captions, \
+    load_record_features
+from visual_caption.image_caption.inference.image_caption_generator import ImageCaptionGenerator
+from visual_caption.image_caption.model.image_caption_config import ImageCaptionModelConfig
+from visual_caption.image_caption.model.image_caption_model import ImageCaptionModel
+from visual_caption.scripts import bleu
+from visual_caption.utils import feature_codec, shard_utils
+
+tf.flags.DEFINE_string("data_dir", None, "dir of tfrecords built with float32 features, valid_data_dir if None")
+tf.flags.DEFINE_integer("num_records", 1000, "number of records sampled from the shards")
+tf.flags.DEFINE_boolean("eval_captions", False,
+                        "generate captions of held-out images with the latest ImageCaptionModel checkpoint "
+                        "from the features of each dtype and report their bleu")
+tf.flags.DEFINE_integer("num_caption_images", 200, "number of held-out images captioned for each feature dtype")
+FLAGS = tf.flags.FLAGS
+
+
+def get_error_stats(features, feature_dtype):
+    """
+    reconstruction error of features stored in feature_dtype, cosine similarity is what the models see
+    of l2 normalized features, nearest neighbour agreement shows whether images stay distinguishable
+    """
+    values, scales = feature_codec.encode_features(features, feature_dtype)
+    decoded = feature_codec.decode_features(values, scales)
+    errors = decoded - features
+    norms = np.linalg.norm(features, axis=1) * np.linalg.norm(decoded, axis=1)
+    cosines = np.sum(features * decoded, axis=1) / np.maximum(norms, 1e-12)
+    bytes_per_vector = values.nbytes / len(features) + (scales.nbytes / len(features) if scales is not None else 0)
+    return {
+        "bytes_per_vector": bytes_per_vector,
+        "max_abs_error": float(np.max(np.abs(errors))),
+        "relative_l2_error": float(np.mean(np.linalg.norm(errors, axis=1) /
+                                           np.maximum(np.linalg.norm(features, axis=1), 1e-12))),
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        "decoded": decoded,
+    }
+
+
+def get_neighbour_agreement(features, decoded):
+    """fraction of vectors whose nearest neighbour among the others is unchanged by quantization"""
+    def _nearest(vectors):
+        similarities = np.dot(vectors, vectors.T)
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argmax(similarities, axis=1)
+
+    return float(np.mean(_nearest(features) == _nearest(decoded)))
+
+
+def get_caption_stats(data_config, data_dir, num_images):
+    """
+    caption quality of each feature dtype on held-out records: image features are quantized and decoded,
+    captioned by beam search with the latest checkpoint of ImageCaptionModel, and scored by bleu-4
+    against the reference captions and by agreement with the captions of float32 features
+    :return: dict of feature dtype to dict of bleu and float32_agreement
+    """
+    manifest = shard_utils.load_manifest(data_dir) or dict()
+    caption_ids_dtype = manifest.get("caption_ids_dtype", data_config.caption_ids_dtype)
+    image_ids, image_features, references = load_record_captions(data_dir, num_images, caption_ids_dtype)
+    print("captioning {} held-out images of {}".format(len(image_ids), data_dir))
+
+    data_reader = ImageCaptionDataReader(data_config=data_config)
+    data_config.dim_visual_feature = data_reader.get_dim_visual_feature()
+    model_config = ImageCaptionModelConfig(data_config=data_config, model_name=data_config.model_name)
+    model = ImageCaptionModel(model_config=model_config, data_reader=data_reader, mode=ModeKeys.INFER)
+    vocab = data_reader.vocabulary.vocab
+    generator = ImageCaptionGenerator(model=model, vocab=vocab,
+                                      token_start=data_config.token_start, token_end=data_config.token_end,
+                                      beam_size=data_config.beam_size,
+                                      max_caption_length=data_config.num_caption_max_length)
+    special_ids = {vocab[data_config.token_start], vocab[data_config.token_end]}
+
+    caption_stats = dict()
+    with tf.Session(config=model_config.sess_config) as sess:
+        if not model.restore_model(sess):
+            raise ValueError("no checkpoint of {} to caption with".format(model_config.model_name))
+        sess.run(tf.tables_initializer())
+        float32_captions = None
+        for feature_dtype in feature_codec.FEATURE_DTYPES:
+            values, scales = feature_codec.encode_features(image_features, feature_dtype)
+            decoded = feature_codec.decode_features(values, scales)
+            captions = list()
+            for image_feature in decoded:
+                best_caption = generator.beam_search(sess=sess, image_feature=image_feature.reshape(1, -1))[0]
+                captions.append([token_id for token_id in best_caption.sentence if token_id not in special_ids])
+            if float32_captions is None:  # float32 comes first
+                float32_captions = captions
+            caption_stats[feature_dtype] = {
+                "bleu": bleu.compute_bleu(references, captions)[0],
+                "float32_agreement": float(np.mean([caption == float32_caption for caption, float32_caption
+                                                    in zip(captions, float32_captions)])),
+            }
+    return caption_stats
+
+
+def main(_):
+    data_config = ImageCaptionDataConfig()
+    data_dir = FLAGS.data_dir or data_config.valid_data_dir
+    # projected features have the dim of the manifest
+    manifest = shard_utils.load_manifest(data_dir) or dict()
+    dim_visual_feature = manifest.get("dim_visual_feature", data_config.dim_visual_feature)
+    image_features, bbox_features = load_record_features(data_dir, FLAGS.num_records, dim_visual_feature)
+    print("{} image features and {} bbox features of {}".format(len(image_features), len(bbox_features), data_dir))
+    bboxes_per_record = len(bbox_features) / len(image_features)
+    for feature_dtype in feature_codec.FEATURE_DTYPES:
+        image_stats = get_error_stats(image_features, feature_dtype)
+        bbox_stats = get_error_stats(bbox_features, feature_dtype)
+        record_bytes = image_stats["bytes_per_vector"] + bboxes_per_record * bbox_stats["bytes_per_vector"]
+        print("{:8s}: feature bytes/record={:10.1f}, neighbour agreement={:.4f}"
+              .format(feature_dtype, record_bytes,
+                      get_neighbour_agreement(image_features, image_stats["decoded"])))
+        for name, stats in (("image", image_stats), ("bbox", bbox_stats)):
+            print("    {:6s}: max_abs_error={:.2e}, relative_l2_error={:.2e}, mean_cosine={:.6f}, min_cosine={:.6f}"
+                  .format(name, stats["max_abs_error"], stats["relative_l2_error"],
+                          stats["mean_cosine"], stats["min_cosine"]))
+    if FLAGS.eval_captions:
+        caption_stats = get_caption_stats(data_config, data_dir, FLAGS.num_caption_images)
+        for feature_dtype, stats in caption_stats.items():
+            print("{:8s}: caption bleu-4={:.4f}, captions equal to float32={:.4f}"
+                  .format(feature_dtype, stats["bleu"], stats["float32_agreement"]))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,44 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Repack image sets into large blob shards with an offset index
+import os
+import time
+
+import tensorflow as tf
+
+from visual_caption.image_caption.data.data_config import ImageCaptionDataConfig
+from visual_caption.utils import image_source
+
+tf.flags.DEFINE_string("image_source", None,
+                       "image dir, zip or tar to pack, train, valid and test image dirs of data config if None")
+tf.flags.DEFINE_string("image_blob_dir", None, "target blob dir of image_source")
+FLAGS = tf.flags.FLAGS
+
+
+def pack_images(source_path, blob_dir, shard_bytes):
+    begin = time.time()
+    source = image_source.get_image_source(source_path)
+    count = image_source.pack_blob_shards(source, blob_dir, shard_bytes=shard_bytes)
+    source.close()
+    print("packed {} images of {} into {}, elapsed {} sec."
+          .format(count, source_path, blob_dir, time.time() - begin))
+
+
+def main(_):
+    data_config = ImageCaptionDataConfig()
+    if FLAGS.image_source is not None:
+        pack_images(FLAGS.image_source, FLAGS.image_blob_dir, data_config.image_blob_shard_bytes)
+        return
+    for split_name, image_dir in [("train", data_config.train_image_dir),
+                                  ("valid", data_config.valid_image_dir),
+                                  ("test", data_config.test_image_dir)]:
+        pack_images(image_dir, os.path.join(data_config.image_blob_dir, split_name),
+                    data_config.image_blob_shard_bytes)
+
+
+if __name__ == '__main__':
+    tf.app.run()
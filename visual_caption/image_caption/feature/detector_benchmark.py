@@ -0,0 +1,45 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Benchmark of FasterRCNNDetector images/sec at several batch sizes
+import time
+from pathlib import Path
+
+import tensorflow as tf
+
+from visual_caption.image_caption.feature.faster_rcnn_detector import FasterRCNNDetector, DetectorConfig
+from visual_caption.utils import image_utils
+
+tf.flags.DEFINE_string("image_dir", None, "directory of benchmark images")
+tf.flags.DEFINE_integer("num_images", 200, "number of images detected for each batch size")
+tf.flags.DEFINE_string("batch_sizes", "1,2,4,8,16", "comma separated batch sizes")
+FLAGS = tf.flags.FLAGS
+
+
+def time_detection(detector, image_nps, batch_size):
+    """
+    :return: images per second of detecting decoded images with batch_size
+    """
+    detector.detect_arrays(image_nps[:batch_size], batch_size=batch_size)  # warm up
+    begin = time.time()
+    detector.detect_arrays(image_nps, batch_size=batch_size)
+    return len(image_nps) / (time.time() - begin)
+
+
+def main(_):
+    image_files = sorted(Path(FLAGS.image_dir).glob('*.jpg'))[:FLAGS.num_images]
+    # images are decoded once, only detection is timed
+    image_nps = image_utils.load_images(image_files)
+    detector = FasterRCNNDetector(config=DetectorConfig())
+    groups = detector._group_by_resolution(image_nps)
+    print("{} images in {} resolution groups".format(len(image_nps), len(groups)))
+    for batch_size in [int(value) for value in FLAGS.batch_sizes.split(",")]:
+        images_per_sec = time_detection(detector, image_nps, batch_size)
+        print("batch_size={:3d}: images/sec={:8.2f}".format(batch_size, images_per_sec))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -11,8 +11,9 @@ import numpy as np
 import tensorflow as tf
 
 from object_detection.utils import label_map_util
-from visual_caption.utils import image_utils
+from visual_caption.utils import bbox_utils, image_utils
 from visual_caption.utils.decorator_utils import timeit
+from visual_caption.utils.image_prefetcher import ImagePrefetcher
 
 home = str(Path.home())  # home dir
 base_data_dir = os.path.join(home, 'data')
@@ -32,6 +33,31 @@ class DetectorConfig():
     model_ckpt = PATH_TO_CKPT
     path_labels = PATH_TO_LABELS
     num_classes = NUM_CLASSES
+    batch_size = 8  # max number of images of each detection run
+    resolution_step = 64  # images are grouped by height and width rounded up to resolution_step
+    intra_op_threads = 0  # threads of session thread pools, 0 for the number of cores
+    inter_op_threads = 0
+    decode_threads = 4  # threads decoding images of detect_images in parallel
+    # jpeg images are decoded at reduced scale with the shorter side at least decode_min_size,
+    # the min_dimension of the keep aspect ratio resizer of the model, None for full size
+    decode_min_size = 600
+    # post-processing of detections
+    score_threshold = 0.2  # detections with lower confidence are dropped
+    nms_iou_threshold = 0.7  # class agnostic nms iou threshold, None to disable nms
+    min_box_area = 64  # boxes smaller than min_box_area pixels are dropped
+    max_num_bboxes = 36  # top-K detections kept for each image, same as num_max_bbox of data config
+
+
+def get_detection_params(config):
+    """preprocessing and post-processing params detections of config depend on, part of detection cache keys"""
+    return {
+        "resolution_step": config.resolution_step,
+        "decode_min_size": config.decode_min_size,
+        "score_threshold": config.score_threshold,
+        "nms_iou_threshold": config.nms_iou_threshold,
+        "min_box_area": config.min_box_area,
+        "max_num_bboxes": config.max_num_bboxes,
+    }
 
 
 class FasterRCNNDetector(object):
@@ -78,20 +104,15 @@ class FasterRCNNDetector(object):
         gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.8)
         sess_config = tf.ConfigProto(gpu_options=gpu_options,
                                      allow_soft_placement=True,
-                                     log_device_placement=False)
+                                     log_device_placement=False,
+                                     intra_op_parallelism_threads=self.config.intra_op_threads,
+                                     inter_op_parallelism_threads=self.config.inter_op_threads)
         self.sess = tf.Session(config=sess_config, graph=self.detection_graph)
         summary_writer.add_graph(self.sess.graph)
         self.summary_merged = tf.summary.merge_all()
 
         pass
 
-    # def detect_images(self, images):
-    #     image_array = np.asarray(images)
-    #     feed_dict = {self.imput_images: image_array}
-    #     results = self.sess.run(fetches=self.fetches,
-    #                             feed_dict=feed_dict)
-    #     return results
-
     def detect(self, image_np_expanded):
         feed_dict = {self.imput_images: image_np_expanded}
         results = self.sess.run(fetches=self.fetches,
@@ -107,46 +128,125 @@ class FasterRCNNDetector(object):
         # image = Image.open(image_path)
         # (img_width, img_height) = image.size
         # image_np = self._load_image_into_numpy_array(image)
-        image_np = image_utils.load_image(image_path=image_path)
-        (img_width, img_height, channel) = image_np.shape
+        image_np, original_shape = image_utils.decode_image(image_path, min_size=self.config.decode_min_size)
         image_np_expanded = np.expand_dims(image_np, axis=0)
         detect_result = self.detect(image_np_expanded=image_np_expanded)
         boxes, scores, classes, num = detect_result
-        confidence_score_list = np.squeeze(scores)
-        classes_list = np.squeeze(classes).astype(np.int32)
-        boxes_list = np.squeeze(boxes)
+        return self._build_image_dict(image_shape=image_np.shape,
+                                      padded_shape=image_np.shape,
+                                      boxes=boxes[0], scores=scores[0], classes=classes[0],
+                                      num=num[0], original_shape=original_shape)
+
+    def detect_images(self, image_paths, batch_size=None):
+        """
+        detect bboxes for a list of images in batches
+        :param image_paths:
+        :param batch_size: max number of images of each detection run, config.batch_size if None
+        :return: list of image_dict in the order of image_paths
+        """
+        with ImagePrefetcher(image_paths,
+                             load_fn=lambda image_path: image_utils.decode_image(
+                                 image_path, min_size=self.config.decode_min_size),
+                             num_threads=self.config.decode_threads,
+                             queue_size=max(len(image_paths), 1)) as prefetcher:
+            decoded = [result for _, result in prefetcher]
+        return self.detect_arrays([image_np for image_np, _ in decoded], batch_size=batch_size,
+                                  original_shapes=[original_shape for _, original_shape in decoded])
+
+    def detect_arrays(self, image_nps, batch_size=None, original_shapes=None):
+        """
+        detect bboxes for a list of decoded images in batches,
+        images are grouped by resolution and each group is padded to the same size at the bottom and right,
+        bboxes are mapped back to the coordinates of each original image
+        :param image_nps: list of uint8 arrays of shape [height, width, channel]
+        :param batch_size: max number of images of each detection run, config.batch_size if None
+        :param original_shapes: full size shapes of images decoded at reduced scale,
+            bboxes and sizes of image_dict are in full size coordinates, shapes of image_nps if None
+        :return: list of image_dict in the order of image_nps
+        """
+        if batch_size is None:
+            batch_size = self.config.batch_size
+        image_dicts = [None] * len(image_nps)
+        for padded_shape, indices in self._group_by_resolution(image_nps):
+            for begin in range(0, len(indices), batch_size):
+                batch_indices = indices[begin:begin + batch_size]
+                batch_images = np.zeros((len(batch_indices),) + padded_shape, dtype=np.uint8)
+                for row, idx in enumerate(batch_indices):
+                    (img_width, img_height) = image_nps[idx].shape[:2]
+                    batch_images[row, :img_width, :img_height] = image_nps[idx][:, :, :3]
+                boxes, scores, classes, num = self.detect(image_np_expanded=batch_images)
+                for row, idx in enumerate(batch_indices):
+                    image_dicts[idx] = self._build_image_dict(
+                        image_shape=image_nps[idx].shape, padded_shape=padded_shape,
+                        boxes=boxes[row], scores=scores[row], classes=classes[row],
+                        num=num[row],
+                        original_shape=original_shapes[idx] if original_shapes is not None else None)
+        return image_dicts
+
+    def _group_by_resolution(self, image_nps):
+        """
+        :return: list of (padded_shape, image indices), images of a group have
+            the same size after rounding up to config.resolution_step
+        """
+        step = self.config.resolution_step
+        groups = dict()
+        for idx, image_np in enumerate(image_nps):
+            (img_width, img_height) = image_np.shape[:2]
+            padded_shape = (-(-img_width // step) * step, -(-img_height // step) * step, 3)
+            groups.setdefault(padded_shape, list()).append(idx)
+        return sorted(groups.items())
+
+    def _build_image_dict(self, image_shape, padded_shape, boxes, scores, classes, num, original_shape=None):
+        """
+        convert detection result of one image into image_dict with compact bbox arrays:
+            bbox_boxes:     int32 [N, 4] of x_min, y_min, x_max, y_max
+            bbox_class_ids: int32 [N]
+            bbox_scores:    float32 [N]
+        boxes are normalized by padded_shape, scaled to original_shape (image_shape if None) and clipped to it,
+        detections are filtered by score threshold and min area, suppressed by nms
+        and truncated to the top max_num_bboxes by score
+        """
+        config = self.config
+        (decoded_width, decoded_height) = image_shape[:2]
+        (img_width, img_height, channel) = original_shape if original_shape is not None else image_shape
+        # normalized coordinates of the padded image to pixels of the original image
+        (padded_width, padded_height) = (padded_shape[0] * img_width / decoded_width,
+                                         padded_shape[1] * img_height / decoded_height)
         image_dict = dict()
 
         image_dict['width'] = img_width
-        image_dict['height']  = img_height
+        image_dict['height'] = img_height
         image_dict['channel'] = channel
         # image_id = image_utils.get_image_name(image_path)
         # image_dict["image_id"] = image_id
-        bboxes = list()
-        # class_ids = list()
-        # class_names = list()
-        # confidences = list()
-
-        for idx, confidence_score in enumerate(confidence_score_list):
-            box = boxes_list[idx]
-            x_min = int(box[0] * img_width)
-            y_min = int(box[1] * img_height)
-            x_max = int(box[2] * img_width)
-            y_max = int(box[3] * img_height)
-
-            class_id = int(classes_list[idx])
-            class_name = self.category_index.get(class_id).get('name')
-            bbox_dict = {
-                "class_id": int(class_id),
-                "class_name": class_name,
-                "confidence": float(confidence_score),
-                "x_min": x_min, "y_min": y_min,
-                "x_max": x_max, "y_max": y_max
-            }
-            bboxes.append(bbox_dict)
-        image_dict["bboxes"] = bboxes
+
+        num = int(num)
+        scores = scores[:num]
+        keep = scores >= config.score_threshold
+        scores = scores[keep]
+        classes = classes[:num][keep]
+        scales = np.asarray([padded_width, padded_height, padded_width, padded_height], dtype=np.float32)
+        limits = np.asarray([img_width, img_height, img_width, img_height], dtype=np.int32)
+        boxes = np.minimum((boxes[:num][keep] * scales).astype(np.int32), limits)
+
+        keep = bbox_utils.box_areas(boxes) >= config.min_box_area
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+        if config.nms_iou_threshold is not None:
+            keep = bbox_utils.non_max_suppression(
+                boxes, scores, iou_threshold=config.nms_iou_threshold,
+                max_output=config.max_num_bboxes)
+        else:
+            keep = np.argsort(-scores, kind='mergesort')[:config.max_num_bboxes]
+        image_dict["bbox_boxes"] = boxes[keep]
+        image_dict["bbox_class_ids"] = classes[keep].astype(np.int32)
+        image_dict["bbox_scores"] = scores[keep].astype(np.float32)
         return image_dict
 
+    def get_class_name(self, class_id):
+        return self.category_index.get(int(class_id)).get('name')
+
+
 def load_images():
     batch_size = 40
     image_dir = None
@@ -165,18 +265,16 @@ def main(_):
     detector = FasterRCNNDetector(config=config)
     image_gen = load_images()
     for batch, batch_images in enumerate(image_gen):
-        for idx, image_path in enumerate(batch_images):
-            image_dict = detector.detect_image(image_path=image_path)
+        image_dicts = detector.detect_images(image_paths=batch_images)
+        for image_path, image_dict in zip(batch_images, image_dicts):
             # image_id = image_dict["image_id"]
-            bboxes = image_dict["bboxes"]
             print("image_path={}".format(image_path))
-            for idx, box_dict in enumerate(bboxes):
+            for box, class_id, score in zip(image_dict["bbox_boxes"], image_dict["bbox_class_ids"],
+                                            image_dict["bbox_scores"]):
                 print("\tconfidence={:.8f}, class_id={:2d}, class_name={:16}, "
-                      "x_min={:.4f}, y_min={:.4f}, m_max={:.4f}, y_max={:.4f}"
-                      .format(box_dict["confidence_score"], box_dict["class_id"],
-                              box_dict["class_name"],
-                              box_dict["x_min"], box_dict["y_min"],
-                              box_dict["x_max"], box_dict["y_max"]))
+                      "x_min={:4d}, y_min={:4d}, m_max={:4d}, y_max={:4d}"
+                      .format(score, class_id, detector.get_class_name(class_id),
+                              box[0], box[1], box[2], box[3]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Full batches of feature extraction across images
+import collections
+import time
+
+import numpy as np
+
+
+class FeatureBatcher(object):
+    """
+    gather crops of many images into full batches of feature extraction and
+    return the items in the order they are added once all of their features are extracted.
+    with split_images, batch_size counts crops and the crops of one image may span two runs,
+    otherwise batch_size counts images and all crops of an image are extracted in the same run
+
+    usage:
+        batcher = FeatureBatcher(extractor.get_batch_crop_features, batch_size=40)
+        for item, image, boxes in items:
+            for item, features in batcher.add(item, image, boxes):
+                ...
+        for item, features in batcher.flush():
+            ...
+    """
+
+    def __init__(self, extract_fn, batch_size, split_images=True):
+        """
+        :param extract_fn: function of (list of images, list of box arrays) to list of feature arrays
+            with one row for each box
+        :param batch_size: number of crops of each run, number of images if not split_images
+        :param split_images: whether crops of one image may be extracted in different runs
+        """
+        self.extract_fn = extract_fn
+        self.batch_size = batch_size
+        self.split_images = split_images
+        self._pending = collections.deque()  # entries of added items in order
+        self._queue = collections.deque()  # [entry, first box not queued for extraction]
+        self._queued_size = 0
+
+        # counters
+        self.num_runs = 0
+        self.num_crops = 0
+        self.num_images = 0
+        self.run_time = 0.0
+
+    def add(self, item, image, boxes):
+        """
+        :param image: decoded image, None if the item needs no features
+        :param boxes: float array [N, 4] of crops of image normalized to [0, 1]
+        :return: list of (item, features [N, dim] or None) of completed items
+        """
+        entry = {"item": item, "image": image, "boxes": None, "features": list(), "remaining": 0}
+        if image is not None:
+            entry["boxes"] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            entry["remaining"] = len(entry["boxes"])
+        self._pending.append(entry)
+        if entry["remaining"] > 0:
+            self._queue.append([entry, 0])
+            self._queued_size += entry["remaining"] if self.split_images else 1
+        while self._queued_size >= self.batch_size:
+            self._run_batch()
+        return self._pop_completed()
+
+    def flush(self):
+        """extract the last partial batch, :return: list of (item, features) of all remaining items"""
+        while self._queued_size > 0:
+            self._run_batch()
+        return self._pop_completed()
+
+    def _run_batch(self):
+        images, boxes_list, entries = list(), list(), list()
+        size = 0
+        while len(self._queue) > 0 and size < self.batch_size:
+            queued = self._queue[0]
+            entry, begin = queued
+            end = len(entry["boxes"])
+            if self.split_images:
+                end = min(end, begin + self.batch_size - size)
+                size += end - begin
+            else:
+                size += 1
+            images.append(entry["image"])
+            boxes_list.append(entry["boxes"][begin:end])
+            entries.append(entry)
+            if end == len(entry["boxes"]):
+                self._queue.popleft()
+            else:
+                queued[1] = end
+        self._queued_size -= size
+
+        begin_time = time.time()
+        features_list = self.extract_fn(images, boxes_list)
+        self.run_time += time.time() - begin_time
+        self.num_runs += 1
+        self.num_images += len(images)
+        for entry, features in zip(entries, features_list):
+            entry["features"].append(features)
+            entry["remaining"] -= len(features)
+            self.num_crops += len(features)
+
+    def _pop_completed(self):
+        completed = list()
+        while len(self._pending) > 0 and self._pending[0]["remaining"] == 0:
+            entry = self._pending.popleft()
+            features = np.concatenate(entry["features"]) if len(entry["features"]) > 0 else None
+            completed.append((entry["item"], features))
+        return completed
+
+    def get_stats(self):
+        """
+        :return: dict of number of runs, mean crops and images of each run and crops per second of runs
+        """
+        return {
+            "num_runs": self.num_runs,
+            "crops_per_run": self.num_crops / self.num_runs if self.num_runs > 0 else 0.0,
+            "images_per_run": self.num_images / self.num_runs if self.num_runs > 0 else 0.0,
+            "crops_per_sec": self.num_crops / self.run_time if self.run_time > 0 else 0.0,
+        }
@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Benchmark of region feature extraction images/sec, per image runs and cross-image batches
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from visual_caption.image_caption.feature.feature_batcher import FeatureBatcher
+from visual_caption.image_caption.feature.feature_extractor import FeatureExtractor
+from visual_caption.utils import image_utils
+
+tf.flags.DEFINE_string("image_dir", None, "directory of benchmark images")
+tf.flags.DEFINE_integer("num_images", 50, "number of images extracted for each batch size")
+tf.flags.DEFINE_integer("num_boxes", 36, "number of grid boxes of each image besides the whole image")
+tf.flags.DEFINE_string("batch_sizes", "10,20,40,80", "comma separated numbers of crops of each run")
+FLAGS = tf.flags.FLAGS
+
+
+def get_grid_boxes(num_boxes):
+    """:return: normalized boxes of the whole image followed by num_boxes overlapping grid boxes"""
+    grid = int(np.ceil(np.sqrt(num_boxes)))
+    boxes = [[0.0, 0.0, 1.0, 1.0]]
+    for idx in range(num_boxes):
+        row, col = divmod(idx, grid)
+        boxes.append([row / (grid + 1), col / (grid + 1), (row + 2) / (grid + 1), (col + 2) / (grid + 1)])
+    return np.asarray(boxes, dtype=np.float32)
+
+
+def time_per_image(extractor, image_nps, boxes):
+    """:return: images per second of one extraction run for each image"""
+    extractor.get_crop_features(image_nps[0], boxes)  # warm up
+    begin = time.time()
+    for image_np in image_nps:
+        extractor.get_crop_features(image_np, boxes)
+    return len(image_nps) / (time.time() - begin)
+
+
+def time_batched(extractor, image_nps, boxes, batch_size):
+    """:return: (images per second, batcher stats) of runs of batch_size crops across images"""
+    extractor.get_batch_crop_features(image_nps[:1], [boxes[:batch_size]])  # warm up
+    batcher = FeatureBatcher(extractor.get_batch_crop_features, batch_size)
+    begin = time.time()
+    for idx, image_np in enumerate(image_nps):
+        batcher.add(idx, image_np, boxes)
+    batcher.flush()
+    return len(image_nps) / (time.time() - begin), batcher.get_stats()
+
+
+def main(_):
+    image_files = sorted(Path(FLAGS.image_dir).glob('*.jpg'))[:FLAGS.num_images]
+    # images are decoded once, only feature extraction is timed
+    image_nps = image_utils.load_images(image_files)
+    boxes = get_grid_boxes(FLAGS.num_boxes)
+    extractor = FeatureExtractor()
+    print("{} images with {} crops each".format(len(image_nps), len(boxes)))
+    print("per image runs: images/sec={:8.2f}".format(time_per_image(extractor, image_nps, boxes)))
+    for batch_size in [int(value) for value in FLAGS.batch_sizes.split(",")]:
+        images_per_sec, stats = time_batched(extractor, image_nps, boxes, batch_size)
+        print("batch_size={:3d}: images/sec={:8.2f}, crops/sec={:8.2f}, images/run={:5.2f}"
+              .format(batch_size, images_per_sec, images_per_sec * len(boxes), stats["images_per_run"]))
+
+
+if __name__ == '__main__':
+    tf.app.run()
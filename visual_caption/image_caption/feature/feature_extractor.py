@@ -7,12 +7,12 @@ from __future__ import unicode_literals  # compatible with python3 unicode codin
 import os
 from pathlib import Path
 
+import numpy as np
 import tensorflow as tf
-from scipy.misc import imresize
-from sklearn.preprocessing import normalize
 
-from visual_caption.utils import image_utils
+from visual_caption.utils import bbox_utils, image_utils
 from visual_caption.utils.decorator_utils import timeit
+from visual_caption.utils.image_prefetcher import ImagePrefetcher
 
 slim = tf.contrib.slim
 from slim.nets.inception_resnet_v2 import inception_resnet_v2_arg_scope, inception_resnet_v2
@@ -23,15 +23,32 @@ model_data_dir = os.path.join(base_data_dir, "tf/models")
 inception_resnet_v2_ckpt = os.path.join(model_data_dir, "inception_resnet_v2_2016_08_30.ckpt")
 
 batch_size = 40
+decode_threads = 4
+# preprocessing params features depend on, part of feature cache keys
+FEATURE_PARAMS = {"image_size": 299, "normalize": "l2", "feature": "PreLogitsFlatten"}
+# crops of get_crop_features are cut and bilinear resized by crop_and_resize in the graph,
+# boxes are mapped to padded images by (size - 1) / (padded_size - 1) as crop_and_resize aligns corners
+CROP_PARAMS = {"resize": "crop_and_resize", "box_scale": "corners"}
+# images of a crop run are grouped by height and width rounded up to crop_resolution_step,
+# each group is padded to its own size
+crop_resolution_step = 64
+# bboxes kept on a zero canvas of the whole image size which is resized to 299 x 299
+CANVAS_PARAMS = {"resize": "masked_canvas"}
+# region features of roi mode are pooled from roi_crop_size x roi_crop_size bilinear crops
+# of the last conv feature map (8 x 8 x 1536 for 299 x 299 images)
+roi_feature_map = 'Conv2d_7b_1x1'
+roi_crop_size = 4
+ROI_PARAMS = {"feature_map": roi_feature_map, "crop_size": roi_crop_size, "pool": "mean", "normalize": "l2"}
+
+
+def load_resized_image(image_path):
+    return image_utils.load_resized_image(image_path, (299, 299))
 
 
 def load_images(image_files):
     raw_images = list()
     for idx, image_path in enumerate(image_files):
-        image_rawdata = image_utils.load_image(image_path=image_path)
-        if image_rawdata is not None:
-            image_rawdata = imresize(image_rawdata, (299, 299, 3))
-            raw_images.append(image_rawdata)
+        raw_images.append(load_resized_image(image_path))
     return raw_images
 
 
@@ -41,10 +58,24 @@ class FeatureExtractor(object):
     """
 
     def __init__(self, sess=None):
-        self.input_images = tf.placeholder(
-            tf.float32,
+        # crops of uint8 images padded to the same size are cut and resized in the graph
+        # (get_batch_crop_features), boxes are normalized to [0, 1] of the padded images
+        # in (min_0, min_1, max_0, max_1) order, each with the index of its image
+        self.input_raw_images = tf.placeholder(tf.uint8, shape=(None, None, None, 3), name='input_raw_images')
+        self.input_crop_boxes = tf.placeholder(tf.float32, shape=(None, 4), name='input_crop_boxes')
+        self.input_crop_box_indices = tf.placeholder(tf.int32, shape=(None,), name='input_crop_box_indices')
+        crops = tf.image.crop_and_resize(
+            tf.to_float(self.input_raw_images), boxes=self.input_crop_boxes,
+            box_ind=self.input_crop_box_indices, crop_size=[299, 299])
+        # images resized in python are fed directly, which skips the crop ops
+        self.input_images = tf.placeholder_with_default(
+            crops,
             shape=(None, 299, 299, 3),
             name='input_images')
+        # boxes of roi mode normalized to [0, 1] in (min_0, min_1, max_0, max_1) order,
+        # and the index of the image in input_images each box belongs to
+        self.input_boxes = tf.placeholder(tf.float32, shape=(None, 4), name='input_boxes')
+        self.input_box_indices = tf.placeholder(tf.int32, shape=(None,), name='input_box_indices')
         if sess is None:
             gpu_options = tf.GPUOptions(
                 per_process_gpu_memory_fraction=0.6)
@@ -69,15 +100,41 @@ class FeatureExtractor(object):
         saver = tf.train.Saver()
         checkpoint_file = inception_resnet_v2_ckpt
         saver.restore(self.sess, checkpoint_file)
-        self.fetches = [end_points['PreLogitsFlatten'], logits]
+        # whole image features, crop features and region features are all l2 normalized in the graph
+        image_features = tf.nn.l2_normalize(end_points['PreLogitsFlatten'], dim=1)
+        self.fetches = [image_features, logits]
+        self.crop_fetch = image_features
+
+        # region features pooled from the feature map of the same backbone pass
+        region_maps = tf.image.crop_and_resize(end_points[roi_feature_map], boxes=self.input_boxes,
+                                               box_ind=self.input_box_indices,
+                                               crop_size=[roi_crop_size, roi_crop_size])
+        region_features = tf.reduce_mean(region_maps, axis=[1, 2])
+        self.roi_fetches = [image_features, tf.nn.l2_normalize(region_features, dim=1)]
 
     def get_features(self, image_files):
-        raw_images = load_images(image_files)
+        """
+        features of image_files, images are decoded and resized in background threads
+        while the previous batch is in the session
+        """
+        results = list()
+        raw_images = list()
+        with ImagePrefetcher(image_files, load_fn=load_resized_image,
+                             num_threads=decode_threads, queue_size=2 * batch_size) as prefetcher:
+            for image_file, raw_image in prefetcher:
+                raw_images.append(raw_image)
+                if len(raw_images) == batch_size:
+                    results.extend(self._run_features(raw_images))
+                    raw_images = list()
+        if len(raw_images) > 0:
+            results.extend(self._run_features(raw_images))
+        return np.asarray(results) if len(results) > 0 else results
+
+    def _run_features(self, raw_images):
         feed_dict = {self.input_images: raw_images}
         predict_values, logit_values = self.sess.run(
             self.fetches, feed_dict)
-        results = normalize(predict_values)
-        return results
+        return predict_values
 
     def get_feature(self, image_path):
         image_files = [image_path]
@@ -92,22 +149,114 @@ class FeatureExtractor(object):
         raw_image_datas = list()
         results = list()
         for image_rawdata in image_rawdata_list:
-            image_rawdata = imresize(image_rawdata, (299, 299, 3))
+            image_rawdata = image_utils.resize_image(image_rawdata, (299, 299))
             raw_image_datas.append(image_rawdata)
 
             if len(raw_image_datas) == batch_size:
                 feed_dict = {self.input_images: raw_image_datas}
                 predict_values, logit_values = self.sess.run(
                     self.fetches, feed_dict)
-                results.extend(normalize(predict_values))
+                results.extend(predict_values)
                 raw_image_datas = list()
 
         if len(raw_image_datas) > 0:
             feed_dict = {self.input_images: raw_image_datas}
             predict_values, logit_values = self.sess.run(
                 self.fetches, feed_dict)
-            results.extend(normalize(predict_values))
+            results.extend(predict_values)
 
         del raw_image_datas
 
         return results
+
+    def get_roi_features(self, image_rawdata_list, boxes_list):
+        """
+        whole image features and region features of images with one backbone pass for each image,
+        region features are pooled from the conv feature map by crop_and_resize in the graph
+        :param image_rawdata_list: list of decoded images
+        :param boxes_list: list of float arrays [N, 4] normalized to [0, 1] in (min_0, min_1, max_0, max_1) order
+        :return: (list of image features, list of region feature arrays [N, dim] of each image)
+        """
+        image_features = list()
+        region_features_list = list()
+        for begin in range(0, len(image_rawdata_list), batch_size):
+            batch_images = image_rawdata_list[begin:begin + batch_size]
+            batch_boxes = boxes_list[begin:begin + batch_size]
+            raw_image_datas = list()
+            normalized_boxes = list()
+            box_indices = list()
+            for idx, (image_rawdata, boxes) in enumerate(zip(batch_images, batch_boxes)):
+                raw_image_datas.append(image_utils.resize_image(image_rawdata, (299, 299)))
+                normalized_boxes.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+                box_indices.append(np.full(len(normalized_boxes[-1]), idx, dtype=np.int32))
+            feed_dict = {self.input_images: raw_image_datas,
+                         self.input_boxes: np.concatenate(normalized_boxes),
+                         self.input_box_indices: np.concatenate(box_indices)}
+            predict_values, region_values = self.sess.run(self.roi_fetches, feed_dict)
+            image_features.extend(predict_values)
+            splits = np.cumsum([len(boxes) for boxes in normalized_boxes])[:-1]
+            region_features_list.extend(np.split(region_values, splits))
+        return image_features, region_features_list
+
+    def get_crop_features(self, image_rawdata, boxes):
+        """
+        features of crops of one image, cropping, resizing to 299 x 299, scaling and l2 normalization
+        run in the graph, only the uint8 image crosses the feed boundary
+        :param image_rawdata: uint8 array [height, width, channel]
+        :param boxes: float array [N, 4] normalized to [0, 1] in (min_0, min_1, max_0, max_1) order,
+            [0, 0, 1, 1] for the whole image
+        :return: float32 array [N, dim]
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        results = list()
+        for begin in range(0, len(boxes), batch_size):
+            results.extend(self.get_batch_crop_features([image_rawdata], [boxes[begin:begin + batch_size]]))
+        if len(results) == 0:
+            return np.zeros([0, self.crop_fetch.shape[1].value], dtype=np.float32)
+        return np.concatenate(results)
+
+    def get_batch_crop_features(self, image_rawdata_list, boxes_list):
+        """
+        features of crops of several images, images are grouped by resolution and each group is
+        zero padded at the bottom and right to the same size and run together,
+        boxes are rescaled to the padded size
+        :param image_rawdata_list: list of uint8 arrays [height, width, channel]
+        :param boxes_list: list of float arrays [N, 4] normalized to [0, 1] of each image
+        :return: list of float32 arrays [N, dim] of each image
+        """
+        features_list = [None] * len(image_rawdata_list)
+        for padded_shape, indices in get_resolution_groups(image_rawdata_list, crop_resolution_step):
+            raw_images = np.zeros((len(indices),) + padded_shape, dtype=np.uint8)
+            crop_boxes = list()
+            box_indices = list()
+            for row, idx in enumerate(indices):
+                image_rawdata = image_rawdata_list[idx]
+                (height, width) = image_rawdata.shape[:2]
+                raw_images[row, :height, :width] = image_rawdata[:, :, :3]
+                crop_boxes.append(bbox_utils.get_padded_boxes(boxes_list[idx], (height, width), padded_shape[:2]))
+                box_indices.append(np.full(len(crop_boxes[-1]), row, dtype=np.int32))
+            if sum(len(boxes) for boxes in crop_boxes) == 0:
+                features = np.zeros([0, self.crop_fetch.shape[1].value], dtype=np.float32)
+            else:
+                feed_dict = {self.input_raw_images: raw_images,
+                             self.input_crop_boxes: np.concatenate(crop_boxes),
+                             self.input_crop_box_indices: np.concatenate(box_indices)}
+                features = self.sess.run(self.crop_fetch, feed_dict)
+            splits = np.cumsum([len(boxes) for boxes in crop_boxes])[:-1]
+            for idx, image_features in zip(indices, np.split(features, splits)):
+                features_list[idx] = image_features
+        return features_list
+
+
+def get_resolution_groups(image_rawdata_list, step):
+    """
+    :return: list of (padded_shape, image indices), images of a group have
+        the same size after rounding up to step
+    """
+    groups = dict()
+    for idx, image_rawdata in enumerate(image_rawdata_list):
+        (height, width) = image_rawdata.shape[:2]
+        padded_shape = (-(-height // step) * step, -(-width // step) * step, 3)
+        groups.setdefault(padded_shape, list()).append(idx)
+    return sorted(groups.items())
+
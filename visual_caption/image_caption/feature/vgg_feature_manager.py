@@ -7,10 +7,10 @@ from __future__ import unicode_literals  # compatible with python3 unicode codin
 import os
 
 import tensorflow as tf
-from scipy.misc import imresize
 from sklearn.preprocessing import normalize
 
 from visual_caption.image_caption.feature.vgg19 import Vgg19
+from visual_caption.utils import image_utils
 
 vgg_data_dir = "/home/liuxiaoming/data/vgg"
 
@@ -36,7 +36,7 @@ class FeatureManager(object):
         self.vgg_model.build(self.input_images)
 
     def get_feature(self, image_rawdata):
-        resized_image = imresize(image_rawdata, self.shape)
+        resized_image = image_utils.resize_image(image_rawdata, self.shape)
         feed_dict = {self.input_images: [resized_image]}
         fc7 = self.sess.run(self.vgg_model.fc7, feed_dict=feed_dict)
         fc7 = normalize(fc7)
@@ -46,7 +46,7 @@ class FeatureManager(object):
         image_rawdata_batch = []
         for img in image_batch:
             # print("img.shape={}".format(img.shape))
-            resized_image = imresize(img, self.shape)
+            resized_image = image_utils.resize_image(img, self.shape)
             image_rawdata_batch.append(resized_image)
 
         feed_dict = {self.input_images: image_rawdata_batch}
@@ -20,6 +20,9 @@ class ImageCaptionAttentionModel(ImageCaptionBaseModel):
             2.Multi-modal Factorized Bilinear Pooling with Co-Attention
 
     """
+    input_features = ('image_id', 'image_feature', 'bbox_features',
+                      'caption_ids', 'fw_target_ids', 'bw_target_ids',
+                      'caption_length', 'fw_target_length', 'bw_target_length')
 
     def __init__(self, model_config, data_reader, mode):
         super(ImageCaptionAttentionModel, self).__init__(
@@ -43,25 +46,19 @@ class ImageCaptionAttentionModel(ImageCaptionBaseModel):
             self.input_seqs = tf.expand_dims(self.input_feed, 1)
 
         else:
-            (id_batch, width_batch, height_batch, depth_batch, feature_batch,
-             bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features,
-             caption_batch, fw_target_batch, bw_target_batch,
-             caption_ids, fw_target_ids, bw_target_ids,
-             caption_lengths, fw_target_lengths, bw_target_lengths) = self.next_batch
+            self.image_ids = self.next_batch['image_id']
 
-            self.image_ids = id_batch
+            self.image_feature = self.next_batch['image_feature']
+            self.region_features = self.next_batch['bbox_features']
 
-            self.image_feature = feature_batch
-            self.region_features = bbox_features
+            self.input_seqs = self.next_batch['caption_ids']
+            self.input_lengths = self.next_batch['caption_length']
 
-            self.input_seqs = caption_ids
-            self.input_lengths = caption_lengths
+            self.fw_target_seqs = self.next_batch['fw_target_ids']
+            self.fw_target_lengths = self.next_batch['fw_target_length']
 
-            self.fw_target_seqs = fw_target_ids
-            self.fw_target_lengths = fw_target_lengths
-
-            self.bw_target_seqs = bw_target_ids
-            self.bw_target_lengths = bw_target_lengths
+            self.bw_target_seqs = self.next_batch['bw_target_ids']
+            self.bw_target_lengths = self.next_batch['bw_target_length']
 
             # input visual features
         expend_images = tf.expand_dims(self.image_feature, axis=1)
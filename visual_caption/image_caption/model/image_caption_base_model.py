@@ -12,6 +12,8 @@ from visual_caption.utils.decorator_utils import timeit, define_scope
 
 
 class ImageCaptionBaseModel(BaseModel):
+    input_features = ('image_id', 'image_feature', 'caption_ids', 'fw_target_ids', 'caption_length')
+
     def __init__(self, model_config, data_reader, mode):
         super(ImageCaptionBaseModel, self).__init__(
             model_config, data_reader, mode)
@@ -31,17 +33,11 @@ class ImageCaptionBaseModel(BaseModel):
             input_seqs = tf.expand_dims(self.input_feed, 1)
             self.input_seqs = input_seqs
         else:
-            (image_id_batch, width_batch, height_batch, depth_batch, image_feature_batch,  # for image
-             bbox_shape_batch, bbox_num_batch, bbox_labels, bboxes, bbox_features,  # for bbox
-             caption_batch, fw_target_batch, bw_target_batch,  # for text
-             caption_ids, fw_target_ids, bw_target_ids,  # for ids
-             input_lengths) = self.next_batch
-
-            self.image_ids = image_id_batch
-            self.image_feature = image_feature_batch
-            self.input_seqs = caption_ids
-            self.target_seqs = fw_target_ids
-            self.input_lengths = input_lengths
+            self.image_ids = self.next_batch['image_id']
+            self.image_feature = self.next_batch['image_feature']
+            self.input_seqs = self.next_batch['caption_ids']
+            self.target_seqs = self.next_batch['fw_target_ids']
+            self.input_lengths = self.next_batch['caption_length']
 
         # input visual features
         # expend_images = tf.expand_dims(self.image_feature, axis=1)
@@ -16,6 +16,10 @@ from visual_caption.utils.decorator_utils import timeit, define_scope
 
 
 class ImageCaptionBiModel(BaseModel):
+    input_features = ('image_id', 'image_feature',
+                      'caption_ids', 'fw_target_ids', 'bw_target_ids',
+                      'caption_length', 'fw_target_length', 'bw_target_length')
+
     def __init__(self, model_config, data_reader, mode):
         super(ImageCaptionBiModel, self).__init__(
             model_config, data_reader, mode)
@@ -44,24 +48,17 @@ class ImageCaptionBiModel(BaseModel):
             self.input_bw_seqs = tf.expand_dims(self.input_bw_feed, 1)
 
         else:
-            id_batch, width_batch, height_batch, depth_batch, feature_batch, \
-            bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features, \
-            caption_batch, fw_target_batch, bw_target_batch, \
-            caption_ids, fw_target_ids, bw_target_ids, \
-            caption_lengths, fw_target_lengths, bw_target_lengths = self.next_batch
-
-            self.image_ids = id_batch
+            self.image_ids = self.next_batch['image_id']
 
-            self.image_feature = feature_batch
-            self.region_features = bbox_features
+            self.image_feature = self.next_batch['image_feature']
 
-            self.input_seqs = caption_ids
-            self.fw_target_seqs = fw_target_ids
-            self.bw_target_seqs = bw_target_ids
+            self.input_seqs = self.next_batch['caption_ids']
+            self.fw_target_seqs = self.next_batch['fw_target_ids']
+            self.bw_target_seqs = self.next_batch['bw_target_ids']
 
-            self.input_lengths = caption_lengths
-            self.fw_target_lengths = fw_target_lengths
-            self.bw_target_lengths = bw_target_lengths
+            self.input_lengths = self.next_batch['caption_length']
+            self.fw_target_lengths = self.next_batch['fw_target_length']
+            self.bw_target_lengths = self.next_batch['bw_target_length']
 
         # input visual features
         # expend_images = tf.expand_dims(self.image_feature, axis=1)
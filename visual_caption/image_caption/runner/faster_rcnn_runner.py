@@ -43,6 +43,8 @@ class FasterRCNNModelRunner(BaseRunner):
 
         self.data_config = ImageCaptionDataConfig()
         self.data_reader = ImageCaptionDataReader(data_config=self.data_config)
+        # models are built with the dim of visual features in the tfrecords, projected ones are smaller
+        self.data_config.dim_visual_feature = self.data_reader.get_dim_visual_feature()
         self.model_config = ImageCaptionModelConfig(data_config=self.data_config,
                                                model_name="image_caption_faster_rcnn")
 
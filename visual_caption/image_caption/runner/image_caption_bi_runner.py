@@ -32,6 +32,8 @@ class ImageCaptionBiRunner(BaseRunner):
         self.data_config.batch_size = 200
         self.data_reader = ImageCaptionDataReader(
             data_config=self.data_config)
+        # models are built with the dim of visual features in the tfrecords, projected ones are smaller
+        self.data_config.dim_visual_feature = self.data_reader.get_dim_visual_feature()
         self.model_config = ImageCaptionModelConfig(
             data_config=self.data_config,
             model_name="image_caption_bi")
@@ -74,16 +76,21 @@ class ImageCaptionBiRunner(BaseRunner):
                 sess.run(init_op)
             sess.run(tf.tables_initializer())
             train_init_op = self.data_reader.get_train_init_op()
+            # resume training data from the position saved with the checkpoint
+            start_epoch, start_batch = model.restore_input_state()
             begin = time.time()
             # running the first internal evaluation
             global_step = tf.train.global_step(sess, model.global_step_tensor)
             max_acc = 0.0
             if global_step > 0:
                 max_acc = self._internal_eval(model=model, sess=sess)
-            for epoch in range(model.model_config.max_max_epoch):
-                sess.run(train_init_op)  # initial train data options
+            for epoch in range(start_epoch, model.model_config.max_max_epoch):
+                skip_batches = start_batch if epoch == start_epoch else 0
+                sess.run(train_init_op,  # initial train data options
+                         feed_dict=self.data_reader.get_train_feed_dict(
+                             epoch=epoch, skip_batches=skip_batches))
                 step_begin = time.time()
-                batch = 0
+                batch = skip_batches
                 while True:  # train each batch in a epoch
                     try:
                         result_batch = sess.run(fetches)  # run training step
@@ -118,10 +125,13 @@ class ImageCaptionBiRunner(BaseRunner):
                                     sess, model.global_step_tensor)
                                 model.logger.info("finished validation in training step {}"
                                                   .format(global_step))
+                            # evaluation switched the data iterator to valid data, continue the epoch
+                            sess.run(self.data_reader.get_train_switch_op())
                             valid_acc = valid_result
                             if valid_acc > max_acc:  # save the best model session
                                 max_acc = valid_acc
-                                model.save_model(sess=sess, global_step=global_step)
+                                model.save_model(sess=sess, global_step=global_step,
+                                                 epoch=epoch, batch=batch)
                                 print('training: epoch={}, step={}, validation: average_result ={}'
                                       .format(epoch, global_step, valid_result))
                             print("training epoch={} finished with {} batches, global_step={}, elapsed={:.4f} "
@@ -137,7 +147,8 @@ class ImageCaptionBiRunner(BaseRunner):
                         valid_acc = valid_result
                         if valid_acc > max_acc:  # save the best model session
                             max_acc = valid_acc
-                            model.save_model(sess=sess, global_step=global_step)
+                            model.save_model(sess=sess, global_step=global_step,
+                                             epoch=epoch + 1, batch=0)
                             print('training: epoch={}, step={}, validation: average_result ={}'
                                   .format(epoch, global_step, valid_result))
                         print("training epoch={} finished with {} batches, global_step={}, elapsed={:.4f} "
@@ -156,7 +167,7 @@ class ImageCaptionBiRunner(BaseRunner):
         fetches = [model.bw_batch_accuracy, model.bw_batch_loss, model.summary_merged]
         batch_count = 0
         eval_acc = 0.0
-        validation_init_op = self.data_reader.get_valid_init_op()
+        validation_init_op = self.data_reader.get_valid_init_op(cached=True)
         # initialize validation dataset
         sess.run(validation_init_op)
         step_begin = time.time()
@@ -173,8 +184,6 @@ class ImageCaptionBiRunner(BaseRunner):
                     print("valid: step={0:8d}, batch={1:4d} loss={2:.4f}, acc={3:.4f}, elapsed={4:.4f}"
                           .format(global_step, batch_count, loss, acc, time.time() - step_begin))
                     step_begin = time.time()
-                if batch_count >= 100:
-                    break
             except tf.errors.OutOfRangeError:  # ==> "End of validation dataset"
                 print("_internal_eval finished : step={0}, batch={1}, elapsed={2:.4f}"
                       .format(global_step, batch_count, time.time() - step_begin))
@@ -243,13 +252,11 @@ class ImageCaptionBiRunner(BaseRunner):
                 while True:  # train each batch in a epoch
                     try:
                         batch_data = sess.run(model.next_batch)
-                        (id_batch, width_batch, height_batch, depth_batch, feature_batch,
-                         bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features,
-                         caption_batch, fw_target_batch, bw_target_batch,
-                         caption_ids, fw_target_ids, bw_target_ids,
-                         caption_lengths, fw_target_lengths, bw_target_lengths) = batch_data
+                        feature_batch = batch_data['image_feature']
+                        caption_ids = batch_data['caption_ids']
+                        caption_lengths = batch_data['caption_length']
 
-                        for idx, image_id in enumerate(id_batch):  # for each image
+                        for idx, image_id in enumerate(batch_data['image_id']):  # for each image
                             image_feature = feature_batch[idx].reshape(1, -1)
                             print("image_id={}".format(image_id))
                             fw_predict_captions = fw_generator.beam_search(
@@ -257,7 +264,7 @@ class ImageCaptionBiRunner(BaseRunner):
                             bw_predict_captions = bw_generator.beam_search(
                                 sess=sess, image_feature=image_feature)
                             caption_length = caption_lengths[idx]
-                            caption_text = b' '.join(caption_batch[idx][:caption_length]).decode('utf-8')
+                            caption_text = " ".join(self._get_sequence(caption_ids[idx], caption_length))
                             print("target_caption: {}".format(caption_text))
                             print("forward:----------------------------------------")
                             for idx,caption in enumerate(fw_predict_captions):
@@ -293,12 +300,8 @@ class ImageCaptionBiRunner(BaseRunner):
                 while True:  # train each batch in a epoch
                     try:
                         batch_data = sess.run(model.next_batch)
-                        (id_batch, width_batch, height_batch, depth_batch, feature_batch,
-                         bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features,
-                         caption_batch, fw_target_batch, bw_target_batch,
-                         caption_ids, fw_target_ids, bw_target_ids,
-                         caption_lengths, fw_target_lengths, bw_target_lengths) = batch_data
-                        for idx, image_id in enumerate(id_batch):  # for each image
+                        feature_batch = batch_data['image_feature']
+                        for idx, image_id in enumerate(batch_data['image_id']):  # for each image
                             image_feature = feature_batch[idx].reshape(1, -1)
                             predict_caption_ids = self._decode_fw_greedy(
                                 model=model, sess=sess, image_feature=image_feature)
@@ -353,13 +356,8 @@ class ImageCaptionBiRunner(BaseRunner):
                 try:
                     batch_data = sess.run(model.next_batch)
 
-                    (id_batch, width_batch, height_batch, depth_batch, feature_batch,
-                     bbox_shape_batch, bbox_num, bbox_labels, bboxes, bbox_features,
-                     caption_batch, fw_target_batch, bw_target_batch,
-                     caption_ids, fw_target_ids, bw_target_ids,
-                     caption_lengths, fw_target_lengths, bw_target_lengths) = batch_data
-
-                    for idx, image_id in enumerate(id_batch):  # for each image
+                    feature_batch = batch_data['image_feature']
+                    for idx, image_id in enumerate(batch_data['image_id']):  # for each image
                         image_feature = feature_batch[idx].reshape(1, -1)
                         predict_caption_ids = self._decode_bw_greedy(
                             model=model, sess=sess, image_feature=image_feature)
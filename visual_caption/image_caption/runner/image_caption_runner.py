@@ -28,6 +28,8 @@ class ImageCaptionRunner(BaseRunner):
         self.data_config = ImageCaptionDataConfig()
         self.data_config.reader_batch_size = 100
         self.data_reader = ImageCaptionDataReader(data_config=self.data_config)
+        # models are built with the dim of visual features in the tfrecords, projected ones are smaller
+        self.data_config.dim_visual_feature = self.data_reader.get_dim_visual_feature()
         self.model_config = ImageCaptionModelConfig(
             data_config=self.data_config, model_name=self.data_config.model_name)
 
@@ -60,16 +62,21 @@ class ImageCaptionRunner(BaseRunner):
                 sess.run(init_op)
             sess.run(tf.tables_initializer())
             train_init_op = self.data_reader.get_train_init_op()
+            # resume training data from the position saved with the checkpoint
+            start_epoch, start_batch = model.restore_input_state()
             begin = time.time()
             # running the first internal evaluation
             global_step = tf.train.global_step(sess, model.global_step_tensor)
             max_acc = 0.0
             if global_step > 0:
                 max_acc = self._internal_eval(model=model, sess=sess)
-            for epoch in range(model.model_config.max_max_epoch):
-                sess.run(train_init_op)  # initial train data options
+            for epoch in range(start_epoch, model.model_config.max_max_epoch):
+                skip_batches = start_batch if epoch == start_epoch else 0
+                sess.run(train_init_op,  # initial train data options
+                         feed_dict=self.data_reader.get_train_feed_dict(
+                             epoch=epoch, skip_batches=skip_batches))
                 step_begin = time.time()
-                batch = 0
+                batch = skip_batches
                 while True:  # train each batch in a epoch
                     try:
                         result_batch = sess.run(fetches)  # run training step
@@ -96,10 +103,13 @@ class ImageCaptionRunner(BaseRunner):
                                 global_step = tf.train.global_step(sess, model.global_step_tensor)
                                 model.logger.info("finished validation in training step {}"
                                                   .format(global_step))
+                            # evaluation switched the data iterator to valid data, continue the epoch
+                            sess.run(self.data_reader.get_train_switch_op())
                             valid_acc = valid_result
                             if valid_acc > max_acc:  # save the best model session
                                 max_acc = valid_acc
-                                model.save_model(sess=sess, global_step=global_step)
+                                model.save_model(sess=sess, global_step=global_step,
+                                                 epoch=epoch, batch=batch)
                                 print('training: epoch={}, step={}, validation: average_result ={}'
                                       .format(epoch, global_step, valid_result))
                             print("training epoch={} finished with {} batches, global_step={}, elapsed={:.4f} "
@@ -115,7 +125,8 @@ class ImageCaptionRunner(BaseRunner):
                         valid_acc = valid_result
                         if valid_acc > max_acc:  # save the best model session
                             max_acc = valid_acc
-                            model.save_model(sess=sess, global_step=global_step)
+                            model.save_model(sess=sess, global_step=global_step,
+                                             epoch=epoch + 1, batch=0)
                             print('training: epoch={}, step={}, validation: average_result ={}'
                                   .format(epoch, global_step, valid_result))
                         print("training epoch={} finished with {} batches, global_step={}, elapsed={:.4f} "
@@ -134,7 +145,7 @@ class ImageCaptionRunner(BaseRunner):
         fetches = [model.accuracy, model.loss, model.summary_merged]
         batch_count = 0
         eval_acc = 0.0
-        validation_init_op = self.data_reader.get_valid_init_op()
+        validation_init_op = self.data_reader.get_valid_init_op(cached=True)
         # initialize validation dataset
         sess.run(validation_init_op)
         step_begin = time.time()
@@ -151,8 +162,6 @@ class ImageCaptionRunner(BaseRunner):
                     print("valid: step={0:8d}, batch={1} loss={2:.4f}, acc={3:.4f}, elapsed={4:.4f}"
                           .format(global_step, batch_count, loss, acc, time.time() - step_begin))
                     step_begin = time.time()
-                if batch_count >= 100:
-                    break
             except tf.errors.OutOfRangeError:  # ==> "End of validation dataset"
                 print("_internal_eval finished : step={0}, batch={1}, elapsed={2:.4f}"
                       .format(global_step, batch_count, time.time() - step_begin))
@@ -194,12 +203,8 @@ class ImageCaptionRunner(BaseRunner):
                 while True:  # train each batch in a epoch
                     try:
                         batch_data = sess.run(model.next_batch)
-                        (image_id_batch, width_batch, height_batch, depth_batch, image_feature_batch,  # for image
-                         bbox_shape_batch, bbox_num_batch, bbox_labels, bboxes, bbox_features,  # for bbox
-                         caption_batch, fw_target_batch, bw_target_batch,  # for text
-                         caption_ids, fw_target_ids, bw_target_ids,  # for ids
-                         input_lengths, fw_target_lengths, bw_target_lengths) = batch_data
-                        for idx, image_id in enumerate(image_id_batch):  # for each image
+                        image_feature_batch = batch_data['image_feature']
+                        for idx, image_id in enumerate(batch_data['image_id']):  # for each image
                             image_feature = image_feature_batch[idx].reshape(1, -1)
                             # region_features = bbox_features[idx].reshape(1, 36, -1)
                             print("image_id={}".format(image_id))
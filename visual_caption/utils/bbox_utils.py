@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# numpy operations on arrays of boxes [N, 4] in (min_0, min_1, max_0, max_1) order
+import numpy as np
+
+
+def box_areas(boxes):
+    return np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+
+
+def box_ious(box, boxes):
+    """
+    :return: intersection over union between one box and each of boxes
+    """
+    min_0 = np.maximum(box[0], boxes[:, 0])
+    min_1 = np.maximum(box[1], boxes[:, 1])
+    max_0 = np.minimum(box[2], boxes[:, 2])
+    max_1 = np.minimum(box[3], boxes[:, 3])
+    intersections = np.maximum(max_0 - min_0, 0) * np.maximum(max_1 - min_1, 0)
+    unions = box_areas(box[np.newaxis, :]) + box_areas(boxes) - intersections
+    return intersections / np.maximum(unions, 1e-10)
+
+
+def non_max_suppression(boxes, scores, iou_threshold, max_output=None):
+    """
+    class agnostic greedy non maximum suppression
+    :param boxes: float or int array [N, 4]
+    :param scores: array [N]
+    :param iou_threshold: boxes overlapping a kept box with higher score above it are removed
+    :param max_output: stop after max_output boxes are kept, None for no limit
+    :return: indices of kept boxes in descending order of score
+    """
+    order = np.argsort(-scores, kind='mergesort')
+    boxes = boxes.astype(np.float32)
+    keep = list()
+    while order.size > 0:
+        index = order[0]
+        keep.append(index)
+        if max_output is not None and len(keep) >= max_output:
+            break
+        ious = box_ious(boxes[index], boxes[order[1:]])
+        order = order[1:][ious <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def get_padded_boxes(boxes, image_size, padded_size):
+    """
+    boxes normalized to [0, 1] of an image of image_size mapped to the image zero padded at the bottom
+    and right to padded_size, crop_and_resize maps normalized y to y * (height - 1),
+    so boxes are scaled by (size - 1) / (padded_size - 1)
+    :param boxes: float array [N, 4]
+    :param image_size: (height, width)
+    :return: float32 array [N, 4]
+    """
+    scales = [(size - 1) / max(padded - 1, 1) for size, padded in zip(image_size, padded_size)]
+    return np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * np.asarray(scales * 2, dtype=np.float32)
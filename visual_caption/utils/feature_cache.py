@@ -0,0 +1,271 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Persistent cache of detections and features keyed by image content, model and preprocessing params
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+
+import numpy as np
+
+from visual_caption.utils import image_source, jsonl_utils
+
+SEGMENT_SUFFIX = ".seg"  # npz bytes of entries appended one after another
+INDEX_SUFFIX = ".idx"  # json lines of key, offset and size of the entries of a segment
+
+
+def get_bytes_hash(data):
+    """sha1 of encoded image bytes, the same image under another name or source has the same hash"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_content_hash(file_path):
+    """sha1 of the bytes of file_path, it may be a path inside an image source like archive.zip/name.jpg"""
+    return get_bytes_hash(image_source.read_image_file(file_path))
+
+
+def get_model_id(model_path):
+    """
+    id of a model checkpoint from its name, size and modification time,
+    a retrained or replaced checkpoint gets a new id without hashing the whole file
+    """
+    if not os.path.isfile(model_path):
+        return os.path.basename(model_path)
+    stat = os.stat(model_path)
+    return "{}:{}:{}".format(os.path.basename(model_path), stat.st_size, int(stat.st_mtime))
+
+
+def make_key(kind, content_hash, model_id, params=None):
+    """
+    :param kind: kind of cached value, such as detection, image_feature or region_feature
+    :param params: json serializable preprocessing params the value depends on
+    :return: hex key of the cache entry
+    """
+    key_data = json.dumps([kind, content_hash, model_id, params], sort_keys=True, default=jsonl_utils._to_json)
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+
+class FeatureCache(object):
+    """
+    on-disk cache of dicts of numpy arrays shared by the processes of a build.
+    entries are appended as npz bytes to segment files of about segment_bytes, each process writes
+    its own segments with an index of json lines (key, offset, size) next to them, so the cache
+    is a few large files instead of one file per entry.
+    processes read the indexes of all segments and pick up new entries of other processes on misses.
+    the max_bytes budget is shared: the total size of all segments is read from the cache dir and
+    least recently used segments are removed until the cache is below 90% of max_bytes,
+    a removed segment of another process turns its entries into misses
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 << 30, segment_bytes=256 << 20, refresh_interval=30.0):
+        """
+        :param segment_bytes: size of segment files, the unit of eviction
+        :param refresh_interval: min seconds between reloads of the indexes of other processes on misses
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()  # entries are read from prefetcher threads
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0  # removed segments
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self._writer_id = "{}-{}".format(os.getpid(), uuid.uuid4().hex[:8])
+        self._num_segments = 0
+        self._segment = None  # name of the segment of this process in writing
+        self._segment_file = None
+        self._index_file = None
+        self._segment_size = 0
+
+        self._index = dict()  # key: (segment, offset, size)
+        self._index_offsets = dict()  # segment: bytes of its index file already loaded
+        self._segment_sizes = dict()  # segment: size in bytes
+        self._touched = dict()  # segment: last time its mtime was updated by a hit
+        self._refresh_time = 0.0
+        with self._lock:
+            self._refresh()
+
+    @property
+    def total_bytes(self):
+        return sum(self._segment_sizes.values())
+
+    def _get_path(self, segment, suffix):
+        return os.path.join(self.cache_dir, segment + suffix)
+
+    def _list_segments(self):
+        return [file_name[:-len(SEGMENT_SUFFIX)] for file_name in os.listdir(self.cache_dir)
+                if file_name.endswith(SEGMENT_SUFFIX)]
+
+    def _refresh(self):
+        """load new index lines of all segments and drop entries of removed segments, holding _lock"""
+        segments = set(self._list_segments())
+        for segment in list(self._index_offsets):
+            if segment not in segments:
+                self._drop_segment(segment)
+        for segment in segments:
+            try:
+                self._segment_sizes[segment] = os.path.getsize(self._get_path(segment, SEGMENT_SUFFIX))
+                self._load_index(segment)
+            except (IOError, OSError):  # removed by another process meanwhile
+                self._drop_segment(segment)
+        self._refresh_time = time.time()
+
+    def _load_index(self, segment):
+        offset = self._index_offsets.get(segment, 0)
+        with open(self._get_path(segment, INDEX_SUFFIX), mode='rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # an unfinished last line is loaded by a later refresh
+        for line in data[:end].splitlines():
+            record = json.loads(line.decode('utf-8'))
+            self._index[record["key"]] = (segment, record["offset"], record["size"])
+        self._index_offsets[segment] = offset + end
+
+    def _drop_segment(self, segment):
+        self._index_offsets.pop(segment, None)
+        self._segment_sizes.pop(segment, None)
+        self._touched.pop(segment, None)
+        for key in [key for key, location in self._index.items() if location[0] == segment]:
+            del self._index[key]
+
+    def get(self, key):
+        """
+        :return: dict of cached arrays of key, scalars are returned as python numbers, None on a miss
+        """
+        with self._lock:
+            location = self._index.get(key)
+            if location is None and time.time() - self._refresh_time > self.refresh_interval:
+                self._refresh()  # written by another process since the last refresh
+                location = self._index.get(key)
+            if location is None:
+                self.misses += 1
+                return None
+        (segment, offset, size) = location
+        try:
+            with open(self._get_path(segment, SEGMENT_SUFFIX), mode='rb') as f:
+                f.seek(offset)
+                data = f.read(size)
+            value = dict()
+            with np.load(io.BytesIO(data)) as entry:
+                for name in entry.files:
+                    array = entry[name]
+                    value[name] = array.item() if array.ndim == 0 else array
+        except (IOError, OSError, ValueError, zipfile.BadZipFile):
+            with self._lock:
+                self.misses += 1
+                if self._index.get(key) == location:  # segment removed by another process or truncated
+                    del self._index[key]
+            return None
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            touch = now - self._touched.get(segment, 0.0) > self.refresh_interval
+            if touch:
+                self._touched[segment] = now
+        if touch:
+            try:
+                os.utime(self._get_path(segment, SEGMENT_SUFFIX), (now, now))  # last access survives restarts
+            except OSError:
+                pass
+        return value
+
+    def put(self, key, value):
+        """
+        :param value: dict of numpy arrays or numbers
+        """
+        buffer = io.BytesIO()
+        np.savez(buffer, **value)
+        data = buffer.getvalue()
+        with self._lock:
+            if self._segment_file is None or self._segment_size >= self.segment_bytes:
+                self._open_segment()
+            offset = self._segment_size
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            # the index line is written after the entry, a reader never sees a partial entry
+            line = json.dumps({"key": key, "offset": offset, "size": len(data)}) + "\n"
+            self._index_file.write(line.encode('utf-8'))
+            self._index_file.flush()
+            self._segment_size += len(data)
+            self._segment_sizes[self._segment] = self._segment_size
+            self._index_offsets[self._segment] = self._index_offsets.get(self._segment, 0) + len(line)
+            self._index[key] = (self._segment, offset, len(data))
+            self.puts += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _open_segment(self):
+        self._close_segment()
+        self._segment = "{}-{:05d}".format(self._writer_id, self._num_segments)
+        self._num_segments += 1
+        self._segment_file = open(self._get_path(self._segment, SEGMENT_SUFFIX), mode='wb')
+        self._index_file = open(self._get_path(self._segment, INDEX_SUFFIX), mode='wb')
+        self._segment_size = 0
+        self._index_offsets[self._segment] = 0
+
+    def _close_segment(self):
+        for f in (self._segment_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._segment_file = None
+        self._index_file = None
+
+    def _evict(self):
+        """
+        remove least recently used segments of all processes until the cache is below 90% of max_bytes,
+        sizes and access times are read from the cache dir, holding _lock
+        """
+        self._refresh()
+        segments = list()
+        for segment in self._segment_sizes:
+            if segment == self._segment:  # the segment in writing is the most recent one
+                continue
+            try:
+                segments.append((os.path.getmtime(self._get_path(segment, SEGMENT_SUFFIX)), segment))
+            except OSError:
+                pass
+        target_bytes = int(self.max_bytes * 0.9)
+        for _, segment in sorted(segments):
+            if self.total_bytes <= target_bytes:
+                break
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(self._get_path(segment, suffix))
+                except OSError:  # removed by another process
+                    pass
+            self._drop_segment(segment)
+            self.evictions += 1
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def get_stats(self):
+        """
+        :return: dict of hits, misses, hit rate, puts, evicted segments, number of entries, segments and bytes
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "puts": self.puts,
+            "evictions": self.evictions,
+            "num_entries": len(self._index),
+            "num_segments": len(self._segment_sizes),
+            "total_bytes": self.total_bytes,
+        }
@@ -0,0 +1,48 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Storage dtypes of visual features in tfrecords
+"""
+features are l2 normalized, their values are small and within [-1, 1]:
+    float32: raw features
+    float16: half the bytes, relative error about 1e-3
+    int8: a quarter of the bytes, each vector is scaled by max(abs(vector)) / 127 and rounded,
+        the float32 scale of each vector is stored besides the int8 values
+"""
+import numpy as np
+
+FEATURE_DTYPES = ('float32', 'float16', 'int8')
+INT8_MAX = 127
+
+
+def check_feature_dtype(feature_dtype):
+    if feature_dtype not in FEATURE_DTYPES:
+        raise ValueError("Unknown feature dtype {}, expected one of {}".format(feature_dtype, FEATURE_DTYPES))
+
+
+def encode_features(features, feature_dtype):
+    """
+    :param features: float array [N, dim] or [dim]
+    :return: (encoded array of feature_dtype, float32 scales [N] or [1] of int8, None otherwise)
+    """
+    check_feature_dtype(feature_dtype)
+    features = np.asarray(features, dtype=np.float32)
+    if feature_dtype != 'int8':
+        return features.astype(feature_dtype), None
+    vectors = features.reshape(-1, features.shape[-1])
+    scales = np.max(np.abs(vectors), axis=1) / INT8_MAX
+    scales[scales == 0.0] = 1.0  # zero vectors stay zero
+    values = np.clip(np.rint(vectors / scales[:, np.newaxis]), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return values.reshape(features.shape), scales.astype(np.float32)
+
+
+def decode_features(values, scales=None):
+    """:return: float32 features of encode_features"""
+    features = np.asarray(values).astype(np.float32)
+    if scales is None:
+        return features
+    vectors = features.reshape(-1, features.shape[-1]) * np.asarray(scales, dtype=np.float32)[:, np.newaxis]
+    return vectors.reshape(features.shape)
@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Linear projection of visual features to fewer dimensions, fitted offline on a training sample
+"""
+features x of dim_in are projected to l2_normalize((x - mean) . matrix) of dim_out,
+pca keeps the directions of largest variance of the sample,
+random projection is a scaled gaussian matrix, which needs no fitting beyond dim_in
+"""
+import numpy as np
+
+PROJECTION_METHODS = ('pca', 'random')
+
+
+def fit_projection(features, dim, method='pca', seed=0):
+    """
+    :param features: float array [N, dim_in] of image and bbox features sampled from the training data
+    :param dim: dim_out of projected features
+    :return: dict of method, mean [dim_in], matrix [dim_in, dim] and explained_variance of pca
+    """
+    features = np.asarray(features, dtype=np.float64)
+    dim_in = features.shape[1]
+    if dim > dim_in:
+        raise ValueError("projection dim {} is larger than feature dim {}".format(dim, dim_in))
+    if method == 'pca':
+        # eigenvectors of the dim_in x dim_in covariance, cheaper than svd of a large sample
+        mean = np.mean(features, axis=0)
+        centered = features - mean
+        covariance = np.dot(centered.T, centered) / max(len(features) - 1, 1)
+        eigen_values, eigen_vectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigen_values)[::-1]
+        matrix = eigen_vectors[:, order[:dim]]
+        explained_variance = float(np.sum(eigen_values[order[:dim]]) / max(np.sum(eigen_values), 1e-12))
+    elif method == 'random':
+        rng = np.random.RandomState(seed)
+        mean = np.zeros(dim_in)
+        matrix = rng.normal(size=(dim_in, dim)) / np.sqrt(dim)
+        explained_variance = None
+    else:
+        raise ValueError("Unknown projection method {}, expected one of {}".format(method, PROJECTION_METHODS))
+    return {"method": method, "mean": mean.astype(np.float32), "matrix": matrix.astype(np.float32),
+            "explained_variance": explained_variance}
+
+
+def project(features, projection):
+    """
+    :param features: float array [N, dim_in] or [dim_in]
+    :return: float32 l2 normalized features [N, dim_out] or [dim_out]
+    """
+    projected = np.dot(np.asarray(features, dtype=np.float32) - projection["mean"], projection["matrix"])
+    norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+    return (projected / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def get_projection_info(projection):
+    """:return: json serializable description of projection for manifests"""
+    (dim_in, dim_out) = projection["matrix"].shape
+    return {"method": str(projection["method"]), "dim_in": int(dim_in), "dim_out": int(dim_out),
+            "explained_variance": projection["explained_variance"]}
+
+
+def save_projection(projection, projection_file):
+    with open(projection_file, mode='wb') as f:
+        np.savez(f, method=projection["method"], mean=projection["mean"], matrix=projection["matrix"],
+                 explained_variance=np.nan if projection["explained_variance"] is None
+                 else projection["explained_variance"])
+
+
+def load_projection(projection_file):
+    with np.load(projection_file) as data:
+        explained_variance = float(data["explained_variance"])
+        return {"method": str(data["method"]), "mean": data["mean"], "matrix": data["matrix"],
+                "explained_variance": None if np.isnan(explained_variance) else explained_variance}
@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Background image decoding overlapped with session runs
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from visual_caption.utils import image_utils
+
+_END = object()  # end of items marker in the queue
+
+
+class ImagePrefetcher(object):
+    """
+    decode images of items with a pool of threads into a bounded queue,
+    the consumer iterates (item, image) in the order of items while the next images are decoded.
+    image decoding of PIL releases the GIL, so threads decode in parallel with sess.run
+
+    usage:
+        with ImagePrefetcher(image_files) as prefetcher:
+            for image_file, image in prefetcher:
+                ...
+    """
+
+    def __init__(self, items, load_fn=None, num_threads=4, queue_size=32):
+        """
+        :param items: iterable of items, such as image paths, it is read by a background thread
+        :param load_fn: function of an item to its image, image_utils.load_image if None
+        :param num_threads: number of decoding threads
+        :param queue_size: max number of images decoded or in decoding ahead of the consumer
+        """
+        self._items = items
+        self._load_fn = load_fn or image_utils.load_image
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._stop_event = threading.Event()
+
+        # counters
+        self.num_images = 0
+        self.consumer_wait_time = 0.0  # time the consumer waited for decoded images
+        self.producer_wait_time = 0.0  # time the producer waited for a free queue slot
+
+        self._producer = threading.Thread(target=self._produce, name="image_prefetcher")
+        self._producer.daemon = True
+        self._producer.start()
+
+    def _put(self, entry):
+        """put entry into the queue unless the prefetcher is closed, return whether it is put"""
+        begin = time.time()
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                self.producer_wait_time += time.time() - begin
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._items:
+                future = self._executor.submit(self._load_fn, item)
+                if not self._put((item, future)):
+                    return
+        except Exception as e:  # errors of reading items are raised in the consumer
+            self._put((_END, e))
+            return
+        self._put((_END, None))
+
+    def __iter__(self):
+        while True:
+            begin = time.time()
+            item, future = self._queue.get()
+            if item is _END:
+                self.consumer_wait_time += time.time() - begin
+                if future is not None:
+                    raise future
+                return
+            image = future.result()
+            self.consumer_wait_time += time.time() - begin
+            self.num_images += 1
+            yield item, image
+
+    def get_stats(self):
+        """
+        :return: dict of number of consumed images, current queue depth and wait times in seconds
+        """
+        return {
+            "num_images": self.num_images,
+            "queue_depth": self._queue.qsize(),
+            "consumer_wait_time": self.consumer_wait_time,
+            "producer_wait_time": self.producer_wait_time,
+        }
+
+    def close(self):
+        self._stop_event.set()
+        while True:  # unblock the producer
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._producer.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
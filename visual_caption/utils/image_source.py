@@ -0,0 +1,266 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# Image sources: a directory, the zip/tar of the original distribution or repacked blob shards
+"""
+images are addressed by file name inside a source, an image file path like
+    ~/data/caption_train_images_20170902.zip/0a0b1c.jpg
+is read from the zip archive without extracting it, the same holds for .tar files
+and blob dirs packed by pack_blob_shards, plain paths are read from the file system
+"""
+import io
+import os
+import tarfile
+import threading
+import zipfile
+
+from visual_caption.utils import jsonl_utils
+
+BLOB_INDEX_FILE_NAME = "index.jsonl"
+BLOB_SUFFIX = ".blob"
+
+
+class ImageSource(object):
+    """
+    base of image sources, images are read as encoded bytes by file name
+    """
+
+    def list_names(self):
+        """:return: list of image file names in storage order"""
+        raise NotImplementedError()
+
+    def read(self, name):
+        """:return: encoded bytes of image name, KeyError if it is not in the source"""
+        raise NotImplementedError()
+
+    def iter_items(self):
+        """yield (name, bytes) of all images with sequential reads in storage order"""
+        for name in self.list_names():
+            yield name, self.read(name)
+
+    def __contains__(self, name):
+        return name in set(self.list_names())
+
+    def close(self):
+        pass
+
+
+class DirImageSource(ImageSource):
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+
+    def list_names(self):
+        return sorted(os.listdir(self.image_dir))
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.image_dir, name), mode='rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return os.path.isfile(os.path.join(self.image_dir, name))
+
+
+class _IndexedImageSource(ImageSource):
+    """source with an index of name to (file, offset, size), read by pread of cached file descriptors"""
+
+    def __init__(self):
+        self._index = dict()  # name: (file path, offset, size)
+        self._names = list()
+        self._fds = dict()
+        self._lock = threading.Lock()
+
+    def _add(self, name, file_path, offset, size):
+        if name not in self._index:
+            self._names.append(name)
+        self._index[name] = (file_path, offset, size)
+
+    def _get_fd(self, file_path):
+        with self._lock:
+            if file_path not in self._fds:
+                self._fds[file_path] = os.open(file_path, os.O_RDONLY)
+            return self._fds[file_path]
+
+    def list_names(self):
+        return list(self._names)
+
+    def read(self, name):
+        (file_path, offset, size) = self._index[name]
+        return os.pread(self._get_fd(file_path), size, offset)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = dict()
+
+
+class ZipImageSource(ImageSource):
+    """images of a zip archive indexed by file name from its central directory"""
+
+    def __init__(self, zip_file):
+        self.zip_file = zip_file
+        self._zip = zipfile.ZipFile(zip_file, mode='r')
+        infos = [info for info in self._zip.infolist() if not info.filename.endswith('/')]
+        infos.sort(key=lambda info: info.header_offset)
+        self._infos = {os.path.basename(info.filename): info for info in infos}
+        self._names = [os.path.basename(info.filename) for info in infos]
+
+    def list_names(self):
+        return list(self._names)
+
+    def read(self, name):
+        # zip members are read through a shared file handle with a lock, safe for prefetcher threads
+        return self._zip.read(self._infos[name])
+
+    def __contains__(self, name):
+        return name in self._infos
+
+    def close(self):
+        self._zip.close()
+
+
+class TarImageSource(_IndexedImageSource):
+    """
+    images of an uncompressed tar archive, member headers are scanned once for the index,
+    compressed tars have no random access and should be repacked by pack_blob_shards
+    """
+
+    def __init__(self, tar_file):
+        super(TarImageSource, self).__init__()
+        self.tar_file = tar_file
+        with tarfile.open(tar_file, mode='r:') as tar:
+            for member in tar:
+                if member.isfile():
+                    self._add(os.path.basename(member.name), tar_file, member.offset_data, member.size)
+
+
+class CompressedTarImageSource(ImageSource):
+    """
+    images of a compressed tar (.tar.gz, .tar.bz2, ...) which is only read as a stream,
+    iter_items serves pack_blob_shards, random reads are not supported
+    """
+
+    def __init__(self, tar_file):
+        self.tar_file = tar_file
+
+    def list_names(self):
+        with tarfile.open(self.tar_file, mode='r|*') as tar:
+            return [os.path.basename(member.name) for member in tar if member.isfile()]
+
+    def read(self, name):
+        raise ValueError("compressed tar {} has no random access, repack it by image_packer "
+                         "(pack_blob_shards) or extract it".format(self.tar_file))
+
+    def iter_items(self):
+        with tarfile.open(self.tar_file, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    yield os.path.basename(member.name), tar.extractfile(member).read()
+
+    def __contains__(self, name):
+        return name in set(self.list_names())
+
+
+class BlobImageSource(_IndexedImageSource):
+    """images of blob shards packed by pack_blob_shards, indexed by index.jsonl"""
+
+    def __init__(self, blob_dir):
+        super(BlobImageSource, self).__init__()
+        self.blob_dir = blob_dir
+        for record in jsonl_utils.load_jsonl_generator(os.path.join(blob_dir, BLOB_INDEX_FILE_NAME)):
+            self._add(record["name"], os.path.join(blob_dir, record["shard"]), record["offset"], record["size"])
+
+
+def is_blob_dir(path):
+    return os.path.isfile(os.path.join(path, BLOB_INDEX_FILE_NAME))
+
+
+def get_image_source(path):
+    """
+    :param path: image dir, zip file, tar file or blob dir, compressed tars are only read sequentially
+    """
+    if is_blob_dir(path):
+        return BlobImageSource(path)
+    if os.path.isdir(path):
+        return DirImageSource(path)
+    if zipfile.is_zipfile(path):
+        return ZipImageSource(path)
+    if tarfile.is_tarfile(path):
+        try:
+            return TarImageSource(path)
+        except tarfile.ReadError:  # compressed, is_tarfile accepts them but they can't be opened with 'r:'
+            return CompressedTarImageSource(path)
+    raise ValueError("unknown image source {}".format(path))
+
+
+_sources = dict()
+_sources_lock = threading.Lock()
+
+
+def _get_cached_source(source_path):
+    """sources are opened once for each process"""
+    with _sources_lock:
+        if source_path not in _sources:
+            _sources[source_path] = get_image_source(source_path)
+        return _sources[source_path]
+
+
+def read_image_file(image_file):
+    """
+    :param image_file: file path, or a path inside an image source like archive.zip/name.jpg
+    :return: encoded bytes of the image
+    """
+    (source_path, name) = os.path.split(str(image_file))
+    if source_path not in _sources and os.path.isfile(image_file):
+        with open(image_file, mode='rb') as f:
+            return f.read()
+    return _get_cached_source(source_path).read(name)
+
+
+def open_image_file(image_file):
+    """:return: file object of the image for decoders"""
+    return io.BytesIO(read_image_file(image_file))
+
+
+def pack_blob_shards(source, blob_dir, shard_bytes=1 << 30):
+    """
+    repack images of source into blob shards of about shard_bytes with sequential reads and writes,
+    index.jsonl of name, shard, offset and size is written last
+    :return: number of images
+    """
+    if not os.path.isdir(blob_dir):
+        os.makedirs(blob_dir)
+    index_file = os.path.join(blob_dir, BLOB_INDEX_FILE_NAME)
+    tmp_index_file = index_file + ".tmp"
+    if os.path.isfile(tmp_index_file):  # left by an interrupted run, the shards are rewritten
+        os.remove(tmp_index_file)
+    shard_index = 0
+    shard_file = None
+    offset = 0
+    count = 0
+    with jsonl_utils.JsonLinesWriter(tmp_index_file, flush_every=1000) as index_writer:
+        for name, data in source.iter_items():
+            if shard_file is None or offset >= shard_bytes:
+                if shard_file is not None:
+                    shard_file.close()
+                shard_name = "images-{:05d}{}".format(shard_index, BLOB_SUFFIX)
+                shard_file = open(os.path.join(blob_dir, shard_name), mode='wb')
+                shard_index += 1
+                offset = 0
+            shard_file.write(data)
+            index_writer.write({"name": name, "shard": shard_name, "offset": offset, "size": len(data)})
+            offset += len(data)
+            count += 1
+    if shard_file is not None:
+        shard_file.close()
+    os.rename(tmp_index_file, index_file)
+    return count
@@ -5,16 +5,70 @@ from __future__ import print_function
 from __future__ import unicode_literals  # compatible with python3 unicode coding
 
 import numpy as np
-import skimage.color
-import skimage.io
+from PIL import Image
 
+from visual_caption.utils import image_source
 
-def load_image(image_path):
-    current_image = skimage.io.imread(image_path)
-    # this is to convert a gray to RGB image
-    if len(current_image.shape) == 2 or current_image.shape[2] == 1:
-        current_image = skimage.color.gray2rgb(current_image)  #
-    return current_image
+
+def _draft_scale(image, min_size):
+    """
+    let the jpeg decoder scale the DCT blocks down (1/2, 1/4 or 1/8) as far as
+    the shorter side stays at least min_size, other formats are decoded at full size
+    """
+    (width, height) = image.size
+    scale = min_size / min(width, height)
+    if scale < 1:
+        image.draft('RGB', (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+
+
+def _open_image(image_path):
+    """image_path is a file object, a file path or a path inside an image source like archive.zip/name.jpg"""
+    if hasattr(image_path, 'read'):
+        return Image.open(image_path)
+    return Image.open(image_source.open_image_file(image_path))
+
+
+def decode_image(image_path, min_size=None):
+    """
+    decode image_path into a uint8 RGB array [height, width, 3], gray and palette images are
+    converted to RGB by the decoder
+    :param min_size: if not None, jpeg images are decoded at reduced scale with the shorter side >= min_size
+    :return: (image array, (height, width, 3) of the image at full size)
+    """
+    with _open_image(image_path) as image:
+        original_shape = (image.size[1], image.size[0], 3)
+        if min_size is not None:
+            _draft_scale(image, min_size)
+        image = image.convert('RGB')
+        return np.asarray(image), original_shape
+
+
+def load_image(image_path, min_size=None):
+    return decode_image(image_path, min_size=min_size)[0]
+
+
+def load_resized_image(image_path, size):
+    """
+    decode image_path close to size by jpeg DCT scaling and resize it in uint8
+    :param size: (height, width) of the result
+    """
+    with _open_image(image_path) as image:
+        _draft_scale(image, max(size))
+        image = image.convert('RGB')
+        if image.size != (size[1], size[0]):
+            image = image.resize((size[1], size[0]), Image.BILINEAR)
+        return np.asarray(image)
+
+
+def resize_image(image_np, size):
+    """
+    bilinear resize of a uint8 image array in uint8
+    :param size: (height, width) of the result
+    """
+    if image_np.shape[:2] == tuple(size[:2]):
+        return image_np
+    image = Image.fromarray(image_np[:, :, :3])
+    return np.asarray(image.resize((size[1], size[0]), Image.BILINEAR))
 
 
 def get_image_name(image_path):
@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+# JSON Lines files: one json record per line, appended as records are produced
+import heapq
+import json
+import os
+
+import numpy as np
+
+JSONL_SUFFIX = ".jsonl"
+
+
+def _to_json(value):
+    """numpy arrays and scalars of records are written as json lists and numbers"""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+
+def is_jsonl_file(file_path):
+    return str(file_path).endswith(JSONL_SUFFIX)
+
+
+def truncate_partial_line(file_path, block_size=1 << 16):
+    """
+    drop the unfinished last line of file_path left by an interrupted writer
+    :return: number of bytes dropped
+    """
+    if not os.path.isfile(file_path):
+        return 0
+    with open(file_path, mode='rb+') as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        end = file_size
+        while end > 0:
+            begin = max(0, end - block_size)
+            f.seek(begin)
+            block = f.read(end - begin)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                end = begin + newline + 1
+                break
+            end = begin
+        f.truncate(end)
+    return file_size - end
+
+
+def load_jsonl_generator(file_path, start=0):
+    """
+    yield records of file_path in streaming fashion, an unfinished last line is skipped
+    :param start: index of the first record, earlier lines are skipped without json decoding
+    """
+    with open(file_path, mode='rb') as f:
+        for idx, line in enumerate(f):
+            if not line.endswith(b'\n'):
+                break
+            if idx < start:
+                continue
+            yield json.loads(line.decode('utf-8'))
+
+
+def count_jsonl_records(file_path):
+    count = 0
+    with open(file_path, mode='rb') as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                count += 1
+    return count
+
+
+def load_jsonl_keys(file_path, key):
+    """
+    :return: set of record[key] of all records in file_path, empty if it doesn't exist
+    """
+    if not os.path.isfile(file_path):
+        return set()
+    return set(record[key] for record in load_jsonl_generator(file_path))
+
+
+def _load_keyed_lines(f, sort_key):
+    """yield (sort_key(record), line) of the finished lines of f"""
+    for line in f:
+        if line.endswith(b'\n'):
+            yield sort_key(json.loads(line.decode('utf-8'))), line
+
+
+def merge_jsonl_files(part_files, target_file, block_size=1 << 20, sort_key=None):
+    """
+    append records of part_files to target_file in order and remove the part files,
+    unfinished last lines are dropped, the merged file is written to a temp file and renamed
+    :param sort_key: function of a record to its input index, if not None, records of target_file
+        and part_files, each sorted by it, are merged in its order, so the records a resumed
+        target_file already holds and the records of new parts interleave in input order
+    """
+    source_files = [source_file for source_file in [target_file] + list(part_files) if os.path.isfile(source_file)]
+    for source_file in source_files:
+        truncate_partial_line(source_file)
+    tmp_file = target_file + ".tmp"
+    with open(tmp_file, mode='wb') as f_target:
+        if sort_key is None:
+            for source_file in source_files:
+                with open(source_file, mode='rb') as f_source:
+                    for block in iter(lambda: f_source.read(block_size), b''):
+                        f_target.write(block)
+        else:
+            source_fs = [open(source_file, mode='rb') for source_file in source_files]
+            try:
+                # streaming merge, one line of each file is held in memory
+                for _, line in heapq.merge(*[_load_keyed_lines(f, sort_key) for f in source_fs],
+                                           key=lambda keyed_line: keyed_line[0]):
+                    f_target.write(line)
+            finally:
+                for f in source_fs:
+                    f.close()
+        f_target.flush()
+        os.fsync(f_target.fileno())
+    os.rename(tmp_file, target_file)
+    for part_file in part_files:
+        if os.path.isfile(part_file):
+            os.remove(part_file)
+
+
+class JsonLinesWriter(object):
+    """
+    append records to a JSON Lines file, the file is flushed to disk every flush_every records,
+    an unfinished last line of a previous run is dropped when it is opened
+    """
+
+    def __init__(self, file_path, flush_every=100):
+        self.file_path = file_path
+        self.flush_every = flush_every
+        file_dir = os.path.dirname(file_path)
+        if file_dir and not os.path.isdir(file_dir):
+            os.makedirs(file_dir)
+        dropped = truncate_partial_line(file_path)
+        if dropped > 0:
+            print("dropped an unfinished record of {} bytes from {}".format(dropped, file_path))
+        self._file = open(file_path, mode='ab')
+        self._pending = 0
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True, ensure_ascii=False, default=_to_json) + "\n"
+        self._file.write(line.encode('utf-8'))
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
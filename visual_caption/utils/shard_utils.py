@@ -0,0 +1,149 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals  # compatible with python3 unicode coding
+
+import hashlib
+import json
+import os
+
+MANIFEST_FILE_NAME = "manifest.json"
+SHARD_SUFFIX = ".tfrecords"
+TMP_SUFFIX = ".tmp"  # suffix of shards in writing
+DONE_SUFFIX = ".done"  # suffix of completion markers of finished shards
+
+
+def get_shard_name(prefix, shard_index, num_shards):
+    """
+    deterministic shard file name, such as train-00003-of-00064.tfrecords
+    """
+    return "{}-{:05d}-of-{:05d}{}".format(prefix, shard_index, num_shards, SHARD_SUFFIX)
+
+
+def get_part_file(file_path, shard_index, num_shards):
+    """
+    file of one shard of file_path which is merged into file_path later,
+    such as detect_train.jsonl.part-00003-of-00008
+    """
+    return "{}.part-{:05d}-of-{:05d}".format(file_path, shard_index, num_shards)
+
+
+def get_shard_ranges(num_items, num_shards):
+    """
+    split [0, num_items) into num_shards contiguous and disjoint ranges
+    :return: list of (shard_index, start, end), end is exclusive
+    """
+    shard_ranges = list()
+    for shard_index in range(num_shards):
+        start = shard_index * num_items // num_shards
+        end = (shard_index + 1) * num_items // num_shards
+        shard_ranges.append((shard_index, start, end))
+    return shard_ranges
+
+
+def get_worker_blocks(shard_ranges, num_workers):
+    """
+    split shard_ranges into num_workers contiguous blocks, so each worker reads
+    one contiguous range of the source data
+    :return: list of lists of shard ranges
+    """
+    blocks = list()
+    for worker_index in range(num_workers):
+        begin = worker_index * len(shard_ranges) // num_workers
+        end = (worker_index + 1) * len(shard_ranges) // num_workers
+        blocks.append(shard_ranges[begin:end])
+    return blocks
+
+
+def get_file_checksum(file_path, block_size=1 << 20):
+    """md5 checksum of file content, read in blocks"""
+    md5 = hashlib.md5()
+    with open(file_path, mode='rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_file_identity(file_path):
+    """
+    size and modification time of file_path, a rewritten or extended file gets another identity
+    without hashing its content, None if it doesn't exist
+    """
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return {"file": os.path.abspath(file_path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def get_shard_info(shard_file, num_records):
+    """summary of a finished shard used by the manifest"""
+    return {
+        "file": os.path.basename(shard_file),
+        "num_records": num_records,
+        "num_bytes": os.path.getsize(shard_file),
+        "md5": get_file_checksum(shard_file),
+    }
+
+
+def finalize_file(tmp_file, target_file):
+    """atomically move a finished temp file to its final name"""
+    os.rename(tmp_file, target_file)
+
+
+def write_done_marker(shard_file, shard_info, build_params=None):
+    """
+    mark shard_file as finished, the marker keeps its shard info for the manifest
+    :param build_params: json serializable params the content of the shard depends on
+    """
+    marker_file = shard_file + DONE_SUFFIX
+    tmp_file = marker_file + TMP_SUFFIX
+    with open(tmp_file, mode='w') as f:
+        json.dump(dict(shard_info, build_params=build_params), f, sort_keys=True)
+    finalize_file(tmp_file, marker_file)
+
+
+def load_done_marker(shard_file, build_params=None):
+    """
+    :param build_params: params of the current build, a shard built with other params is unfinished
+    :return: shard info if shard_file is finished, otherwise None
+    """
+    marker_file = shard_file + DONE_SUFFIX
+    if not (os.path.isfile(marker_file) and os.path.isfile(shard_file)):
+        return None
+    with open(marker_file, mode='r') as f:
+        shard_info = json.load(f)
+    if shard_info.get("num_bytes") != os.path.getsize(shard_file):
+        return None
+    # round trip through json, so tuples and lists compare equal
+    if shard_info.pop("build_params", None) != json.loads(json.dumps(build_params, sort_keys=True)):
+        return None
+    return shard_info
+
+
+def write_manifest(output_dir, shard_infos, **kwargs):
+    """
+    write manifest.json into output_dir with per-shard record counts, byte sizes and checksums
+    :param shard_infos: list of dict from get_shard_info
+    :param kwargs: extra build information, such as data_mode
+    :return: manifest file path
+    """
+    shard_infos = sorted(shard_infos, key=lambda info: info["file"])
+    manifest = dict(kwargs)
+    manifest["num_shards"] = len(shard_infos)
+    manifest["num_records"] = sum(info["num_records"] for info in shard_infos)
+    manifest["num_bytes"] = sum(info["num_bytes"] for info in shard_infos)
+    manifest["shards"] = shard_infos
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    with open(manifest_file, mode='w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest_file
+
+
+def load_manifest(data_dir):
+    """load manifest.json from data_dir, return None if not exist"""
+    manifest_file = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, mode='r') as f:
+        return json.load(f)